@@ -0,0 +1,361 @@
+# ASR Handler
+# vosk is imported where recognizers are built, so WakeMatcher works without it
+from settings import *
+from collections import deque
+from multiprocessing import shared_memory
+from audio_handler import RingBuffer
+import multiprocessing
+import signal
+import queue
+import numpy as np
+
+class WakeMatcher:
+    """
+    Token-level wake phrase matcher built once from CALL_WORDS and NAME.
+    A call word only counts when it is a whole word directly followed by the name,
+    so short call words like "a" or "he" no longer match inside other words.
+    """
+    def __init__(self, name=NAME, call_words=CALL_WORDS):
+        self.name = name.lower()
+        self.phrases = sorted({' '.join(word.lower().split()) for word in call_words}, key=len, reverse=True)
+        self.pattern = re.compile(
+            r'(?:^| )(?:' + '|'.join(re.escape(phrase) for phrase in self.phrases) + r') '
+            + re.escape(self.name) + r'(?= |$)')
+
+    def match(self, text):
+        """
+        Looks for the wake phrase in an utterance.
+
+        Returns:
+            str: The text following the wake phrase (possibly empty), or None if not addressed.
+        """
+        text = ' '.join(text.lower().split())
+        match = self.pattern.search(text)
+        if match:
+            return text[match.end():].strip()
+
+        # "Blossom, <query>" also counts when at least two words follow the name
+        words = text.split(' ')
+        if words[0] == self.name and len(words) > 2:
+            return ' '.join(words[1:])
+        return None
+
+
+class SpeechRecognizer:
+    """
+    Single-stage recognition: one full-vocabulary recognizer decodes every chunk.
+    feed() turns recognizer output into ('wake', text) and ('final', text) events.
+    """
+    def __init__(self, model, rate, matcher, wake_on_partial=WAKE_ON_PARTIAL):
+        from vosk import KaldiRecognizer
+        self.recognizer = KaldiRecognizer(model, rate)
+        self.matcher = matcher
+        self.wake_on_partial = wake_on_partial
+        self.woken = False
+
+    def feed(self, data, counted=True):
+        """Decodes a chunk of PCM audio and returns the resulting events."""
+        if self.recognizer.AcceptWaveform(data):
+            self.woken = False
+            text = json.loads(self.recognizer.Result()).get('text', '').strip()
+            return [('final', text)] if text else []
+
+        if self.wake_on_partial and not self.woken:
+            partial = json.loads(self.recognizer.PartialResult()).get('partial', '')
+            if partial and self.matcher.match(partial) is not None:
+                self.woken = True
+                return [('wake', partial)]
+        return []
+
+    def skip(self, data):
+        """Single-stage recognition has no listening window, so a chunk the gate held back changes nothing."""
+        return []
+
+
+class TwoStageRecognizer:
+    """
+    Two-stage recognition to keep idle CPU low.
+    A small recognizer restricted by a Vosk grammar to the wake phrases listens all the time.
+    Once it hears a wake phrase, the full recognizer is fed the pre-roll ring buffer and then
+    live audio until the window has passed without speech, after which it goes idle again.
+    Grammars only take effect with models that support them (the small Vosk models).
+    """
+    def __init__(self, model, rate, matcher, window=WAKE_WINDOW_SECONDS, preroll=WAKE_PREROLL_CHUNKS):
+        from vosk import KaldiRecognizer
+        # the bare name covers "Blossom, <query>"; the full recognizer hears the rest
+        grammar = [f"{phrase} {matcher.name}" for phrase in matcher.phrases] + [matcher.name, "[unk]"]
+        self.wake = KaldiRecognizer(model, rate, json.dumps(grammar))
+        self.full = KaldiRecognizer(model, rate)
+        self.matcher = matcher
+        self.rate = rate
+        self.window = window
+        self.preroll = deque(maxlen=max(preroll, 1))
+        self.active = False
+        self.remaining = 0.0
+
+    def _heard_wake(self):
+        """Checks the wake recognizer's current hypothesis for a wake phrase."""
+        if self.wake.AcceptWaveform(self.preroll[-1]):
+            text = json.loads(self.wake.Result()).get('text', '')
+        else:
+            text = json.loads(self.wake.PartialResult()).get('partial', '')
+        text = ' '.join(text.replace('[unk]', ' ').split())
+        if not text:
+            return None
+        # the grammar can't hear the query after a bare name, so the name alone activates
+        if self.matcher.match(text) is not None or text.split(' ')[0] == self.matcher.name:
+            return text
+        return None
+
+    def _activate(self):
+        """Switches to the full recognizer, replaying the pre-roll so the first words are kept."""
+        self.active = True
+        self.full.Reset()
+        chunks = list(self.preroll)
+        self.preroll.clear()
+        events = []
+        for chunk in chunks:
+            events.extend(self._decode(chunk, 0))
+        self.remaining = self.window
+        return events
+
+    def _decode(self, data, elapsed):
+        """Feeds the full recognizer, counts elapsed seconds against the window and returns any final result."""
+        self.remaining -= elapsed
+        if self.full.AcceptWaveform(data):
+            text = json.loads(self.full.Result()).get('text', '').strip()
+            if text:
+                self.remaining = self.window
+                return [('final', text)]
+        return []
+
+    def _deactivate(self):
+        """Flushes the full recognizer and returns to wake listening."""
+        self.active = False
+        self.wake.Reset()
+        text = json.loads(self.full.FinalResult()).get('text', '').strip()
+        return [('final', text)] if text else []
+
+    def feed(self, data, counted=True):
+        """
+        Decodes a chunk of 16-bit mono PCM audio and returns the resulting events.
+        counted=False marks pre-roll released late by the voice activity gate, whose time skip() already counted.
+        """
+        if self.active:
+            events = self._decode(data, len(data) / 2 / self.rate if counted else 0)
+            if self.remaining <= 0:
+                events.extend(self._deactivate())
+            return events
+
+        self.preroll.append(data)
+        wake = self._heard_wake()
+        if wake is None:
+            return []
+        events = self._activate()
+        # a bare name only cues once the final result shows a query followed it
+        if self.matcher.match(wake) is not None:
+            events.insert(0, ('wake', wake))
+        return events
+
+
+    def skip(self, data):
+        """
+        Counts a chunk the voice activity gate held back towards the window, so silence
+        ends it just like decoded audio does, and returns any final result on going idle.
+        """
+        if not self.active:
+            return []
+        self.remaining -= len(data) / 2 / self.rate
+        return self._deactivate() if self.remaining <= 0 else []
+
+
+class VoiceActivityGate:
+    """
+    Energy and zero-crossing-rate voice activity gate in front of the recognizer.
+    Each chunk is split into short frames and scored with NumPy against an adaptive
+    noise floor. Silent chunks are held back in a small pre-roll buffer instead of
+    being decoded; when speech starts the pre-roll is released first, and a hangover
+    keeps passing chunks after speech so the recognizer can still end the utterance.
+    """
+    def __init__(self, rate=SAMPLING_RATE, frame_ms=VAD_FRAME_MS, margin_db=VAD_MARGIN_DB,
+                 max_zcr=VAD_MAX_ZCR, hangover=VAD_HANGOVER_CHUNKS, preroll=VAD_PREROLL_CHUNKS):
+        self.frame = max(int(rate * frame_ms / 1000), 1)
+        self.margin_db = margin_db
+        self.max_zcr = max_zcr
+        self.hangover = hangover
+        self.preroll = deque(maxlen=max(preroll, 1))
+        self.noise_db = None
+        self.remaining = 0
+        self.chunks_seen = 0
+        self.chunks_decoded = 0
+
+    def is_speech(self, data):
+        """Scores a chunk of 16-bit mono PCM and updates the noise floor on silence."""
+        samples = np.frombuffer(data, dtype='<i2').astype(np.float32)
+        count = len(samples) // self.frame
+        if count == 0:
+            return False
+        frames = samples[:count * self.frame].reshape(count, self.frame)
+
+        energy_db = 10 * np.log10(np.mean(frames ** 2, axis=1) + 1e-3)
+        signs = np.signbit(frames)
+        zcr = np.mean(signs[:, 1:] != signs[:, :-1], axis=1)
+
+        if self.noise_db is None:
+            self.noise_db = float(np.percentile(energy_db, 10))
+
+        loud = energy_db > self.noise_db + self.margin_db
+        # high zero-crossing rate at moderate energy is hiss rather than voice
+        voiced = loud & ((zcr < self.max_zcr) | (energy_db > self.noise_db + 2 * self.margin_db))
+        speech = np.count_nonzero(voiced) >= 2
+
+        # follow the floor down quickly and up slowly, slower still while someone is speaking
+        quiet = float(np.percentile(energy_db, 10))
+        if quiet < self.noise_db:
+            rate = 0.5
+        else:
+            rate = 0.02 if speech else 0.05
+        self.noise_db += rate * (quiet - self.noise_db)
+        return speech
+
+    def process(self, data):
+        """Returns the chunks that should be passed to the recognizer for this input chunk."""
+        self.chunks_seen += 1
+        if self.is_speech(data):
+            chunks = list(self.preroll) + [data]
+            self.preroll.clear()
+            self.remaining = self.hangover
+        elif self.remaining > 0:
+            self.remaining -= 1
+            chunks = [data]
+        else:
+            self.preroll.append(data)
+            chunks = []
+        self.chunks_decoded += len(chunks)
+        return chunks
+
+    def stats(self):
+        """Returns counters for chunks seen versus chunks passed to the recognizer."""
+        return {
+            'chunks_seen': self.chunks_seen,
+            'chunks_decoded': self.chunks_decoded,
+            'skipped_ratio': 1 - self.chunks_decoded / self.chunks_seen if self.chunks_seen else 0.0,
+            'noise_db': self.noise_db,
+        }
+
+
+def recognize(recognizer, vad, data):
+    """Passes a captured chunk through the voice activity gate, if any, to the recognizer and returns its events."""
+    if vad is None:
+        return recognizer.feed(data)
+    chunks = vad.process(data)
+    if not chunks:
+        return recognizer.skip(data)
+    # the gate releases its pre-roll ahead of this chunk; skip() already counted that time
+    events = []
+    for chunk in chunks[:-1]:
+        events.extend(recognizer.feed(chunk, counted=False))
+    events.extend(recognizer.feed(chunks[-1]))
+    return events
+
+
+def run_recognizer(shm, capacity, model_path, rate, available, paused, stop_event, results):
+    """
+    Child process entry point: loads the Vosk model, reads PCM from the shared ring
+    and sends ('wake' | 'final', text) events back over the results queue, along with
+    ('stats', counters) every ASR_STATS_INTERVAL seconds and once more on exit.
+    """
+    # the parent handles Ctrl+C and stops the child through stop_event
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    ring = RecognizerProcess.attach(shm, capacity, available)
+    try:
+        from vosk import Model
+        model = Model(model_path)
+    except Exception as e:
+        results.put(('error', f'Error loading Vosk model: {e}'))
+        return
+
+    matcher = WakeMatcher(NAME, CALL_WORDS)
+    if TWO_STAGE_ASR:
+        recognizer = TwoStageRecognizer(model, rate, matcher)
+    else:
+        recognizer = SpeechRecognizer(model, rate, matcher)
+    vad = VoiceActivityGate(rate) if VAD_ENABLED else None
+    results.put(('ready', None))
+
+    next_stats = time.monotonic() + ASR_STATS_INTERVAL
+    while not stop_event.is_set():
+        if vad and time.monotonic() >= next_stats:
+            results.put(('stats', vad.stats()))
+            next_stats += ASR_STATS_INTERVAL
+        data = ring.read(FRAMES_PER_BUFFER, timeout=0.5)
+        if data is None:
+            continue
+        if paused.is_set():
+            ring.discard()
+            continue
+        for event in recognize(recognizer, vad, data):
+            results.put(event)
+
+    results.put(('stats', vad.stats() if vad else {}))
+
+
+class RecognizerProcess:
+    """
+    Runs speech recognition in a child process to keep Vosk decoding away from the
+    GIL shared with TTS and playback. Raw PCM travels through a ring buffer in
+    shared memory; only small result tuples come back over a queue.
+    Start it before other threads exist, since it forks where the platform allows.
+    """
+    HEADER = 16  # two int64 ring positions
+
+    def __init__(self, model_path, rate, seconds=CAPTURE_RING_SECONDS):
+        methods = multiprocessing.get_all_start_methods()
+        ctx = multiprocessing.get_context('fork' if 'fork' in methods else 'spawn')
+        self.capacity = int(rate * seconds)
+        self.shm = shared_memory.SharedMemory(create=True, size=self.HEADER + self.capacity * 2)
+        self.available = ctx.Event()
+        self.paused = ctx.Event()
+        self.stop_event = ctx.Event()
+        self.results = ctx.Queue()
+        self.ring = self.attach(self.shm, self.capacity, self.available)
+        self.ring.positions[:] = 0
+        self.stats = {}
+        self.process = ctx.Process(
+            target=run_recognizer,
+            args=(self.shm, self.capacity, model_path, rate, self.available,
+                  self.paused, self.stop_event, self.results),
+            daemon=True)
+        self.process.start()
+
+    @classmethod
+    def attach(cls, shm, capacity, available):
+        """Builds a RingBuffer view over the shared memory block."""
+        positions = np.ndarray((2,), dtype=np.int64, buffer=shm.buf)
+        buffer = np.ndarray((capacity,), dtype='<i2', buffer=shm.buf, offset=cls.HEADER)
+        return RingBuffer(capacity, buffer, positions, available)
+
+    def get(self, timeout=None):
+        """Returns the next (event, text) result, or None on timeout."""
+        try:
+            event = self.results.get(timeout=timeout)
+        except queue.Empty:
+            return None
+        if event[0] == 'stats':
+            self.stats = event[1]
+        return event
+
+    def close(self):
+        """Stops the child process and releases the shared memory."""
+        self.stop_event.set()
+        self.available.set()
+        self.process.join(timeout=3)
+        if self.process.is_alive():
+            self.process.terminate()
+            self.process.join()
+        while self.get(timeout=0) is not None:
+            pass
+        # numpy views must be released before the block can be closed
+        self.ring = None
+        self.shm.close()
+        self.shm.unlink()
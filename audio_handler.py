@@ -0,0 +1,292 @@
+# Audio Handler
+import time
+import wave
+import queue
+import logging
+import threading
+import numpy as np
+
+# PortAudio callback flags, as exposed by pyaudio.paInputOverflow and pyaudio.paContinue
+PA_INPUT_OVERFLOW = 0x2
+PA_CONTINUE = 0
+
+class AudioClip:
+    """
+    Holds a block of PCM audio in memory, ready to be written to a PyAudio stream.
+    Samples are stored as interleaved little-endian int16 bytes.
+    """
+    def __init__(self, data, rate, channels=1, sampwidth=2):
+        self.data = data
+        self.rate = rate
+        self.channels = channels
+        self.sampwidth = sampwidth
+
+    @classmethod
+    def from_float(cls, samples, rate):
+        """Creates a mono clip from float samples in the range [-1, 1]."""
+        samples = np.clip(np.asarray(samples, dtype=np.float32), -1.0, 1.0)
+        return cls((samples * 32767).astype('<i2').tobytes(), rate)
+
+    @classmethod
+    def from_wav(cls, filename):
+        """Reads a WAV file fully into memory."""
+        with wave.open(filename, 'rb') as wf:
+            return cls(wf.readframes(wf.getnframes()), wf.getframerate(),
+                       wf.getnchannels(), wf.getsampwidth())
+
+    @property
+    def frames(self):
+        """Number of sample frames in the clip."""
+        return len(self.data) // (self.channels * self.sampwidth)
+
+    @property
+    def duration(self):
+        """Length of the clip in seconds."""
+        return self.frames / self.rate if self.rate else 0.0
+
+    def to_float(self):
+        """Returns the samples as float32 in the range [-1, 1]."""
+        if self.sampwidth != 2:
+            raise ValueError(f"Unsupported sample width: {self.sampwidth}")
+        return np.frombuffer(self.data, dtype='<i2').astype(np.float32) / 32767
+
+
+class AudioPlayer:
+    """
+    Plays AudioClips back-to-back on a single worker thread.
+    Output streams are opened once per sample format and kept open, so consecutive
+    clips play without gaps or per-clip stream setup. Every queued clip gets a
+    completion event, and the idle event is set once nothing is queued or playing.
+    on_busy and on_idle are called when playback starts and stops being tracked,
+    on_start(clip, cue, tag) whenever a clip begins to play and
+    on_played(clip, cue, tag, start, end) with perf_counter() times once it has played.
+    """
+    def __init__(self, audio, frames_per_buffer=1024, on_idle=None, on_busy=None, on_start=None, on_played=None):
+        self.audio = audio
+        self.frames_per_buffer = frames_per_buffer
+        self.on_idle = on_idle
+        self.on_busy = on_busy
+        self.on_start = on_start
+        self.on_played = on_played
+        self.queue = queue.Queue()
+        self.streams = {}
+        self.pending = 0
+        self.generation = 0
+        self.lock = threading.Lock()
+        self.idle = threading.Event()
+        self.idle.set()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    @property
+    def is_playing(self):
+        """Whether a clip is playing or waiting to be played."""
+        return not self.idle.is_set()
+
+    def play(self, clip, cue=False, tag=None):
+        """
+        Queues a clip and returns an event that is set when it has finished playing.
+        Cue clips don't count towards is_playing, so capture can continue while they play.
+        The tag is passed to the playback hooks.
+        """
+        done = threading.Event()
+        busy = False
+        with self.lock:
+            generation = self.generation
+            if not cue:
+                self.pending += 1
+                busy = self.pending == 1
+                self.idle.clear()
+        if busy and self.on_busy:
+            self.on_busy()
+        self.queue.put((clip, done, cue, generation, tag))
+        return done
+
+    def wait_idle(self, timeout=None):
+        """Blocks until every queued clip has played."""
+        return self.idle.wait(timeout)
+
+    def _stream(self, clip):
+        """Returns the open output stream for the clip's sample format, opening it on first use."""
+        fmt = (clip.rate, clip.channels, clip.sampwidth)
+        stream = self.streams.get(fmt)
+        if stream is None:
+            stream = self.audio.open(
+                format=self.audio.get_format_from_width(clip.sampwidth),
+                channels=clip.channels,
+                rate=clip.rate,
+                output=True,
+                frames_per_buffer=self.frames_per_buffer)
+            self.streams[fmt] = stream
+        return stream
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            clip, done, cue, generation, tag = item
+            start = time.perf_counter()
+            try:
+                stream = self._stream(clip)
+                if self.on_start and generation == self.generation:
+                    self.on_start(clip, cue, tag)
+                step = self.frames_per_buffer * clip.channels * clip.sampwidth
+                for offset in range(0, len(clip.data), step):
+                    if generation != self.generation:
+                        break
+                    stream.write(clip.data[offset:offset + step])
+                if self.queue.empty() and generation == self.generation:
+                    # let the device drain its buffer before reporting idle
+                    time.sleep(stream.get_output_latency())
+                if self.on_played:
+                    self.on_played(clip, cue, tag, start, time.perf_counter())
+            except Exception as e:
+                logging.error(f'Error during playback: {e}')
+            finally:
+                done.set()
+                if not cue:
+                    self._finished()
+
+    def _finished(self):
+        """Marks one tracked clip as done, signalling idle after the last one."""
+        with self.lock:
+            self.pending -= 1
+            finished = self.pending == 0
+            if finished:
+                self.idle.set()
+        if finished and self.on_idle:
+            self.on_idle()
+
+    def clear(self):
+        """Drops every clip that has not started playing yet."""
+        while True:
+            try:
+                item = self.queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                self.queue.put(None)
+                break
+            _, done, cue, _, _ = item
+            done.set()
+            if not cue:
+                self._finished()
+
+    def stop(self):
+        """Drops queued clips and cuts the playing clip off after its current chunk."""
+        with self.lock:
+            self.generation += 1
+        self.clear()
+
+    def close(self):
+        """Drops queued clips, stops the worker and closes all streams."""
+        self.clear()
+        if self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join()
+        for stream in self.streams.values():
+            try:
+                stream.stop_stream()
+                stream.close()
+            except Exception:
+                pass
+        self.streams.clear()
+
+
+class RingBuffer:
+    """
+    Preallocated single-producer, single-consumer ring buffer of int16 samples.
+    The producer and consumer each own one monotonically increasing position, so the
+    data path needs no lock; an event only wakes a consumer waiting for more samples.
+    Samples that don't fit are dropped and counted instead of blocking the producer.
+    The sample buffer, positions and event can be supplied by the caller so the ring
+    can live in shared memory between processes.
+    """
+    def __init__(self, capacity, buffer=None, positions=None, available=None):
+        self.buffer = np.zeros(capacity, dtype='<i2') if buffer is None else buffer
+        self.positions = np.zeros(2, dtype=np.int64) if positions is None else positions  # written, read
+        self.capacity = capacity
+        self.dropped = 0
+        self.available = available or threading.Event()
+
+    @property
+    def written(self):
+        return int(self.positions[0])
+
+    @property
+    def read_pos(self):
+        return int(self.positions[1])
+
+    def __len__(self):
+        return self.written - self.read_pos
+
+    def write(self, data):
+        """Appends PCM bytes, dropping whatever exceeds the free space."""
+        samples = np.frombuffer(data, dtype='<i2')
+        written = self.written
+        free = self.capacity - (written - self.read_pos)
+        if len(samples) > free:
+            self.dropped += len(samples) - free
+            samples = samples[:free]
+        count = len(samples)
+        if count:
+            start = written % self.capacity
+            first = min(count, self.capacity - start)
+            self.buffer[start:start + first] = samples[:first]
+            self.buffer[:count - first] = samples[first:]
+            # publish the samples only after they are in place
+            self.positions[0] = written + count
+        self.available.set()
+
+    def read(self, count, timeout=None):
+        """Returns the next count samples as PCM bytes, or None if they don't arrive in time."""
+        while self.written - self.read_pos < count:
+            self.available.clear()
+            if self.written - self.read_pos >= count:
+                break
+            if not self.available.wait(timeout):
+                return None
+        read_pos = self.read_pos
+        start = read_pos % self.capacity
+        first = min(count, self.capacity - start)
+        data = self.buffer[start:start + first].tobytes() + self.buffer[:count - first].tobytes()
+        self.positions[1] = read_pos + count
+        return data
+
+    def discard(self):
+        """Drops everything buffered so far. Only the consumer may call this."""
+        self.positions[1] = self.written
+
+
+class AudioCapture:
+    """
+    Callback-mode microphone capture.
+    PyAudio delivers input on its own thread into a RingBuffer, so capture keeps running
+    while the consumer is busy; overflow reports and dropped samples are counted.
+    """
+    def __init__(self, rate, seconds, ring=None):
+        self.ring = ring or RingBuffer(int(rate * seconds))
+        self.callbacks = 0
+        self.overflows = 0
+
+    def callback(self, in_data, frame_count, time_info, status):
+        """PyAudio stream callback."""
+        self.callbacks += 1
+        if status & PA_INPUT_OVERFLOW:
+            self.overflows += 1
+        self.ring.write(in_data)
+        return None, PA_CONTINUE
+
+    def read(self, frames, timeout=None):
+        """Blocks until frames samples are available and returns them as PCM bytes."""
+        return self.ring.read(frames, timeout)
+
+    def stats(self):
+        """Returns capture counters."""
+        return {
+            'frames_captured': self.ring.written + self.ring.dropped,
+            'frames_dropped': self.ring.dropped,
+            'input_overflows': self.overflows,
+            'buffered_frames': len(self.ring),
+        }
@@ -0,0 +1,82 @@
+"""
+Per-sentence audio path benchmark.
+
+Measures the time from synthesized samples to bytes ready for the output
+stream, comparing the previous temp-WAV round trip (tts_to_file, librosa.load,
+a second WAV for the sped-up copy, wave.open for playback) with the in-memory
+AudioClip path. By default synthesis is replaced by a generated signal so only
+the audio path is timed; --xtts runs the real model for both paths.
+
+Usage: python benchmarks/bench_audio_path.py [--seconds 4] [--runs 20] [--speed-up] [--xtts]
+"""
+import os
+import sys
+import time
+import wave
+import uuid
+import argparse
+import statistics
+import numpy as np
+import librosa
+import soundfile as sf
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from audio_handler import AudioClip
+
+RATE = 24000
+TEXT = "The attacker has established persistence on the domain controller. What is your next move?"
+
+
+def file_path(samples, speed_up):
+    """The previous path: WAV on disk, optional reload and stretch to a second WAV, then reread."""
+    temp_wav = f"{uuid.uuid4().hex}_temp.wav"
+    sf.write(temp_wav, samples, RATE)
+    output_wav = temp_wav
+    if speed_up:
+        y, sr = librosa.load(temp_wav, sr=None)
+        output_wav = f"{uuid.uuid4().hex}_fast.wav"
+        sf.write(output_wav, librosa.effects.time_stretch(y, rate=1.1), sr)
+    with wave.open(output_wav, 'rb') as wf:
+        data = wf.readframes(wf.getnframes())
+    for filename in {temp_wav, output_wav}:
+        os.remove(filename)
+    return data
+
+
+def memory_path(samples, speed_up):
+    """The in-memory path: stretch the buffer and convert it to int16 bytes."""
+    if speed_up:
+        samples = librosa.effects.time_stretch(samples, rate=1.1)
+    return AudioClip.from_float(samples, RATE).data
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-sentence audio path benchmark")
+    parser.add_argument("--seconds", type=float, default=4.0)
+    parser.add_argument("--runs", type=int, default=20)
+    parser.add_argument("--speed-up", action="store_true")
+    parser.add_argument("--xtts", action="store_true", help="synthesize with the real XTTS model")
+    args = parser.parse_args()
+
+    if args.xtts:
+        from TTS.api import TTS
+        from settings import TTS_MODEL, SPEAKER_WAV
+        tts = TTS(model_name=TTS_MODEL, progress_bar=False)
+        synthesize = lambda: np.asarray(tts.tts(TEXT, speaker_wav=SPEAKER_WAV, language="en"), dtype=np.float32)
+    else:
+        rng = np.random.default_rng(0)
+        signal = (0.3 * rng.standard_normal(int(args.seconds * RATE))).astype(np.float32)
+        synthesize = lambda: signal
+
+    for name, path in (("temp wav", file_path), ("in-memory", memory_path)):
+        timings = []
+        for _ in range(args.runs):
+            start = time.perf_counter()
+            path(synthesize(), args.speed_up)
+            timings.append(time.perf_counter() - start)
+        print(f"{name:<10} median {statistics.median(timings) * 1e3:8.2f} ms  "
+              f"max {max(timings) * 1e3:8.2f} ms per sentence")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,383 @@
+"""
+End-to-end latency benchmark.
+
+Drives Core with recorded speech instead of a microphone. The WAVs listed in a
+JSONL manifest ({"wav": "hey_blossom_what_is_phishing.wav"}) are fed through
+the capture callback in real time, and each one should contain the wake phrase
+followed by a query. The LLM is the local fake Ollama server, TTS is a stub
+with a configurable cost, and playback only takes the clip's duration.
+The Vosk model is real, since recognition is part of what is measured.
+
+Every fixture is run as a cache hit, a cache miss and a simulation turn, each
+scenario on a fresh Core with empty caches. For every metric, p50 and p95 are
+reported:
+  wake_to_cue                 end of the spoken name to the start cue playing
+  query_to_first_token        query dispatched to the first LLM token (misses and simulation)
+  first_token_to_first_audio  first LLM token to the first answer audio
+  query_to_first_audio        query dispatched to the first answer audio
+  turn                        query dispatched to the end of playback
+Results are written as JSON, optionally with deltas to an earlier run.
+
+Usage: python benchmarks/bench_e2e.py manifest.jsonl [--model vosk-model] [--repeat 3]
+                                      [--token-rate 30] [--tts-cost 0.3] [--output e2e.json]
+                                      [--baseline previous.json]
+"""
+import io
+import os
+import sys
+import json
+import time
+import queue
+import argparse
+import tempfile
+import threading
+import subprocess
+import contextlib
+from functools import partial
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+import main as blossom
+import llm_handler
+import res_handler
+from settings import NAME, SIM_PROMPT, SAMPLING_RATE, VOSK_MODEL, START_WAV
+from tts_handler import TtsHandler
+from fake_ollama import FakeOllama
+from bench_vad import load_mono
+
+METRICS = ("wake_to_cue", "query_to_first_token", "first_token_to_first_audio", "query_to_first_audio", "turn")
+SCENARIOS = ("hit", "miss", "sim")
+
+
+class StubTts(TtsHandler):
+    """TTS stand-in that sleeps for a fixed cost plus a per-character cost and returns silence."""
+    def __init__(self, cost=0.3, char_cost=0.002, char_seconds=0.06, rate=24000):
+        self.device = None
+        self.model_name = "stub"
+        self.latents = {}
+        self.file_hashes = {}
+        self.lock = threading.Lock()
+        self.cost = cost
+        self.char_cost = char_cost
+        self.char_seconds = char_seconds
+        self.rate = rate
+
+    @property
+    def sample_rate(self):
+        return self.rate
+
+    @property
+    def supports_latents(self):
+        return False
+
+    def worker_factory(self):
+        return partial(type(self), self.cost, self.char_cost, self.char_seconds, self.rate)
+
+    def synthesize(self, text, speaker_wav=None, language="en"):
+        time.sleep(self.cost + self.char_cost * len(text))
+        return np.zeros(int(len(text) * self.char_seconds * self.rate), dtype=np.float32)
+
+
+class Feed:
+    """A queued recording: started is set with its start time in at, done once it has been fed."""
+    def __init__(self, pcm):
+        self.pcm = pcm
+        self.at = None
+        self.started = threading.Event()
+        self.done = threading.Event()
+
+
+class FakeInputStream:
+    """Calls the capture callback in real time with queued PCM, and silence in between."""
+    def __init__(self, rate, frames_per_buffer, callback):
+        self.rate = rate
+        self.frames = frames_per_buffer
+        self.callback = callback
+        self.clips = queue.Queue()
+        self.running = threading.Event()
+        self.thread = None
+
+    def play(self, pcm):
+        """Queues 16-bit mono PCM to be fed after what is already queued."""
+        feed = Feed(pcm)
+        self.clips.put(feed)
+        return feed
+
+    def start_stream(self):
+        self.running.set()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        step = self.frames * 2
+        silence = bytes(step)
+        period = self.frames / self.rate
+        feed, pcm, offset = None, b"", 0
+        deadline = time.perf_counter()
+        while self.running.is_set():
+            if offset >= len(pcm):
+                if feed:
+                    feed.done.set()
+                    feed = None
+                try:
+                    feed = self.clips.get_nowait()
+                    pcm, offset = feed.pcm, 0
+                    feed.at = max(deadline, time.perf_counter())
+                    feed.started.set()
+                except queue.Empty:
+                    pcm, offset = b"", 0
+            chunk = pcm[offset:offset + step] if offset < len(pcm) else silence
+            offset += step
+            chunk = chunk.ljust(step, b"\0")
+            delay = deadline - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            self.callback(chunk, self.frames, None, 0)
+            deadline += period
+
+    def stop_stream(self):
+        self.running.clear()
+        if self.thread:
+            self.thread.join()
+
+    def close(self):
+        pass
+
+
+class FakeOutputStream:
+    """Output stream that takes as long to write as the audio lasts."""
+    def __init__(self, rate, channels, sampwidth):
+        self.bytes_per_second = rate * channels * sampwidth
+
+    def write(self, data):
+        time.sleep(len(data) / self.bytes_per_second)
+
+    def get_output_latency(self):
+        return 0.0
+
+    def stop_stream(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class FakePyAudio:
+    """The subset of the PyAudio interface Core uses."""
+    def __init__(self):
+        self.mic = None
+        self.mic_ready = threading.Event()
+
+    def get_format_from_width(self, width):
+        return width
+
+    def open(self, format=None, channels=1, rate=None, input=False, output=False,
+             frames_per_buffer=1024, stream_callback=None, **kwargs):
+        if input:
+            self.mic = FakeInputStream(rate, frames_per_buffer, stream_callback)
+            self.mic_ready.set()
+            return self.mic
+        return FakeOutputStream(rate, channels, format or 2)
+
+    def terminate(self):
+        pass
+
+
+def align(model, samples, name=NAME):
+    """Returns (transcript, seconds at which the name is first spoken) using Vosk word timings."""
+    from vosk import KaldiRecognizer
+    recognizer = KaldiRecognizer(model, SAMPLING_RATE)
+    recognizer.SetWords(True)
+    pcm = (np.clip(samples, -1, 1) * 32767).astype('<i2').tobytes()
+    words = []
+    for i in range(0, len(pcm), 8000):
+        if recognizer.AcceptWaveform(pcm[i:i + 8000]):
+            words.extend(json.loads(recognizer.Result()).get("result", []))
+    words.extend(json.loads(recognizer.FinalResult()).get("result", []))
+    wake_end = next((word["end"] for word in words if word["word"] == name.lower()), None)
+    return ' '.join(word["word"] for word in words), wake_end
+
+
+def percentiles(values):
+    values = [value for value in values if value is not None]
+    if not values:
+        return {"n": 0, "p50": None, "p95": None}
+    return {"n": len(values), "p50": float(np.percentile(values, 50)), "p95": float(np.percentile(values, 95))}
+
+
+def configure(workdir, server):
+    """Points Core's caches and traces at a scratch directory and its LLM at the fake server."""
+    res_handler.CACHE_DB = os.path.join(workdir, "cache.db")
+    res_handler.CACHE_FILE = os.path.join(workdir, "cache.json")
+    blossom.AUDIO_CACHE_DIR = os.path.join(workdir, "audio_cache")
+    blossom.TRACE_FILE = os.path.join(workdir, "traces", "trace.jsonl")
+    blossom.METRICS_FILE = os.path.join(workdir, "traces", "metrics.prom")
+    llm_handler.OLLAMA_URL = server.url
+
+
+def run_scenario(scenario, fixtures, args, server, tts):
+    """Runs every fixture args.repeat times on a fresh Core and returns the per-turn measurements."""
+    audio = FakePyAudio()
+    plays = []
+    with tempfile.TemporaryDirectory() as workdir:
+        configure(workdir, server)
+        core = blossom.Core(audio=audio, tts=tts)
+        core.handler.score_file = os.path.join(workdir, "score.txt")
+        core.player.on_start = lambda clip, cue, tag: plays.append((time.perf_counter(), clip, cue))
+        start_cue = core.cues[START_WAV]
+
+        if scenario == "hit":
+            for fixture in fixtures:
+                query = core.wake_matcher.match(fixture["transcript"]) or fixture["transcript"]
+                query, query_hash, intent = core.handler.parse_query(query)
+                for i in range(2):
+                    core.handler.add_response(query, query_hash, intent,
+                                              f"Cached answer {i} about {query}. It has a second sentence.")
+        elif scenario == "sim":
+            core.handler.sim = True
+            core.handler.llm.set_mode("simulation", f"{SIM_PROMPT} \nLEVEL: {core.handler.level}")
+
+        core.start()
+        # the microphone opens once the recognizer has loaded
+        audio.mic_ready.wait()
+
+        turns = []
+        for _ in range(args.repeat):
+            for fixture in fixtures:
+                del plays[:]
+                del server.first_tokens[:]
+                feed = audio.mic.play(fixture["pcm"])
+                try:
+                    query = core.queries.get(timeout=fixture["seconds"] + args.timeout)
+                except queue.Empty:
+                    turns.append({"scenario": scenario, "wav": fixture["wav"], "error": "no query recognized"})
+                    feed.done.wait()
+                    continue
+                query_at = time.perf_counter()
+                core.process(query)
+                core.speech_queue.join()
+                core.player.wait_idle()
+                end_at = time.perf_counter()
+                feed.done.wait()
+
+                cue_at = next((at for at, clip, cue in plays if clip is start_cue), None)
+                answer_at = next((at for at, clip, cue in plays if not cue and at >= query_at
+                                  and clip not in core.cues.values()), None)
+                # on a hit the only stream is the background refresh
+                token_at = None if scenario == "hit" else next(
+                    (at for at in server.first_tokens if at >= query_at), None)
+                wake_at = feed.at + fixture["wake_end"] if fixture["wake_end"] is not None else None
+                turns.append({
+                    "scenario": scenario,
+                    "wav": fixture["wav"],
+                    "query": query,
+                    "wake_to_cue": cue_at - wake_at if cue_at and wake_at else None,
+                    "query_to_first_token": token_at - query_at if token_at else None,
+                    "first_token_to_first_audio": answer_at - token_at if answer_at and token_at else None,
+                    "query_to_first_audio": answer_at - query_at if answer_at else None,
+                    "turn": end_at - query_at,
+                })
+                time.sleep(args.gap)
+
+        core.shutdown()
+    return turns
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end latency benchmark")
+    parser.add_argument("manifest", help="JSONL manifest of WAV fixtures")
+    parser.add_argument("--model", default=VOSK_MODEL)
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS))
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--tokens", type=int, default=60, help="LLM tokens per answer")
+    parser.add_argument("--token-rate", type=float, default=30.0, help="LLM tokens per second")
+    parser.add_argument("--prompt-eval-rate", type=float, default=None, help="LLM prompt tokens per second")
+    parser.add_argument("--tts-cost", type=float, default=0.3, help="seconds per synthesized sentence")
+    parser.add_argument("--tts-char-cost", type=float, default=0.002, help="extra seconds per character")
+    parser.add_argument("--gap", type=float, default=1.0, help="seconds of silence between turns")
+    parser.add_argument("--timeout", type=float, default=10.0, help="seconds to wait for a query after the WAV")
+    parser.add_argument("--output", default="bench_e2e.json")
+    parser.add_argument("--baseline", help="earlier output to compare against")
+    args = parser.parse_args()
+
+    from vosk import Model
+    blossom.VOSK_MODEL = args.model
+    model = Model(args.model)
+    base = os.path.dirname(os.path.abspath(args.manifest))
+    fixtures = []
+    with open(args.manifest) as file:
+        for line in file:
+            if not line.strip():
+                continue
+            fixture = json.loads(line)
+            samples = load_mono(os.path.join(base, fixture["wav"]))
+            if samples is None:
+                continue
+            transcript, wake_end = align(model, samples)
+            fixtures.append({
+                "wav": fixture["wav"],
+                "pcm": (np.clip(samples, -1, 1) * 32767).astype('<i2').tobytes(),
+                "seconds": len(samples) / SAMPLING_RATE,
+                "transcript": transcript,
+                "wake_end": wake_end,
+            })
+            print(f"{fixture['wav']}: '{transcript}' name ends at {wake_end}")
+    del model
+
+    tts = StubTts(args.tts_cost, args.tts_char_cost)
+    turns = []
+    with FakeOllama(tokens=args.tokens, token_rate=args.token_rate,
+                    prompt_eval_rate=args.prompt_eval_rate) as server:
+        for scenario in args.scenarios.split(","):
+            print(f"running {scenario}...")
+            # keep Core's console UI out of the report
+            with contextlib.redirect_stdout(io.StringIO()):
+                turns.extend(run_scenario(scenario, fixtures, args, server, tts))
+
+    results = {
+        "revision": git_revision(),
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "config": {key: value for key, value in vars(args).items() if key not in ("output", "baseline")},
+        "scenarios": {},
+        "turns": turns,
+    }
+    for scenario in args.scenarios.split(","):
+        scenario_turns = [turn for turn in turns if turn["scenario"] == scenario]
+        results["scenarios"][scenario] = {metric: percentiles([turn.get(metric) for turn in scenario_turns])
+                                          for metric in METRICS}
+        results["scenarios"][scenario]["errors"] = sum(1 for turn in scenario_turns if "error" in turn)
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)["scenarios"]
+
+    for scenario, metrics in results["scenarios"].items():
+        print(f"{scenario}  ({metrics['errors']} turns without a recognized query)")
+        for metric in METRICS:
+            stats = metrics[metric]
+            if not stats["n"]:
+                continue
+            line = f"  {metric:<28} p50 {stats['p50'] * 1e3:8.1f} ms  p95 {stats['p95'] * 1e3:8.1f} ms"
+            previous = (baseline or {}).get(scenario, {}).get(metric)
+            if previous and previous.get("p50") is not None:
+                line += (f"  (p50 {(stats['p50'] - previous['p50']) * 1e3:+.1f} ms, "
+                         f"p95 {(stats['p95'] - previous['p95']) * 1e3:+.1f} ms)")
+            print(line)
+
+    with open(args.output, "w") as file:
+        json.dump(results, file, indent=2)
+    print(f"wrote {args.output}")
+
+
+if __name__ == '__main__':
+    main()
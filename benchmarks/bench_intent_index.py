@@ -0,0 +1,73 @@
+"""
+Intent index lookup benchmark.
+
+Fills an IntentIndex with synthetic stemmed intents and times match() for
+paraphrase-style queries. It then times mixed traffic the way the cache sees
+it: every miss adds a new intent, so each match follows an add.
+
+Usage: python benchmarks/bench_intent_index.py [--intents 50000] [--queries 2000] [--mixed 2000]
+"""
+import os
+import sys
+import time
+import random
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from intent_handler import IntentIndex
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Intent index lookup benchmark")
+    parser.add_argument("--intents", type=int, default=50000)
+    parser.add_argument("--vocab", type=int, default=8000)
+    parser.add_argument("--queries", type=int, default=2000)
+    parser.add_argument("--mixed", type=int, default=2000, help="add+match pairs of mixed traffic")
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    vocab = [f"stem{i}" for i in range(args.vocab)]
+    index = IntentIndex()
+    intents = ['.'.join(rng.sample(vocab, rng.randint(1, 6))) for _ in range(args.intents)]
+
+    start = time.perf_counter()
+    for intent in intents:
+        index.add(intent)
+    index.match(intents[0] + ".warmup")
+    build = time.perf_counter() - start
+
+    # paraphrases: a cached intent with one stem swapped for another word
+    def paraphrase():
+        terms = rng.choice(intents).split('.')
+        terms[rng.randrange(len(terms))] = rng.choice(vocab)
+        return '.'.join(terms + ["explain"])
+    queries = [paraphrase() for _ in range(args.queries)]
+
+    hits = 0
+    start = time.perf_counter()
+    for query in queries:
+        hits += index.match(query)[0] is not None
+    elapsed = time.perf_counter() - start
+
+    print(f"intents: {len(index)}  build: {build * 1e3:.1f} ms")
+    print(f"match: {elapsed / len(queries) * 1e3:.3f} ms/query  hit rate: {hits / len(queries):.1%}")
+
+    # mixed: each miss caches a new intent before the next lookup
+    latencies = []
+    for _ in range(args.mixed):
+        intent = '.'.join(rng.sample(vocab, rng.randint(1, 6)))
+        query = paraphrase()
+        start = time.perf_counter()
+        index.add(intent)
+        index.match(query)
+        latencies.append(time.perf_counter() - start)
+        intents.append(intent)
+    latencies.sort()
+    if latencies:
+        print(f"add+match: {sum(latencies) / len(latencies) * 1e3:.3f} ms mean  "
+              f"p99 {latencies[int(len(latencies) * 0.99)] * 1e3:.3f} ms  "
+              f"max {latencies[-1] * 1e3:.3f} ms  intents: {len(index)}")
+
+
+if __name__ == '__main__':
+    main()
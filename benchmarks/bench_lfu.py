@@ -0,0 +1,85 @@
+"""
+LFU cache microbenchmark.
+
+Compares the frequency-bucket LFUCache against the previous implementation,
+which scanned the whole frequency dict on every eviction.
+
+Usage: python benchmarks/bench_lfu.py [--size 5000] [--ops 50000]
+"""
+import os
+import sys
+import time
+import random
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from cache_handler import LFUCache
+
+
+class ScanLFUCache:
+    """The previous LFUCache, evicting with a min() scan over all frequencies."""
+    def __init__(self, capacity):
+        self.cache = {}
+        self.freq = {}
+        self.capacity = capacity
+
+    def get(self, key):
+        if key in self.cache:
+            self.freq[key] += 1
+            return self.cache[key]
+        return None
+
+    def put(self, key, value):
+        if key in self.cache:
+            self.freq[key] += 1
+        else:
+            if len(self.cache) >= self.capacity:
+                least_used = min(self.freq, key=self.freq.get, default=None)
+                if least_used:
+                    del self.cache[least_used]
+                    del self.freq[least_used]
+            self.cache[key] = value
+            self.freq[key] = 1
+
+
+def workload(size, ops, seed=0):
+    """Builds a skewed get/put trace over a key space larger than the cache."""
+    rng = random.Random(seed)
+    keys = [f"intent.{i}" for i in range(size * 4)]
+    trace = []
+    for _ in range(ops):
+        key = keys[min(int(rng.paretovariate(1.2)) - 1, len(keys) - 1)] if rng.random() < 0.7 else rng.choice(keys)
+        trace.append((rng.random() < 0.5, key))
+    return trace
+
+
+def run(cache, trace):
+    """Replays a trace and returns elapsed seconds."""
+    value = ["A cached answer about phishing."]
+    for i in range(cache.capacity):
+        cache.put(f"warm.{i}", value)
+    start = time.perf_counter()
+    for is_get, key in trace:
+        if is_get:
+            cache.get(key)
+        else:
+            cache.put(key, value)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="LFU cache microbenchmark")
+    parser.add_argument("--size", type=int, default=5000)
+    parser.add_argument("--ops", type=int, default=50000)
+    args = parser.parse_args()
+
+    trace = workload(args.size, args.ops)
+    for name, cache in (("scan", ScanLFUCache(args.size)),
+                        ("buckets", LFUCache(args.size)),
+                        ("buckets+bytes", LFUCache(args.size, max_bytes=args.size * 40))):
+        elapsed = run(cache, trace)
+        print(f"{name:<14} {elapsed * 1e3:9.1f} ms  {elapsed / args.ops * 1e6:8.2f} us/op")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+"""
+Conversation context reuse benchmark.
+
+Runs a multi-turn simulation conversation against the local fake Ollama server,
+which charges prompt evaluation time for every token it has not cached. Each turn
+is sent once without context, so the system prompt is evaluated every time as
+before, and once continuing the returned context. Reports time to first
+sentence, prompt tokens evaluated and the context carried into the next turn,
+which starts afresh once it outgrows CONTEXT_TOKEN_BUDGET. --num-ctx tries another
+context length, with the budget moving along with it.
+
+Usage: python benchmarks/bench_llm_context.py [--turns 6] [--prompt-eval-rate 400] [--num-ctx 1024]
+"""
+import os
+import sys
+import time
+import argparse
+import statistics
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from settings import SIM_PROMPT, CONTEXT_MARGIN, NUM_CTX
+import llm_handler
+from llm_handler import LlmHandler
+from fake_ollama import FakeOllama
+
+QUERIES = [
+    "start a phishing simulation",
+    "I check the sender address of the email",
+    "I report the email to the security team",
+    "I block the lookalike domain on the mail gateway",
+    "I reset the password of the affected account",
+    "I review the VPN logs for logins from new locations",
+]
+
+
+def run_turn(llm, query, remember):
+    """Returns (seconds to first sentence, total seconds, prompt tokens evaluated, context kept)."""
+    start = time.perf_counter()
+    first = None
+    for _ in llm.get_response(query, remember=remember):
+        if first is None:
+            first = time.perf_counter() - start
+    total = time.perf_counter() - start
+    return first or total, total, llm.last_stats.get("prompt_eval_count", 0), len(llm.contexts.get(llm.mode, ()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Conversation context reuse benchmark")
+    parser.add_argument("--turns", type=int, default=6)
+    parser.add_argument("--tokens", type=int, default=150, help="response tokens per turn")
+    parser.add_argument("--token-rate", type=float, default=400.0)
+    parser.add_argument("--prompt-eval-rate", type=float, default=400.0, help="prompt tokens per second")
+    parser.add_argument("--num-ctx", type=int, default=NUM_CTX, help="context length to try")
+    args = parser.parse_args()
+    llm_handler.NUM_CTX = args.num_ctx
+    llm_handler.CONTEXT_TOKEN_BUDGET = args.num_ctx - CONTEXT_MARGIN
+
+    with FakeOllama(tokens=args.tokens, token_rate=args.token_rate,
+                    prompt_eval_rate=args.prompt_eval_rate) as server:
+        results = {}
+        for label, remember in (("no context", False), ("context", True)):
+            llm = LlmHandler()
+            llm.url = f"{server.url}/api/generate"
+            llm.set_mode("simulation", f"{SIM_PROMPT} \nLEVEL: 1")
+            turns = [run_turn(llm, QUERIES[i % len(QUERIES)], remember) for i in range(args.turns)]
+            results[label] = turns
+            print(f"{label}:")
+            for i, (first, total, evaluated, kept) in enumerate(turns, 1):
+                print(f"  turn {i}: first sentence {first * 1e3:7.1f} ms  total {total * 1e3:7.1f} ms  "
+                      f"prompt tokens evaluated {evaluated:4d}  context kept {kept}")
+
+    print(f"context budget: {llm_handler.CONTEXT_TOKEN_BUDGET} tokens of NUM_CTX {args.num_ctx}")
+    for label, turns in results.items():
+        later = turns[1:] or turns
+        print(f"{label:<10} median first sentence after turn 1: "
+              f"{statistics.median(turn[0] for turn in later) * 1e3:7.1f} ms  "
+              f"prompt tokens: {sum(turn[2] for turn in turns)}")
+
+
+if __name__ == '__main__':
+    main()
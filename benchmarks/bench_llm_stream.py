@@ -0,0 +1,64 @@
+"""
+LLM stream parsing throughput benchmark.
+
+Streams thousands of tokens from a local fake Ollama server, using small HTTP
+writes so records are split across chunk boundaries, and checks that
+LlmHandler.get_response returns every token. The previous chunk-per-record
+parser is run against the same stream for comparison.
+
+Usage: python benchmarks/bench_llm_stream.py [--tokens 5000] [--write-size 61]
+"""
+import os
+import re
+import sys
+import json
+import time
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from llm_handler import LlmHandler
+from fake_ollama import FakeOllama
+
+
+def legacy_parse(response):
+    """The previous parser: one json.loads per raw chunk and a regex over the joined buffer."""
+    buffer = []
+    for chunk in response.iter_content(chunk_size=512):
+        try:
+            buffer.append(json.loads(chunk.decode("utf-8")).get("response", ""))
+        except (json.JSONDecodeError, UnicodeDecodeError):
+            continue
+        if re.search(r'[.!?]$', ''.join(buffer)):
+            yield ' '.join(''.join(buffer).split())
+            buffer = []
+
+
+def main():
+    parser = argparse.ArgumentParser(description="LLM stream parsing benchmark")
+    parser.add_argument("--tokens", type=int, default=5000)
+    parser.add_argument("--write-size", type=int, default=61)
+    args = parser.parse_args()
+
+    with FakeOllama(tokens=args.tokens, write_size=args.write_size) as server:
+        expected = ' '.join(''.join(server.tokens).split())
+
+        llm = LlmHandler()
+        llm.url = f"{server.url}/api/generate"
+        start = time.perf_counter()
+        text = ' '.join(llm.get_response("benchmark"))
+        elapsed = time.perf_counter() - start
+        received = llm.last_stats.get('eval_count') or len(text.split())
+        print(f"get_response: {received / elapsed:10.0f} tokens/s  complete: {text == expected}  "
+              f"eval_count: {llm.last_stats.get('eval_count')}")
+
+        response = llm.session.post(llm.url, json={"prompt": "benchmark"}, stream=True)
+        start = time.perf_counter()
+        legacy = ' '.join(legacy_parse(response))
+        elapsed = time.perf_counter() - start
+        kept = len(legacy.split()) / len(expected.split())
+        print(f"legacy:       {len(legacy.split()) / elapsed:10.0f} tokens/s  complete: {legacy == expected}  "
+              f"words kept: {kept:.1%}")
+
+
+if __name__ == '__main__':
+    main()
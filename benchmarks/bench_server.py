@@ -0,0 +1,328 @@
+"""
+Load test for the multi-session server.
+
+Opens a growing number of concurrent client sessions and has each ask a series of
+questions, one after another, the way a trainee would. Every turn is timed from
+the query (the typed text, or the end of the spoken WAV) to the first answer
+audio and to the end of the answer. The audio of each answer is replayed on a
+virtual clock, and a turn counts as stuttering if a clip arrives after the
+previous ones would have finished playing.
+
+A session count passes when the p95 time to first audio stays within
+--max-first-audio and no turn times out or stutters. The largest passing count
+is how many trainees one box can serve.
+
+With --local, an in-process server is started with the fake Ollama server and a
+stub TTS with a configurable cost, on scratch caches, to test the server itself.
+Without it, the client connects to a running server.py.
+
+Usage: python benchmarks/bench_server.py [--local] [--sessions 1,2,4,8,16] [--turns 3]
+                                         [--wav hey_blossom_query.wav] [--max-first-audio 3.0]
+                                         [--host 127.0.0.1] [--port 8765] [--unix path]
+"""
+import os
+import sys
+import json
+import time
+import queue
+import socket
+import argparse
+import tempfile
+import contextlib
+import threading
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+import server as blossom
+import llm_handler
+import res_handler
+from settings import SAMPLING_RATE, FRAMES_PER_BUFFER, SERVER_HOST, SERVER_PORT, SERVER_SOCKET, VOSK_MODEL
+from bench_e2e import StubTts
+from bench_vad import load_mono
+from fake_ollama import FakeOllama
+
+TOPICS = ("phishing", "ransomware", "lateral movement", "credential stuffing", "dns tunneling",
+          "sql injection", "privilege escalation", "supply chain attacks", "port scanning",
+          "malware persistence", "botnets", "insider threats")
+ACTIONS = ("detect", "prevent", "investigate", "contain", "explain")
+
+
+def make_queries(offset, count):
+    """Builds distinct questions, so most turns miss the response cache."""
+    pairs = [(action, topic) for topic in TOPICS for action in ACTIONS]
+    return [f"how do I {action} {topic}" for action, topic in
+            (pairs[(offset + i) % len(pairs)] for i in range(count))]
+
+
+class Client:
+    """One simulated trainee connected to the server."""
+    def __init__(self, address):
+        family = socket.AF_UNIX if isinstance(address, str) else socket.AF_INET
+        self.sock = socket.socket(family, socket.SOCK_STREAM)
+        self.sock.connect(address)
+        if family == socket.AF_INET:
+            self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.rfile = self.sock.makefile('rb')
+        self.wfile = self.sock.makefile('wb')
+        self.send_lock = threading.Lock()
+        self.messages = queue.Queue()  # (perf_counter(), kind, value)
+        self.thread = threading.Thread(target=self._read, daemon=True)
+        self.thread.start()
+
+    def _read(self):
+        while True:
+            try:
+                kind, payload = blossom.read_frame(self.rfile)
+            except (OSError, ValueError):
+                kind = None
+            at = time.perf_counter()
+            if kind is None:
+                self.messages.put((at, 'closed', None))
+                return
+            if kind == b'J':
+                self.messages.put((at, 'event', json.loads(payload)))
+            elif kind == b'A':
+                self.messages.put((at, 'audio', blossom.decode_clip(payload)))
+
+    def send(self, kind, payload=b""):
+        with self.send_lock:
+            blossom.write_frame(self.wfile, kind, payload)
+
+    def wait_event(self, name, timeout):
+        """Waits for an event, returning it or None on timeout."""
+        deadline = time.perf_counter() + timeout
+        while True:
+            try:
+                _, kind, value = self.messages.get(timeout=max(deadline - time.perf_counter(), 0))
+            except queue.Empty:
+                return None
+            if kind == 'closed':
+                return None
+            if kind == 'event' and value["event"] in (name, "error"):
+                return value
+
+    def speak(self, pcm, stop):
+        """Streams PCM in real time, then silence until stop is set, so the utterance can end."""
+        step = FRAMES_PER_BUFFER * 2
+        silence = bytes(step)
+        period = FRAMES_PER_BUFFER / SAMPLING_RATE
+        deadline = time.perf_counter()
+        offset = 0
+        while not stop.is_set():
+            chunk = pcm[offset:offset + step].ljust(step, b"\0") if offset < len(pcm) else silence
+            offset += step
+            self.send(b'A', chunk)
+            deadline += period
+            time.sleep(max(deadline - time.perf_counter(), 0))
+
+    def turn(self, query, pcm, timeout):
+        """Asks one question and times the answer."""
+        stop = threading.Event()
+        speaker = None
+        if pcm is None:
+            start = time.perf_counter()
+            self.send(b'T', query.encode())
+        else:
+            start = time.perf_counter() + len(pcm) / 2 / SAMPLING_RATE
+            speaker = threading.Thread(target=self.speak, args=(pcm, stop), daemon=True)
+            speaker.start()
+
+        first_audio = None
+        playhead = 0.0
+        audio_seconds = 0.0
+        stutters = 0
+        result = {"query": query}
+        deadline = start + timeout
+        try:
+            while True:
+                try:
+                    at, kind, value = self.messages.get(timeout=max(deadline - time.perf_counter(), 0))
+                except queue.Empty:
+                    result["error"] = "timeout"
+                    break
+                if kind == 'closed':
+                    result["error"] = "disconnected"
+                    break
+                if kind == 'audio':
+                    clip, cue = value
+                    if cue:
+                        continue
+                    if first_audio is None:
+                        first_audio = playhead = at
+                    elif at > playhead + 0.05:
+                        stutters += 1
+                    playhead = max(playhead, at) + clip.duration
+                    audio_seconds += clip.duration
+                elif value["event"] == "error":
+                    result["error"] = value.get("message")
+                    break
+                elif value["event"] == "done":
+                    result["turn"] = at - start
+                    if first_audio is None:
+                        # a turn that ends without answer audio failed, even if the server didn't say so
+                        result["error"] = "no answer audio"
+                    break
+        finally:
+            stop.set()
+            if speaker:
+                speaker.join()
+
+        result.update(first_audio=first_audio - start if first_audio is not None else None,
+                      audio=audio_seconds, stutters=stutters)
+        return result
+
+    def close(self):
+        try:
+            self.send(b'Q')
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.sock.close()
+        self.thread.join()
+
+
+def run_level(address, sessions, args, pcm):
+    """Runs the given number of concurrent sessions and returns every turn."""
+    turns = []
+    lock = threading.Lock()
+
+    def trainee(index):
+        try:
+            client = Client(address)
+        except OSError as e:
+            with lock:
+                turns.append({"session": index, "error": f"connect failed: {e}"})
+            return
+        try:
+            if client.wait_event("ready", args.timeout) is None:
+                with lock:
+                    turns.append({"session": index, "error": "not admitted"})
+                return
+            for query in make_queries(index * args.turns, args.turns):
+                result = client.turn(query, pcm, args.timeout)
+                result["session"] = index
+                with lock:
+                    turns.append(result)
+                if "error" in result:
+                    break
+                time.sleep(args.think)
+        finally:
+            client.close()
+
+    threads = [threading.Thread(target=trainee, args=(i,)) for i in range(sessions)]
+    for thread in threads:
+        thread.start()
+        # stagger the connections slightly, like people sitting down
+        time.sleep(args.stagger)
+    for thread in threads:
+        thread.join()
+    return turns
+
+
+def percentile(values, q):
+    values = [value for value in values if value is not None]
+    return float(np.percentile(values, q)) if values else None
+
+
+def summarize(sessions, turns, args):
+    first_audio = [turn.get("first_audio") for turn in turns]
+    summary = {
+        "sessions": sessions,
+        "turns": len(turns),
+        "errors": sum(1 for turn in turns if "error" in turn),
+        "stuttering": sum(1 for turn in turns if turn.get("stutters")),
+        "first_audio_p50": percentile(first_audio, 50),
+        "first_audio_p95": percentile(first_audio, 95),
+        "turn_p50": percentile([turn.get("turn") for turn in turns], 50),
+        "turn_p95": percentile([turn.get("turn") for turn in turns], 95),
+    }
+    summary["passed"] = (not summary["errors"] and not summary["stuttering"]
+                         and summary["first_audio_p95"] is not None
+                         and summary["first_audio_p95"] <= args.max_first_audio)
+    return summary
+
+
+def start_local(workdir, args, ollama):
+    """Starts an in-process server with stand-ins on scratch caches and returns it with its address."""
+    res_handler.CACHE_DB = os.path.join(workdir, "cache.db")
+    res_handler.CACHE_FILE = os.path.join(workdir, "cache.json")
+    blossom.AUDIO_CACHE_DIR = os.path.join(workdir, "audio_cache")
+    blossom.TRACE_FILE = os.path.join(workdir, "traces", "trace.jsonl")
+    blossom.METRICS_FILE = os.path.join(workdir, "traces", "metrics.prom")
+    llm_handler.OLLAMA_URL = ollama.url
+    model = None
+    if args.wav:
+        from vosk import Model
+        model = Model(args.model)
+    server = blossom.Server(tts=StubTts(args.tts_cost, args.tts_char_cost), model=model, asr=bool(args.wav),
+                            max_sessions=max(args.sessions), llm_streams=args.llm_streams,
+                            tts_workers=args.tts_workers)
+    address = server.listen("127.0.0.1", 0)
+    threading.Thread(target=server.serve, daemon=True).start()
+    return server, address
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test for the multi-session server")
+    parser.add_argument("--local", action="store_true", help="start an in-process server with stand-ins")
+    parser.add_argument("--host", default=SERVER_HOST)
+    parser.add_argument("--port", type=int, default=SERVER_PORT)
+    parser.add_argument("--unix", default=SERVER_SOCKET)
+    parser.add_argument("--sessions", default="1,2,4,8,16", help="concurrent session counts to try")
+    parser.add_argument("--turns", type=int, default=3, help="questions per session")
+    parser.add_argument("--think", type=float, default=1.0, help="seconds between a session's questions")
+    parser.add_argument("--stagger", type=float, default=0.05, help="seconds between connections")
+    parser.add_argument("--wav", help="speak this WAV (wake phrase and query) instead of typing queries")
+    parser.add_argument("--model", default=VOSK_MODEL, help="Vosk model for --local with --wav")
+    parser.add_argument("--timeout", type=float, default=60.0, help="seconds to wait for an answer")
+    parser.add_argument("--max-first-audio", type=float, default=3.0, help="p95 target for the first answer audio")
+    parser.add_argument("--tokens", type=int, default=60, help="LLM tokens per answer (--local)")
+    parser.add_argument("--token-rate", type=float, default=30.0, help="LLM tokens per second (--local)")
+    parser.add_argument("--tts-cost", type=float, default=0.3, help="seconds per synthesized sentence (--local)")
+    parser.add_argument("--tts-char-cost", type=float, default=0.002, help="extra seconds per character (--local)")
+    parser.add_argument("--llm-streams", type=int, default=blossom.SERVER_LLM_STREAMS)
+    parser.add_argument("--tts-workers", type=int, default=blossom.SERVER_TTS_WORKERS)
+    parser.add_argument("--output", default="bench_server.json")
+    args = parser.parse_args()
+    args.sessions = [int(count) for count in args.sessions.split(",")]
+
+    pcm = None
+    if args.wav:
+        samples = load_mono(args.wav)
+        if samples is None:
+            sys.exit(f"Could not read {args.wav}")
+        pcm = (np.clip(samples, -1, 1) * 32767).astype('<i2').tobytes()
+
+    results = []
+    ollama = FakeOllama(tokens=args.tokens, token_rate=args.token_rate) if args.local else contextlib.nullcontext()
+    with tempfile.TemporaryDirectory() as workdir, ollama:
+        server = None
+        if args.local:
+            server, address = start_local(workdir, args, ollama)
+        else:
+            address = args.unix or (args.host, args.port)
+        try:
+            for sessions in args.sessions:
+                turns = run_level(address, sessions, args, pcm)
+                summary = summarize(sessions, turns, args)
+                results.append(dict(summary, details=turns))
+                p95 = summary["first_audio_p95"]
+                print(f"{sessions:3d} sessions: first audio p50 {summary['first_audio_p50'] or 0:6.2f} s "
+                      f"p95 {p95 or 0:6.2f} s, turn p95 {summary['turn_p95'] or 0:6.2f} s, "
+                      f"{summary['errors']} errors, {summary['stuttering']} stuttering "
+                      f"-> {'ok' if summary['passed'] else 'over target'}")
+        finally:
+            if server:
+                server.close()
+
+    passed = [result["sessions"] for result in results if result["passed"]]
+    print(f"max concurrent sessions within target: {max(passed) if passed else 0}")
+    with open(args.output, "w") as file:
+        json.dump({"config": {key: value for key, value in vars(args).items() if key != "output"},
+                   "levels": results}, file, indent=2)
+    print(f"wrote {args.output}")
+
+
+if __name__ == '__main__':
+    main()
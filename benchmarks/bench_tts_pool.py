@@ -0,0 +1,137 @@
+"""
+TTS worker pool benchmark.
+
+Synthesizes a multi-sentence answer with one sentence at a time in-process
+(0 workers) and with TtsPool at each worker count. For each run it reports:
+- total synthesis time and speed-up over the serial run;
+- time until the first clip, in order, is ready;
+- the real-time factor (synthesis seconds per second of audio).
+It also reports each worker's proportional set size (PSS). Workers are started
+with 'forkserver' or 'spawn' and each loads its own copy of the model, so expect
+about one model per worker.
+
+Set --threads so workers * threads stays within the cores left over after
+NUM_THREAD for Ollama. --stub replaces XTTS with a CPU-bound stand-in, to check
+the pool's overhead without the model, and to check that clips come back
+in sentence order.
+
+Usage: python benchmarks/bench_tts_pool.py [--workers 1,2,4] [--threads 1] [--start forkserver]
+                                           [--text answer.txt] [--repeat 2] [--stub]
+"""
+import os
+import re
+import sys
+import time
+import argparse
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+from settings import SPEAKER_WAV, TTS_WORKER_THREADS, TTS_POOL_START
+from tts_handler import TtsHandler, TtsPool
+from bench_e2e import StubTts
+
+TEXT = ("The attacker has established persistence on the domain controller. "
+        "A scheduled task runs an encoded PowerShell command every ten minutes. "
+        "Outbound traffic to a lookalike domain started shortly after midnight. "
+        "Two service accounts logged in from a workstation in the finance department. "
+        "The backup server is still reachable from the compromised subnet. "
+        "What is your next move?")
+
+
+class BusyTts(StubTts):
+    """Stand-in that burns CPU instead of sleeping, so workers compete for cores like XTTS does."""
+    def synthesize(self, text, speaker_wav=None, language="en"):
+        deadline = time.process_time() + self.cost + self.char_cost * len(text)
+        while time.process_time() < deadline:
+            pass
+        return np.zeros(int(len(text) * self.char_seconds * self.rate), dtype=np.float32)
+
+
+def pss_mb(pid):
+    """Proportional set size of a process in MB, or None where /proc is unavailable."""
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as file:
+            for line in file:
+                if line.startswith("Pss:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        return None
+    return None
+
+
+def run_serial(tts, sentences):
+    start = time.perf_counter()
+    first = None
+    clips = []
+    for sentence in sentences:
+        clips.append(tts.render(sentence, SPEAKER_WAV))
+        first = first or time.perf_counter() - start
+    return time.perf_counter() - start, first, clips
+
+
+def run_pool(pool, sentences):
+    start = time.perf_counter()
+    futures = [pool.submit(sentence, SPEAKER_WAV) for sentence in sentences]
+    first = None
+    clips = []
+    for future in futures:
+        clips.append(future.result())
+        first = first or time.perf_counter() - start
+    return time.perf_counter() - start, first, clips
+
+
+def main():
+    parser = argparse.ArgumentParser(description="TTS worker pool benchmark")
+    parser.add_argument("--workers", default="1,2,4", help="worker counts to compare with the serial run")
+    parser.add_argument("--threads", type=int, default=TTS_WORKER_THREADS, help="torch threads per worker")
+    parser.add_argument("--start", default=TTS_POOL_START, choices=("forkserver", "spawn"))
+    parser.add_argument("--text", help="file with the answer to synthesize")
+    parser.add_argument("--repeat", type=int, default=2)
+    parser.add_argument("--stub", action="store_true", help="use a CPU-bound stand-in instead of XTTS")
+    args = parser.parse_args()
+
+    text = TEXT
+    if args.text:
+        with open(args.text) as file:
+            text = file.read()
+    if args.stub:
+        tts = BusyTts(cost=0.4, char_cost=0.004)
+    else:
+        import torch
+        tts = TtsHandler(torch.device("cpu"))
+        if tts.supports_latents:
+            tts.conditioning(SPEAKER_WAV)
+    sentences = [sentence for sentence in re.split(r'(?<=[.!?])\s+', text.strip()) if sentence]
+    print(f"{len(sentences)} sentences, {len(text)} characters, {os.cpu_count()} cores")
+
+    # warm up the serial path once, so lazy initialization isn't timed
+    tts.render(sentences[0], SPEAKER_WAV)
+    timings = [run_serial(tts, sentences) for _ in range(args.repeat)]
+    serial = min(timing[0] for timing in timings)
+    reference = timings[0][2]
+    audio = sum(clip.duration for clip in reference)
+    print(f"{'serial':>10}  total {serial:7.2f} s  first {min(t[1] for t in timings):6.2f} s  "
+          f"RTF {serial / audio:5.2f}  PSS {pss_mb(os.getpid()) or 0:8.1f} MB")
+
+    for workers in (int(count) for count in args.workers.split(",")):
+        pool = TtsPool(tts, workers, args.threads, args.start)
+        try:
+            run_pool(pool, sentences[:workers])
+            timings = [run_pool(pool, sentences) for _ in range(args.repeat)]
+            total = min(timing[0] for timing in timings)
+            first = min(timing[1] for timing in timings)
+            # the stand-in's clip lengths follow the text, so they show the order
+            ordered = all(len(clip.data) == len(expected.data)
+                          for clip, expected in zip(timings[0][2], reference)) if args.stub else None
+            memory = [pss_mb(process.pid) for process in pool.processes]
+            memory = f"{np.mean(memory):8.1f} MB each" if None not in memory else "n/a"
+            print(f"{workers:>3} workers  total {total:7.2f} s  first {first:6.2f} s  RTF {total / audio:5.2f}  "
+                  f"speed-up {serial / total:4.2f}x  PSS {memory}"
+                  + ("" if ordered is None else f"  {'in order' if ordered else 'OUT OF ORDER'}"))
+        finally:
+            pool.close()
+
+
+if __name__ == '__main__':
+    main()
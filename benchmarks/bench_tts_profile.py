@@ -0,0 +1,175 @@
+"""
+CPU inference profile benchmark for XTTS.
+
+Adds the parts of the CPU profile one at a time on a CPU-only model:
+  default         torch's own thread settings, no inference mode
+  threads         torch threads from cpu_threads(), leaving NUM_THREAD cores to Ollama
+  inference_mode  as above, synthesizing in torch.inference_mode
+  int8            as above, with the linear layers dynamically quantized to int8
+Every variant synthesizes the same sentences with each bundled speaker WAV, with
+the sampling seed reset per sentence, and reports the real-time factor
+(synthesis seconds per second of audio). Warm-up is measured separately as the
+first sentence of a freshly loaded model against the median sentence after it.
+
+Output quality is scored afterwards on a fresh full-precision model:
+  similarity  cosine between the speaker embedding of the output and of the reference WAV
+  wer         word error rate of a Vosk transcript of the output (with --vosk)
+
+Usage: python benchmarks/bench_tts_profile.py [--speakers audio/speaker.wav,...] [--runs 2]
+                                              [--vosk vosk-model] [--output bench_tts_profile.json]
+"""
+import os
+import re
+import sys
+import gc
+import glob
+import json
+import time
+import argparse
+import tempfile
+import statistics
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+import torch
+import soundfile as sf
+from settings import NUM_THREAD, SAMPLING_RATE
+from tts_handler import TtsHandler, cpu_threads, set_torch_threads
+
+SENTENCES = (
+    "The attacker has established persistence on the domain controller.",
+    "Outbound traffic to a lookalike domain started shortly after midnight.",
+    "Isolate the host, reset the service account and review the scheduled tasks.",
+)
+VARIANTS = ("default", "threads", "inference_mode", "int8")
+
+
+def words(text):
+    return re.sub(r"[^a-z0-9' ]", " ", text.lower()).split()
+
+
+def word_error_rate(reference, hypothesis):
+    """Word-level edit distance divided by the reference length."""
+    reference, hypothesis = words(reference), words(hypothesis)
+    previous = list(range(len(hypothesis) + 1))
+    for i, ref in enumerate(reference, 1):
+        current = [i]
+        for j, hyp in enumerate(hypothesis, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ref != hyp)))
+        previous = current
+    return previous[-1] / max(len(reference), 1)
+
+
+def transcribe(model, samples, rate):
+    """Transcribes float samples with Vosk."""
+    import librosa
+    from vosk import KaldiRecognizer
+    recognizer = KaldiRecognizer(model, SAMPLING_RATE)
+    pcm = (np.clip(librosa.resample(samples, orig_sr=rate, target_sr=SAMPLING_RATE), -1, 1) * 32767)
+    recognizer.AcceptWaveform(pcm.astype('<i2').tobytes())
+    return json.loads(recognizer.FinalResult()).get("text", "")
+
+
+def speaker_embedding(tts, path):
+    _, embedding = tts.model.get_conditioning_latents(audio_path=[path], **tts.conditioning_args())
+    return embedding.flatten().float()
+
+
+def synthesize(tts, text, speaker, seed):
+    torch.manual_seed(seed)
+    start = time.perf_counter()
+    samples = tts.synthesize(text, speaker)
+    return samples, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="CPU inference profile benchmark for XTTS")
+    parser.add_argument("--speakers", help="comma-separated speaker WAVs (default: the bundled ones)")
+    parser.add_argument("--runs", type=int, default=2, help="timed passes per variant")
+    parser.add_argument("--vosk", help="Vosk model for the word error rate")
+    parser.add_argument("--output", default="bench_tts_profile.json")
+    args = parser.parse_args()
+
+    speakers = args.speakers.split(",") if args.speakers else sorted(glob.glob(os.path.join(ROOT, "audio", "speaker*.wav")))
+    default_threads = torch.get_num_threads()
+    print(f"{os.cpu_count()} cores, torch default {default_threads} threads, "
+          f"profile {cpu_threads()} threads (NUM_THREAD={NUM_THREAD})")
+
+    device = torch.device("cpu")
+    load_start = time.perf_counter()
+    tts = TtsHandler(device, cpu_profile=False)
+    print(f"model loaded in {time.perf_counter() - load_start:.1f} s")
+    for speaker in speakers:
+        tts.conditioning(speaker)
+
+    # warm-up: the first sentence of a fresh model against the ones after it
+    _, cold = synthesize(tts, SENTENCES[0], speakers[0], 0)
+    warm = statistics.median(synthesize(tts, SENTENCES[0], speakers[0], 0)[1] for _ in range(3))
+    print(f"first sentence {cold:.2f} s, warm {warm:.2f} s: warm-up saves {cold - warm:.2f} s")
+
+    workdir = tempfile.mkdtemp(prefix="bench_tts_profile_")
+    results = {"cores": os.cpu_count(), "warmup": {"cold": cold, "warm": warm}, "variants": {}}
+    outputs = []  # (variant, speaker, text, path)
+    for variant in VARIANTS:
+        if variant == "default":
+            set_torch_threads(default_threads)
+        else:
+            set_torch_threads(cpu_threads())
+        tts.inference_mode = variant in ("inference_mode", "int8")
+        if variant == "int8":
+            tts.quantize()
+            for speaker in speakers:
+                tts.conditioning(speaker)
+            synthesize(tts, SENTENCES[0], speakers[0], 0)
+
+        seconds = audio = 0.0
+        for run in range(args.runs):
+            for s, speaker in enumerate(speakers):
+                for i, text in enumerate(SENTENCES):
+                    samples, elapsed = synthesize(tts, text, speaker, i)
+                    seconds += elapsed
+                    audio += len(samples) / tts.sample_rate
+                    if run == 0:
+                        path = os.path.join(workdir, f"{variant}_{s}_{i}.wav")
+                        sf.write(path, samples, tts.sample_rate)
+                        outputs.append((variant, speaker, text, path))
+        results["variants"][variant] = {"rtf": seconds / audio}
+        print(f"{variant:<15} RTF {seconds / audio:5.2f}")
+
+    rate = tts.sample_rate
+    del tts
+    gc.collect()
+
+    # score every output with the same full-precision model
+    scorer = TtsHandler(device, cpu_profile=False)
+    vosk_model = None
+    if args.vosk:
+        from vosk import Model
+        vosk_model = Model(args.vosk)
+    references = {speaker: speaker_embedding(scorer, speaker) for speaker in speakers}
+    for variant in VARIANTS:
+        similarity, wer = [], []
+        for output_variant, speaker, text, path in outputs:
+            if output_variant != variant:
+                continue
+            embedding = speaker_embedding(scorer, path)
+            similarity.append(float(torch.nn.functional.cosine_similarity(embedding, references[speaker], dim=0)))
+            if vosk_model:
+                samples, _ = sf.read(path, dtype="float32")
+                wer.append(word_error_rate(text, transcribe(vosk_model, samples, rate)))
+        scores = results["variants"][variant]
+        scores["similarity"] = float(np.mean(similarity))
+        scores["wer"] = float(np.mean(wer)) if wer else None
+        line = f"{variant:<15} RTF {scores['rtf']:5.2f}  speaker similarity {scores['similarity']:.3f}"
+        if scores["wer"] is not None:
+            line += f"  WER {scores['wer']:.3f}"
+        print(line)
+
+    with open(args.output, "w") as file:
+        json.dump(results, file, indent=2)
+    print(f"wrote {args.output}; synthesized audio kept in {workdir}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,170 @@
+"""
+Voice activity gate benchmark.
+
+Replays the WAVs under audio/ as 16 kHz mono, separated by stretches of
+low-level noise, through VoiceActivityGate in FRAMES_PER_BUFFER chunks. It reports
+how many chunks reach the recognizer. With --model, the Vosk recognizer is also run
+over all chunks and over the gated chunks, to show the decoder CPU time saved.
+
+It also checks that the two-stage recognizer's full stage goes idle behind the
+gate: the full stage is woken at the first clip, and the session is replayed
+through recognize() with a stand-in decoder. The full stage should go idle once
+WAKE_WINDOW_SECONDS of audio has passed without a final result. That includes
+silence the gate never passes on.
+
+Usage: python benchmarks/bench_vad.py [--silence 5] [--model vosk-model]
+"""
+import os
+import sys
+import json
+import time
+import wave
+import glob
+import argparse
+import numpy as np
+from collections import deque
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+from settings import SAMPLING_RATE, FRAMES_PER_BUFFER, WAKE_WINDOW_SECONDS
+from asr_handler import VoiceActivityGate, WakeMatcher, TwoStageRecognizer, recognize
+
+
+def load_mono(path, rate=SAMPLING_RATE):
+    """Loads an audio file as float mono at the given rate."""
+    try:
+        with wave.open(path, 'rb') as wf:
+            samples = np.frombuffer(wf.readframes(wf.getnframes()), dtype='<i2').astype(np.float32) / 32768
+            samples = samples.reshape(-1, wf.getnchannels()).mean(axis=1)
+            source_rate = wf.getframerate()
+    except wave.Error:
+        # some bundled samples are compressed audio with a .wav extension
+        try:
+            import librosa
+        except ImportError:
+            print(f"skipping {os.path.basename(path)}: not PCM WAV and librosa is not installed")
+            return None
+        samples, source_rate = librosa.load(path, sr=None, mono=True)
+    positions = np.arange(0, len(samples), source_rate / rate)
+    return np.interp(positions, np.arange(len(samples)), samples).astype(np.float32)
+
+
+def build_session(paths, silence, rng):
+    """Concatenates the clips with noisy silence around them and splits the result into chunks."""
+    gap = lambda: (rng.standard_normal(int(silence * SAMPLING_RATE)) * 0.002).astype(np.float32)
+    parts, clips = [gap()], 0
+    for path in paths:
+        samples = load_mono(path)
+        if samples is not None:
+            parts.extend((samples, gap()))
+            clips += 1
+    pcm = (np.clip(np.concatenate(parts), -1, 1) * 32767).astype('<i2').tobytes()
+    step = FRAMES_PER_BUFFER * 2
+    return [pcm[i:i + step] for i in range(0, len(pcm), step)], clips
+
+
+class SilentDecoder:
+    """Stand-in for a KaldiRecognizer that never hears any words."""
+    def AcceptWaveform(self, data):
+        return False
+
+    def PartialResult(self):
+        return '{"partial": ""}'
+
+    def Result(self):
+        return '{"text": ""}'
+
+    FinalResult = Result
+
+    def Reset(self):
+        pass
+
+
+class StubTwoStage(TwoStageRecognizer):
+    """TwoStageRecognizer on stand-in decoders, so its listening window can be checked without Vosk."""
+    def __init__(self, rate=SAMPLING_RATE, window=WAKE_WINDOW_SECONDS):
+        self.wake = SilentDecoder()
+        self.full = SilentDecoder()
+        self.matcher = WakeMatcher()
+        self.rate = rate
+        self.window = window
+        self.preroll = deque(maxlen=1)
+        self.active = False
+        self.remaining = 0.0
+
+
+def window_check(chunks, gated_only=False):
+    """
+    Wakes the full stage at the first chunk the gate passes and returns the seconds until it
+    went idle, or None. gated_only feeds just the chunks the gate passes, as before recognize().
+    """
+    recognizer = StubTwoStage()
+    gate = VoiceActivityGate(SAMPLING_RATE)
+    seconds = FRAMES_PER_BUFFER / SAMPLING_RATE
+    woken = None
+    for i, chunk in enumerate(chunks):
+        passed = gate.chunks_decoded
+        if gated_only:
+            for out in gate.process(chunk):
+                recognizer.feed(out)
+        else:
+            recognize(recognizer, gate, chunk)
+        if woken is None:
+            if gate.chunks_decoded > passed:
+                woken = i
+                recognizer.preroll.append(chunk)
+                recognizer._activate()
+        elif not recognizer.active:
+            return (i - woken) * seconds
+    return None
+
+
+def decode_time(model, chunks):
+    """Returns the CPU seconds the recognizer spends on the chunks, and its transcript."""
+    from vosk import KaldiRecognizer
+    recognizer = KaldiRecognizer(model, SAMPLING_RATE)
+    text = []
+    start = time.process_time()
+    for chunk in chunks:
+        if recognizer.AcceptWaveform(chunk):
+            text.append(json.loads(recognizer.Result()).get('text', ''))
+    text.append(json.loads(recognizer.FinalResult()).get('text', ''))
+    return time.process_time() - start, ' '.join(t for t in text if t)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Voice activity gate benchmark")
+    parser.add_argument("--silence", type=float, default=5.0, help="seconds of noise around each clip")
+    parser.add_argument("--model", help="Vosk model directory for decoder CPU measurement")
+    args = parser.parse_args()
+
+    paths = sorted(glob.glob(os.path.join(ROOT, "audio", "*.wav")))
+    chunks, clips = build_session(paths, args.silence, np.random.default_rng(0))
+
+    gate = VoiceActivityGate(SAMPLING_RATE)
+    start = time.process_time()
+    gated = [out for chunk in chunks for out in gate.process(chunk)]
+    gate_cpu = time.process_time() - start
+
+    stats = gate.stats()
+    print(f"clips: {clips}  audio: {len(chunks) * FRAMES_PER_BUFFER / SAMPLING_RATE:.1f} s")
+    print(f"chunks seen: {stats['chunks_seen']}  decoded: {stats['chunks_decoded']}  "
+          f"skipped: {stats['skipped_ratio']:.0%}  gate cpu: {gate_cpu * 1e3:.1f} ms")
+
+    for label, gated_only in (("recognize()", False), ("gated chunks only", True)):
+        idle = window_check(chunks, gated_only)
+        print(f"two-stage window {WAKE_WINDOW_SECONDS:.1f} s, {label}: full stage "
+              + (f"went idle {idle:.1f} s after waking" if idle is not None else "never went idle"))
+
+    if args.model:
+        from vosk import Model
+        model = Model(args.model)
+        full_cpu, full_text = decode_time(model, chunks)
+        gated_cpu, gated_text = decode_time(model, gated)
+        print(f"decoder cpu  ungated: {full_cpu:.2f} s  gated: {gated_cpu:.2f} s  "
+              f"saved: {1 - gated_cpu / full_cpu:.0%}")
+        print(f"transcripts match: {full_text == gated_text}")
+
+
+if __name__ == '__main__':
+    main()
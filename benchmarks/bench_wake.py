@@ -0,0 +1,138 @@
+"""
+Wake detection benchmark.
+
+Compares the previous substring wake check (final results only) with
+WakeMatcher on partial results.
+
+Text mode runs both matchers over a built-in set of labelled transcripts and
+reports false-trigger and miss rates. With --fixtures, each WAV listed in a
+JSONL manifest ({"wav": "path.wav", "wake": true}) is replayed through Vosk in
+FRAMES_PER_BUFFER chunks, and the audio time at which each method fires is
+recorded to give wake-to-cue latency.
+
+Usage: python benchmarks/bench_wake.py [--fixtures manifest.jsonl] [--model vosk-model]
+"""
+import os
+import sys
+import json
+import wave
+import argparse
+import statistics
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from settings import NAME, CALL_WORDS, FRAMES_PER_BUFFER, VOSK_MODEL
+from asr_handler import WakeMatcher
+
+TRANSCRIPTS = [
+    ("hey blossom what is phishing", True),
+    ("okay blossom start a ransomware attack", True),
+    ("blossom set level to three", True),
+    ("are you there blossom", True),
+    ("hello blossom", True),
+    ("the blossom on the cherry tree is early", False),
+    ("she blossomed into a great analyst", False),
+    ("check the blossom server logs", False),
+    ("what is a blossom filter", False),
+    ("we had a meeting about the firewall rules", False),
+    ("the cherry blossom festival", False),
+    ("he said blossom was slow today", False),
+]
+
+
+def legacy_match(text, name=NAME):
+    """The previous wake check from Core.recognize_speech."""
+    query_lower = text.lower().strip()
+    query_words = query_lower.split()
+    name_lower = name.lower()
+    if any(word in query_lower for word in CALL_WORDS):
+        for word in CALL_WORDS:
+            if f'{word} {name_lower}' in query_lower:
+                return query_lower.split(f'{word} {name_lower}', 1)[1].strip()
+    if query_words and query_words[0] == name_lower and len(query_words) > 2:
+        return " ".join(query_words[1:])
+    return None
+
+
+def rates(match, samples):
+    """Returns (false-trigger rate, miss rate) of a matcher over labelled samples."""
+    false = sum(1 for text, wake in samples if not wake and match(text) is not None)
+    missed = sum(1 for text, wake in samples if wake and match(text) is None)
+    negatives = sum(1 for _, wake in samples if not wake) or 1
+    positives = sum(1 for _, wake in samples if wake) or 1
+    return false / negatives, missed / positives
+
+
+def replay(model, path, matcher):
+    """Replays a WAV and returns (legacy fire time, partial fire time, final transcript)."""
+    from vosk import KaldiRecognizer
+    with wave.open(path, 'rb') as wf:
+        rate = wf.getframerate()
+        recognizer = KaldiRecognizer(model, rate)
+        legacy_at = partial_at = None
+        transcript = []
+        position = 0
+        while True:
+            data = wf.readframes(FRAMES_PER_BUFFER)
+            if not data:
+                break
+            position += len(data) // (wf.getsampwidth() * wf.getnchannels())
+            now = position / rate
+            if recognizer.AcceptWaveform(data):
+                text = json.loads(recognizer.Result()).get('text', '')
+                transcript.append(text)
+                if legacy_at is None and text and legacy_match(text) is not None:
+                    legacy_at = now
+                if partial_at is None and text and matcher.match(text) is not None:
+                    partial_at = now
+            elif partial_at is None:
+                partial = json.loads(recognizer.PartialResult()).get('partial', '')
+                if partial and matcher.match(partial) is not None:
+                    partial_at = now
+        text = json.loads(recognizer.FinalResult()).get('text', '')
+        transcript.append(text)
+        end = position / rate
+        if legacy_at is None and text and legacy_match(text) is not None:
+            legacy_at = end
+        if partial_at is None and text and matcher.match(text) is not None:
+            partial_at = end
+    return legacy_at, partial_at, ' '.join(t for t in transcript if t)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Wake detection benchmark")
+    parser.add_argument("--fixtures", help="JSONL manifest of WAV fixtures with wake labels")
+    parser.add_argument("--model", default=VOSK_MODEL)
+    args = parser.parse_args()
+
+    matcher = WakeMatcher(NAME, CALL_WORDS)
+    for label, match in (("legacy", legacy_match), ("matcher", matcher.match)):
+        false, missed = rates(match, TRANSCRIPTS)
+        print(f"text {label:<8} false triggers: {false:.0%}  misses: {missed:.0%}")
+
+    if not args.fixtures:
+        return
+
+    from vosk import Model
+    model = Model(args.model)
+    base = os.path.dirname(os.path.abspath(args.fixtures))
+    legacy_fired, partial_fired, latency_gain = [], [], []
+    with open(args.fixtures) as file:
+        fixtures = [json.loads(line) for line in file if line.strip()]
+    for fixture in fixtures:
+        legacy_at, partial_at, transcript = replay(model, os.path.join(base, fixture["wav"]), matcher)
+        legacy_fired.append(legacy_at is not None)
+        partial_fired.append(partial_at is not None)
+        if fixture["wake"] and legacy_at is not None and partial_at is not None:
+            latency_gain.append(legacy_at - partial_at)
+        print(f"{fixture['wav']:<30} legacy: {legacy_at}  partial: {partial_at}  '{transcript}'")
+
+    negatives = [i for i, fixture in enumerate(fixtures) if not fixture["wake"]]
+    if negatives:
+        print(f"audio false triggers  legacy: {sum(legacy_fired[i] for i in negatives) / len(negatives):.0%}  "
+              f"matcher: {sum(partial_fired[i] for i in negatives) / len(negatives):.0%}")
+    if latency_gain:
+        print(f"wake-to-cue latency reduction: median {statistics.median(latency_gain) * 1e3:.0f} ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,158 @@
+"""
+Local stand-in for the Ollama /api/generate endpoint.
+
+Streams NDJSON token records like Ollama does, with a configurable token count,
+token rate and HTTP write size. Small write sizes split records across chunk
+boundaries, which is what the client parser has to cope with.
+
+With a prompt evaluation rate, the first token is delayed by the time it takes
+to evaluate the prompt. Like Ollama, the final record returns a context; a request
+that sends back a context issued by this server only pays for its new tokens,
+while an unknown context is evaluated in full. Prompts are counted with a rough
+BPE estimate (words split into pieces of up to six characters, punctuation on its
+own) plus the template tokens around each message, which puts SIM_PROMPT near the
+~580 tokens a Llama tokenizer gives it. num_predict caps the streamed tokens.
+"""
+import re
+import json
+import time
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+TEMPLATE_TOKENS = 5  # header and end-of-turn tokens the prompt template adds around each message
+WORDS = ("the attacker pivots through the exposed VPN gateway and harvests "
+         "credentials from a phishing page hosted on a lookalike domain").split()
+
+
+def count_tokens(text):
+    """Estimates the tokens in a message, including its template header."""
+    return len(re.findall(r"\w{1,6}|[^\w\s]", text)) + TEMPLATE_TOKENS if text else 0
+
+
+def make_tokens(count):
+    """Builds a deterministic token stream with a sentence end every 12 tokens."""
+    tokens = []
+    for i in range(count):
+        token = " " + WORDS[i % len(WORDS)]
+        if i % 12 == 11:
+            token += "."
+        tokens.append(token)
+    return tokens
+
+
+class FakeOllama:
+    """Runs a threaded HTTP server that imitates Ollama's streaming generate API."""
+    def __init__(self, tokens=2000, token_rate=None, write_size=None, prompt_eval_rate=None,
+                 host="127.0.0.1", port=0):
+        self.tokens = make_tokens(tokens) if isinstance(tokens, int) else list(tokens)
+        self.token_rate = token_rate
+        self.write_size = write_size
+        self.prompt_eval_rate = prompt_eval_rate
+        self.contexts = set()  # contexts handed out, standing in for the KV cache
+        self.requests = []
+        self.disconnects = 0  # streams the client closed before they finished
+        self.first_tokens = []  # perf_counter() when each stream wrote its first token
+
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def send_chunk(self, data):
+                self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                fake.requests.append(body)
+
+                self.send_response(200)
+                self.send_header("Content-Type", "application/x-ndjson")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+
+                if not body.get("prompt"):
+                    # preload/unload requests answer with a single done record
+                    self.send_chunk(json.dumps({"model": body.get("model"), "response": "", "done": True}).encode() + b"\n")
+                    self.wfile.write(b"0\r\n\r\n")
+                    return
+
+                try:
+                    self.stream(body)
+                except (BrokenPipeError, ConnectionResetError):
+                    fake.disconnects += 1
+                    self.close_connection = True
+
+            def stream(self, body):
+                start = time.perf_counter()
+                context = list(body.get("context") or [])
+                # the system and user messages, and the header of the answer
+                new = count_tokens(body.get("system", "")) + count_tokens(body.get("prompt", "")) + TEMPLATE_TOKENS
+                limit = body.get("options", {}).get("num_predict", -1)
+                tokens = fake.tokens[:limit] if limit >= 0 else fake.tokens
+                evaluated = new if tuple(context) in fake.contexts else len(context) + new
+                if fake.prompt_eval_rate:
+                    time.sleep(evaluated / fake.prompt_eval_rate)
+                prompt_elapsed = int((time.perf_counter() - start) * 1e9)
+
+                start = time.perf_counter()
+                pending = b""
+                for i, token in enumerate(tokens):
+                    if fake.token_rate:
+                        delay = start + i / fake.token_rate - time.perf_counter()
+                        if delay > 0:
+                            time.sleep(delay)
+                    pending += json.dumps({"model": body.get("model"), "response": token, "done": False}).encode() + b"\n"
+                    pending = self.flush(pending)
+                    if i == 0:
+                        fake.first_tokens.append(time.perf_counter())
+
+                elapsed = int((time.perf_counter() - start) * 1e9)
+                size = len(context) + new + len(tokens)
+                context += range(len(context), size)
+                fake.contexts.add(tuple(context))
+                pending += json.dumps({
+                    "model": body.get("model"), "response": "", "done": True, "context": context,
+                    "total_duration": prompt_elapsed + elapsed, "load_duration": 0,
+                    "prompt_eval_count": evaluated, "prompt_eval_duration": prompt_elapsed,
+                    "eval_count": len(tokens), "eval_duration": elapsed,
+                }).encode() + b"\n"
+                self.flush(pending, final=True)
+                self.wfile.write(b"0\r\n\r\n")
+
+            def flush(self, pending, final=False):
+                """Writes pending bytes in write_size pieces, keeping any remainder for later."""
+                size = fake.write_size
+                if not size:
+                    self.send_chunk(pending)
+                    return b""
+                while len(pending) >= size or (final and pending):
+                    self.send_chunk(pending[:size])
+                    pending = pending[size:]
+                return pending
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
@@ -1,14 +1,28 @@
 # Cache Handler
-from collections import OrderedDict
+from collections import OrderedDict, defaultdict
+import os
+import json
+import wave
+import hashlib
+import queue
+import logging
+import sqlite3
+import itertools
+import threading
+import time
+from audio_handler import AudioClip
 
 class LRUCache:
     """
     Implements a Least Recently Used (LRU) cache using an OrderedDict.
     When the cache reaches its capacity, the least recently used item is removed.
+    Optional on_update/on_evict callbacks receive the key of every changed or evicted item.
     """
-    def __init__(self, capacity):
+    def __init__(self, capacity, on_update=None, on_evict=None):
         self.cache = OrderedDict()
         self.capacity = capacity
+        self.on_update = on_update
+        self.on_evict = on_evict
 
     def get(self, key):
         """
@@ -17,6 +31,8 @@ class LRUCache:
         """
         if key in self.cache:
             self.cache.move_to_end(key)
+            if self.on_update:
+                self.on_update(key)
             return self.cache[key]
         return None
 
@@ -29,8 +45,12 @@ class LRUCache:
         if key in self.cache:
             self.cache.move_to_end(key)
         elif len(self.cache) >= self.capacity:
-            self.cache.popitem(last=False)
+            evicted, _ = self.cache.popitem(last=False)
+            if self.on_evict:
+                self.on_evict(evicted)
         self.cache[key] = value
+        if self.on_update:
+            self.on_update(key)
 
     def to_dict(self):
         """Returns the cache as a dictionary."""
@@ -44,12 +64,74 @@ class LRUCache:
 class LFUCache:
     """
     Implements a Least Frequently Used (LFU) cache.
-    Tracks usage frequency and removes the least frequently used item when full.
+    Keys are grouped into frequency buckets, each an OrderedDict (a doubly linked list
+    keyed by access count), so get, put and eviction all run in O(1).
+    Ties between equally used keys are broken by recency: the least recently used key
+    in the lowest bucket is evicted first.
+    An optional byte budget caps the total serialized size of the stored values.
+    Optional on_update/on_evict callbacks receive the key of every changed or evicted item.
     """
-    def __init__(self, capacity):
+    def __init__(self, capacity, max_bytes=None, on_update=None, on_evict=None):
         self.cache = {}
         self.freq = {}
+        self.sizes = {}
+        self.buckets = defaultdict(OrderedDict)
+        self.min_freq = None
+        self.total_bytes = 0
         self.capacity = capacity
+        self.max_bytes = max_bytes
+        self.on_update = on_update
+        self.on_evict = on_evict
+
+    @staticmethod
+    def size_of(value):
+        """Estimates the size of a value as the length of its JSON encoding in bytes."""
+        return len(json.dumps(value).encode('utf-8'))
+
+    def _touch(self, key):
+        """Moves a key from its current frequency bucket to the next one."""
+        count = self.freq[key]
+        bucket = self.buckets[count]
+        del bucket[key]
+        if not bucket:
+            del self.buckets[count]
+            if self.min_freq == count:
+                self.min_freq = count + 1
+        self.freq[key] = count + 1
+        self.buckets[count + 1][key] = None
+
+    def _unlink(self, key):
+        """Removes a key from the cache and returns its frequency."""
+        count = self.freq.pop(key)
+        bucket = self.buckets[count]
+        del bucket[key]
+        if not bucket:
+            del self.buckets[count]
+            if self.min_freq == count:
+                # resolved lazily by the next eviction, inserts usually reset it to 1
+                self.min_freq = None
+        self.total_bytes -= self.sizes.pop(key)
+        del self.cache[key]
+        return count
+
+    def _evict(self):
+        """Removes the least recently used key from the lowest frequency bucket."""
+        if self.min_freq is None:
+            self.min_freq = min(self.buckets)
+        key = next(iter(self.buckets[self.min_freq]))
+        self._unlink(key)
+        if self.on_evict:
+            self.on_evict(key)
+
+    def _link(self, key, value, count, size):
+        """Stores a key as the most recent entry of the given frequency bucket."""
+        self.cache[key] = value
+        self.freq[key] = count
+        self.sizes[key] = size
+        self.total_bytes += size
+        self.buckets[count][key] = None
+        if count == 1 or (self.min_freq is not None and count < self.min_freq):
+            self.min_freq = count
 
     def get(self, key):
         """
@@ -57,33 +139,338 @@ class LFUCache:
         Increases the access frequency of the key.
         """
         if key in self.cache:
-            self.freq[key] += 1
+            self._touch(key)
+            if self.on_update:
+                self.on_update(key)
             return self.cache[key]
         return None
 
     def put(self, key, value):
         """
         Adds a key-value pair to the cache.
-        If the key exists, increments its frequency.
-        If the cache is at capacity, removes the least frequently used item before adding a new one.
+        If the key exists, updates its value and increments its frequency.
+        Evicts the least frequently used items until the item count and byte budget fit.
+        Values larger than the whole byte budget are not stored.
         """
+        size = self.size_of(value) if self.max_bytes is not None else 0
+        if self.capacity <= 0 or (self.max_bytes is not None and size > self.max_bytes):
+            return
+
+        count = 0
         if key in self.cache:
-            self.freq[key] += 1
-        else:
-            if len(self.cache) >= self.capacity:
-                least_used = min(self.freq, key=self.freq.get, default=None)
-                if least_used:
-                    del self.cache[least_used]
-                    del self.freq[least_used]
-            self.cache[key] = value
-            self.freq[key] = 1
+            count = self._unlink(key)
+        elif len(self.cache) >= self.capacity:
+            self._evict()
+
+        while self.max_bytes is not None and self.cache and self.total_bytes + size > self.max_bytes:
+            self._evict()
+
+        self._link(key, value, count + 1, size)
+        if self.on_update:
+            self.on_update(key)
 
     def to_dict(self):
-        """Returns the cache and frequency data as a dictionary."""
-        return {'cache': self.cache, 'freq': self.freq}
+        """Returns the cache and frequency data as a dictionary, ordered from least to most used."""
+        cache = {}
+        for count in sorted(self.buckets):
+            for key in self.buckets[count]:
+                cache[key] = self.cache[key]
+        return {'cache': cache, 'freq': {key: self.freq[key] for key in cache}}
 
     def load(self, data):
         """Loads cache and frequency data from a dictionary."""
-        self.cache = dict(data.get('cache', {}))
-        self.freq = dict(data.get('freq', {}))
+        cache = dict(data.get('cache', {}))
+        freq = dict(data.get('freq', {}))
+        self.__init__(self.capacity, self.max_bytes, self.on_update, self.on_evict)
+
+        # stable sort keeps the stored recency order within each frequency
+        for key in sorted(cache, key=lambda k: freq.get(k, 1)):
+            size = self.size_of(cache[key]) if self.max_bytes is not None else 0
+            self._link(key, cache[key], max(int(freq.get(key, 1)), 1), size)
+
+        while self.cache and (len(self.cache) > self.capacity or
+                              (self.max_bytes is not None and self.total_bytes > self.max_bytes)):
+            self._evict()
+
+
+class CacheStore:
+    """
+    Persists LRU and LFU cache entries in SQLite (WAL mode).
+    Changes are queued as they happen and written by a single background thread,
+    which coalesces repeated updates to the same key and commits each batch atomically.
+    The in-memory caches remain the front tier; the store only mirrors them.
+    """
+    def __init__(self, path, flush_interval=0.5):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.pending = queue.Queue()
+        self.seq = itertools.count(self._init_db())
+        self.writer = threading.Thread(target=self._write_loop, daemon=True)
+        self.writer.start()
+
+    def _connect(self):
+        """Opens a connection with WAL journaling enabled."""
+        conn = sqlite3.connect(self.path)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def _init_db(self):
+        """Creates the tables if needed and returns the next sequence number."""
+        with self._connect() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS lru (key TEXT PRIMARY KEY, value TEXT, seq INTEGER)")
+            conn.execute("CREATE TABLE IF NOT EXISTS lfu (key TEXT PRIMARY KEY, value TEXT, freq INTEGER, seq INTEGER)")
+            conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+            last = max(conn.execute("SELECT COALESCE(MAX(seq), 0) FROM lru").fetchone()[0],
+                       conn.execute("SELECT COALESCE(MAX(seq), 0) FROM lfu").fetchone()[0])
+        conn.close()
+        return last + 1
+
+    def put(self, table, key, value, freq=1):
+        """Queues an insert or update of a key in the 'lru' or 'lfu' table."""
+        self.pending.put((table, key, value, freq, next(self.seq)))
+
+    def delete(self, table, key):
+        """Queues the removal of a key from the 'lru' or 'lfu' table."""
+        self.pending.put((table, key, None, None, None))
+
+    def _write_batch(self, conn, batch):
+        """Writes the latest change for each key in one transaction."""
+        with conn:
+            for (table, key), (value, freq, seq) in batch.items():
+                if seq is None:
+                    conn.execute(f"DELETE FROM {table} WHERE key = ?", (key,))
+                elif table == 'lru':
+                    conn.execute("INSERT OR REPLACE INTO lru VALUES (?, ?, ?)",
+                                 (key, json.dumps(value), seq))
+                else:
+                    conn.execute("INSERT OR REPLACE INTO lfu VALUES (?, ?, ?, ?)",
+                                 (key, json.dumps(value), freq, seq))
+
+    def _write_loop(self):
+        """Collects queued changes for up to flush_interval seconds and writes them in batches."""
+        conn = self._connect()
+        running = True
+        while running:
+            item = self.pending.get()
+            batch, waiters = {}, []
+            deadline = time.monotonic() + self.flush_interval
+            while True:
+                if item is None:
+                    running = False
+                elif isinstance(item, threading.Event):
+                    waiters.append(item)
+                else:
+                    table, key, value, freq, seq = item
+                    batch[(table, key)] = (value, freq, seq)
+
+                if not running or waiters:
+                    break
+                try:
+                    item = self.pending.get(timeout=max(deadline - time.monotonic(), 0))
+                except queue.Empty:
+                    break
+
+            try:
+                if batch:
+                    self._write_batch(conn, batch)
+            except sqlite3.Error as e:
+                logging.error(f"Failed to persist cache batch: {e}")
+            for event in waiters:
+                event.set()
+
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        conn.close()
+
+    def flush(self):
+        """Blocks until every change queued so far has been written."""
+        if not self.writer.is_alive():
+            return
+        done = threading.Event()
+        self.pending.put(done)
+        done.wait()
+
+    def close(self):
+        """Writes any pending changes and stops the writer thread."""
+        if self.writer.is_alive():
+            self.pending.put(None)
+            self.writer.join()
+
+    def load(self):
+        """Returns the stored entries in the LRUCache/LFUCache load() format, oldest first."""
+        conn = self._connect()
+        try:
+            lru = {key: json.loads(value) for key, value in
+                   conn.execute("SELECT key, value FROM lru ORDER BY seq")}
+            lfu = {'cache': {}, 'freq': {}}
+            for key, value, freq in conn.execute("SELECT key, value, freq FROM lfu ORDER BY seq"):
+                lfu['cache'][key] = json.loads(value)
+                lfu['freq'][key] = freq
+        finally:
+            conn.close()
+        return {'lru': lru, 'lfu': lfu}
+
+    def import_json(self, json_file):
+        """
+        Imports a legacy cache.json file once. The file is left in place and
+        the import is recorded so later starts skip it.
+        """
+        if not os.path.exists(json_file):
+            return False
+
+        marker = f"imported:{os.path.abspath(json_file)}"
+        conn = self._connect()
+        try:
+            if conn.execute("SELECT 1 FROM meta WHERE key = ?", (marker,)).fetchone():
+                return False
+
+            try:
+                with open(json_file, 'r') as file:
+                    data = json.load(file)
+            except (ValueError, IOError) as e:
+                logging.error(f"Failed to read {json_file}: {e}")
+                return False
+
+            lfu = data.get('lfu', {})
+            with conn:
+                for key, value in data.get('lru', {}).items():
+                    conn.execute("INSERT OR REPLACE INTO lru VALUES (?, ?, ?)",
+                                 (key, json.dumps(value), next(self.seq)))
+                freq = lfu.get('freq', {})
+                for key, value in lfu.get('cache', {}).items():
+                    conn.execute("INSERT OR REPLACE INTO lfu VALUES (?, ?, ?, ?)",
+                                 (key, json.dumps(value), freq.get(key, 1), next(self.seq)))
+                conn.execute("INSERT INTO meta VALUES (?, ?)", (marker, str(time.time())))
+        finally:
+            conn.close()
+        return True
+
+
+class AudioCache:
+    """
+    Content-addressed cache for synthesized speech.
+    Clips are keyed by a hash of (text, speaker, speed, model) and kept in an in-memory
+    LRU tier backed by a directory of WAV files; both tiers are capped by total bytes.
+    """
+    def __init__(self, cache_dir, memory_bytes, disk_bytes):
+        self.cache_dir = cache_dir
+        self.memory_bytes = memory_bytes
+        self.disk_bytes = disk_bytes
+        self.memory = OrderedDict()   # key -> AudioClip
+        self.memory_used = 0
+        self.disk = OrderedDict()     # key -> file size, least recently used first
+        self.disk_used = 0
+        self.hits = {'memory': 0, 'disk': 0}
+        self.misses = 0
+        self.lock = threading.Lock()
+        self._scan_disk()
+
+    @staticmethod
+    def key(text, speaker, speed, model):
+        """Builds the cache key for an utterance."""
+        return hashlib.sha256(json.dumps([text, speaker, round(speed, 3), model]).encode('utf-8')).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.wav")
+
+    def _scan_disk(self):
+        """Indexes the clips already on disk, oldest first."""
+        if not os.path.isdir(self.cache_dir):
+            return
+        entries = []
+        for entry in os.scandir(self.cache_dir):
+            if entry.name.endswith('.wav'):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, entry.name[:-4], stat.st_size))
+        for _, key, size in sorted(entries):
+            self.disk[key] = size
+            self.disk_used += size
+        self._trim_disk()
+
+    def _remember(self, key, clip):
+        """Adds a clip to the memory tier, evicting least recently used clips over budget."""
+        size = len(clip.data)
+        if size > self.memory_bytes:
+            return
+        if key in self.memory:
+            self.memory_used -= len(self.memory.pop(key).data)
+        self.memory[key] = clip
+        self.memory_used += size
+        while self.memory_used > self.memory_bytes:
+            _, evicted = self.memory.popitem(last=False)
+            self.memory_used -= len(evicted.data)
+
+    def _trim_disk(self):
+        """Deletes least recently used files until the disk tier fits its budget."""
+        while self.disk_used > self.disk_bytes and self.disk:
+            key, size = self.disk.popitem(last=False)
+            self.disk_used -= size
+            try:
+                os.remove(self._path(key))
+            except OSError:
+                pass
+
+    def get(self, key):
+        """Returns the cached AudioClip for a key, or None."""
+        with self.lock:
+            clip = self.memory.get(key)
+            if clip is not None:
+                self.memory.move_to_end(key)
+                self.hits['memory'] += 1
+                return clip
+
+            if key in self.disk:
+                try:
+                    clip = AudioClip.from_wav(self._path(key))
+                    os.utime(self._path(key))
+                except (OSError, EOFError, wave.Error):
+                    self.disk_used -= self.disk.pop(key)
+                else:
+                    self.disk.move_to_end(key)
+                    self.hits['disk'] += 1
+                    self._remember(key, clip)
+                    return clip
+
+            self.misses += 1
+            return None
+
+    def put(self, key, clip):
+        """Stores a clip in both tiers."""
+        with self.lock:
+            self._remember(key, clip)
+            if len(clip.data) > self.disk_bytes or key in self.disk:
+                return
+            try:
+                os.makedirs(self.cache_dir, exist_ok=True)
+                temp_path = f"{self._path(key)}.tmp"
+                with wave.open(temp_path, 'wb') as wf:
+                    wf.setnchannels(clip.channels)
+                    wf.setsampwidth(clip.sampwidth)
+                    wf.setframerate(clip.rate)
+                    wf.writeframes(clip.data)
+                os.replace(temp_path, self._path(key))
+                size = os.path.getsize(self._path(key))
+            except OSError as e:
+                logging.warning(f"Failed to store audio cache entry: {e}")
+                return
+            self.disk[key] = size
+            self.disk_used += size
+            self._trim_disk()
+
+    @property
+    def hit_rate(self):
+        """Fraction of lookups served from either tier."""
+        lookups = sum(self.hits.values()) + self.misses
+        return sum(self.hits.values()) / lookups if lookups else 0.0
 
+    def stats(self):
+        """Returns hit counters and tier usage."""
+        with self.lock:
+            return {
+                'memory_hits': self.hits['memory'],
+                'disk_hits': self.hits['disk'],
+                'misses': self.misses,
+                'hit_rate': self.hit_rate,
+                'memory_bytes': self.memory_used,
+                'disk_bytes': self.disk_used,
+            }
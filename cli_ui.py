@@ -20,6 +20,7 @@ class CliUI:
         self.recording_status = False
         self.status_thread = None
         self.stop_status = threading.Event()
+        self.score_changed = threading.Event()
         self.running = True
 
         # Start the static score bar in a separate thread
@@ -67,26 +68,51 @@ class CliUI:
             if i < len(lines) - 1:
                 print()
         print()
+        self.refresh_score()
 
     def print_user_input(self, text: str):
         """Print the user's input in the user color."""
         print(f"{self.user_color}You > {text}{Style.RESET_ALL}\n")
+        self.refresh_score()
+
+    def refresh_score(self):
+        """Requests a redraw of the score bar."""
+        self.score_changed.set()
 
     def update_score_bar(self):
-        """Continuously updates the static score bar at the bottom of the screen with score and level."""
-        while self.running:
+        """Redraws the static score bar at the bottom of the screen whenever score, level or output changes."""
+        while True:
+            self.score_changed.wait()
+            self.score_changed.clear()
+            if not self.running:
+                break
             if self.handler.sim:
                 sys.stdout.write(
                     f"\r{Fore.YELLOW}Score: {self.handler.score} | High Score: {self.handler.high_score} | Level: {self.handler.level} {Style.RESET_ALL}"
                 )
             sys.stdout.flush()
-            time.sleep(0.5)
 
     def stop(self):
         """Stop the UI threads."""
         self.running = False
+        self.score_changed.set()
         self.score_thread.join()
 
+    def ask(self, prompt):
+        """Creates a temporary popup to take user input and return the text."""
+        # tkinter is loaded once a command first asks for text
+        import tkinter as tk
+        from tkinter import simpledialog
+        root = tk.Tk()
+        root.withdraw()
+        user_input = simpledialog.askstring("Input", prompt)
+        root.destroy()
+        return user_input
+
+    def print_status(self, text):
+        """Print a status line in the status color."""
+        print(f"{self.status_color}{text}{Style.RESET_ALL}")
+
     def show_error(self, message: str):
         """Show an error message."""
         print(f"{self.error_color}Error: {message}{Style.RESET_ALL}")
@@ -0,0 +1,169 @@
+# Intent Handler
+import math
+import threading
+import numpy as np
+
+class IntentIndex:
+    """
+    In-memory similarity index over cached intents (dotted stem strings).
+    Uses an inverted index from stems to intent ids and scores candidates with
+    TF-IDF weighted cosine similarity, so paraphrased queries can reuse cached answers.
+    """
+    def __init__(self, threshold=0.55, refresh_ratio=0.1):
+        self.threshold = threshold
+        self.refresh_ratio = refresh_ratio  # share of intents added or removed after which all norms are recomputed
+        self.lock = threading.Lock()
+        self.intents = []    # intent id -> intent string (None once removed)
+        self.ids = {}        # intent string -> intent id
+        self.vocab = {}      # stem -> term id
+        self.postings = []   # term id -> list of intent ids
+        self.arrays = {}     # term id -> posting list as a NumPy array, dropped when the list grows
+        self.df = np.zeros(64)                     # term id -> live intents containing the term
+        self.norms = np.zeros(64)                  # intent id -> TF-IDF norm (inf once removed)
+        self.doc_ids = np.zeros(256, dtype=np.int64)  # (intent id, term id) pairs of the intent-term matrix
+        self.term_ids = np.zeros(256, dtype=np.int64)
+        self.pairs = 0
+        self.removed = 0
+        self.changes = 0     # intents added or removed since the norms were last recomputed
+
+    def __len__(self):
+        return len(self.ids)
+
+    @staticmethod
+    def terms(intent):
+        """Splits an intent into its unique stems, keeping their order."""
+        return list(dict.fromkeys(term for term in intent.split('.') if term))
+
+    @staticmethod
+    def _grow(array, size):
+        """Returns the array, doubled in capacity until it holds size entries."""
+        if size <= len(array):
+            return array
+        grown = np.zeros(max(size, 2 * len(array)), dtype=array.dtype)
+        grown[:len(array)] = array
+        return grown
+
+    def _idf2(self, df):
+        """Squared smoothed IDF weights for the given document frequencies."""
+        return (np.log((1 + len(self.ids)) / (1 + df)) + 1) ** 2
+
+    def add(self, intent):
+        """Adds an intent to the index if it is not already present."""
+        with self.lock:
+            self._add(intent)
+
+    def _add(self, intent):
+        """Adds an intent, updating postings, document frequencies and its own norm in place."""
+        terms = self.terms(intent)
+        if not terms or intent in self.ids:
+            return
+        doc = len(self.intents)
+        self.intents.append(intent)
+        self.ids[intent] = doc
+        term_ids = []
+        for term in terms:
+            term_id = self.vocab.get(term)
+            if term_id is None:
+                term_id = self.vocab[term] = len(self.postings)
+                self.postings.append([])
+                self.df = self._grow(self.df, len(self.postings))
+            self.postings[term_id].append(doc)
+            self.arrays.pop(term_id, None)
+            term_ids.append(term_id)
+        term_ids = np.array(term_ids, dtype=np.int64)
+        self.df[term_ids] += 1
+
+        end = self.pairs + len(term_ids)
+        self.doc_ids = self._grow(self.doc_ids, end)
+        self.term_ids = self._grow(self.term_ids, end)
+        self.doc_ids[self.pairs:end] = doc
+        self.term_ids[self.pairs:end] = term_ids
+        self.pairs = end
+
+        # the other norms drift slowly as IDF changes and are refreshed in bulk by _refresh
+        self.norms = self._grow(self.norms, doc + 1)
+        self.norms[doc] = math.sqrt(self._idf2(self.df[term_ids]).sum())
+        self.changes += 1
+
+    def remove(self, intent):
+        """Removes an intent, compacting the index once most of it is stale."""
+        with self.lock:
+            doc = self.ids.pop(intent, None)
+            if doc is None:
+                return
+            self.intents[doc] = None
+            self.df[[self.vocab[term] for term in self.terms(intent)]] -= 1
+            self.norms[doc] = np.inf
+            self.removed += 1
+            self.changes += 1
+            if self.removed > len(self.ids):
+                self._compact()
+
+    def _compact(self):
+        """Rebuilds the index from the live intents only."""
+        live = [intent for intent in self.intents if intent is not None]
+        self.intents, self.ids, self.vocab, self.postings, self.arrays = [], {}, {}, [], {}
+        self.df[:] = 0
+        self.pairs = 0
+        self.removed = 0
+        for intent in live:
+            self._add(intent)
+        self._refresh()
+
+    def _refresh(self):
+        """Recomputes every intent norm with the current IDF weights."""
+        count = len(self.intents)
+        idf2 = self._idf2(self.df[:len(self.postings)])
+        docs, terms = self.doc_ids[:self.pairs], self.term_ids[:self.pairs]
+        norms = np.sqrt(np.bincount(docs, weights=idf2[terms], minlength=count))
+        norms[np.isinf(self.norms[:count])] = np.inf
+        self.norms[:count] = norms
+        self.changes = 0
+
+    def _posting(self, term_id):
+        """Returns the posting list of a term as a cached NumPy array."""
+        array = self.arrays.get(term_id)
+        if array is None:
+            array = self.arrays[term_id] = np.array(self.postings[term_id], dtype=np.int64)
+        return array
+
+    def match(self, intent):
+        """
+        Finds the cached intent most similar to the given one.
+
+        Returns:
+            tuple: (intent, score) for the best match at or above the threshold,
+            otherwise (None, best score).
+        """
+        terms = self.terms(intent)
+        if not terms:
+            return None, 0.0
+
+        with self.lock:
+            if intent in self.ids:
+                return intent, 1.0
+            if not self.ids:
+                return None, 0.0
+            # a full cache evicts one intent per add, so churn counts even when the size holds
+            if self.changes > self.refresh_ratio * len(self.ids):
+                self._refresh()
+
+            known = [self.vocab[term] for term in terms if term in self.vocab]
+            if not known:
+                return None, 0.0
+
+            # unseen stems still count towards the query norm with the maximum idf
+            idf2 = self._idf2(self.df[known])
+            unseen_idf2 = (math.log(1 + len(self.ids)) + 1) ** 2
+            query_norm = math.sqrt(idf2.sum() + unseen_idf2 * (len(terms) - len(known)))
+
+            postings = [self._posting(term_id) for term_id in known]
+            weights = np.repeat(idf2, [len(p) for p in postings])
+            scores = np.bincount(np.concatenate(postings), weights=weights, minlength=len(self.intents))
+            scores /= self.norms[:len(self.intents)] * query_norm
+
+            best = int(np.argmax(scores))
+            score = float(scores[best])
+            if score >= self.threshold:
+                return self.intents[best], score
+            return None, score
@@ -1,16 +1,77 @@
 # LLM Handler
 from settings import *
 
+# end punctuation, possibly followed by closing quotes or brackets, or a line break; trailing whitespace allowed
+SENTENCE_END = re.compile(r'(?:[.!?]["\'\u201d\u2019)\]*]*|\n)\s*$')
+STATS_FIELDS = ("total_duration", "load_duration", "prompt_eval_count",
+                "prompt_eval_duration", "eval_count", "eval_duration")
+
+def iter_ndjson(chunks):
+    """
+    Decodes a stream of byte chunks as newline-delimited JSON.
+    Records split across chunk boundaries are buffered until their newline arrives.
+
+    Args:
+        chunks (iterable): Raw byte chunks from the HTTP response.
+    Yields:
+        dict: One decoded JSON record per line.
+    """
+    parts = []
+    for chunk in chunks:
+        if b"\n" not in chunk:
+            if chunk:
+                parts.append(chunk)
+            continue
+        parts.append(chunk)
+        *lines, tail = b"".join(parts).split(b"\n")
+        parts = [tail]
+        for line in lines:
+            if line.strip():
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    logging.warning(f"Skipping malformed stream record: {line[:80]!r}")
+    pending = b"".join(parts)
+    if pending.strip():
+        try:
+            yield json.loads(pending)
+        except json.JSONDecodeError:
+            logging.warning(f"Skipping malformed stream record: {pending[:80]!r}")
+
 class LlmHandler:
     """
     Handles interactions with the AI model by sending requests to a local API endpoint
     and processing streamed responses.
     """
-    def __init__(self, prompt = GEN_PROMPT):
-        """ Initializes the LlmHandler with model details and a session for API requests."""
+    def __init__(self, prompt = GEN_PROMPT, tracer=None, session=None, slots=None):
+        """
+        Initializes the LlmHandler with model details and a session for API requests.
+        Handlers can share one HTTP session, and a semaphore in slots that limits
+        the number of streams in flight across all of them.
+        """
         self.model = LLM_MODEL
-        self.session = requests.Session()
+        self.url = f"{OLLAMA_URL}/api/generate"
+        self.session = session or requests.Session()
+        self.slots = slots
         self.prompt = prompt
+        self.mode = "general"
+        self.contexts = {}  # mode -> context tokens returned by the last turn
+        self.last_stats = {}
+        self.streams = {}  # open cancellable response -> its cancel event
+        self.lock = threading.Lock()
+        self.tracer = tracer
+
+    def preload_model(self):
+        """Sends a request without a prompt, which loads the model into memory without generating anything."""
+        try:
+            data = {
+                "model": self.model,
+                "keep_alive": KEEP_ALIVE
+            }
+            response = self.session.post(self.url, json=data)
+            response.raise_for_status()
+        except requests.exceptions.RequestException as e:
+            logging.error(f"Failed to preload model: {e}")
 
     def unload_model(self):
         """Sends a request to unload the model from memory."""
@@ -19,28 +80,67 @@ class LlmHandler:
                 "model": self.model,
                 "keep_alive": 0
             }
-            response = self.session.post("http://localhost:11434/api/generate", json=data)
+            response = self.session.post(self.url, json=data)
             response.raise_for_status()
         except requests.exceptions.RequestException as e:
             logging.error(f"Failed to unload model: {e}")
 
-    def get_response(self, query):
+    def set_mode(self, mode, prompt):
+        """Switches to another system prompt and starts that mode's conversation afresh."""
+        self.mode = mode
+        self.prompt = prompt
+        self.contexts.pop(mode, None)
+
+    def remember(self, mode, context):
+        """
+        Keeps the context returned by a finished turn for the next request in the same mode.
+        A context can't be trimmed without breaking the prompt template inside it, so once
+        it leaves less than CONTEXT_MARGIN of NUM_CTX for the next query and answer,
+        the next turn starts afresh instead of letting the server shift the window.
+        """
+        if context and len(context) <= CONTEXT_TOKEN_BUDGET:
+            self.contexts[mode] = context
+        else:
+            if context:
+                logging.debug(f"Context of {len(context)} tokens exceeds the budget, resetting {mode} conversation")
+            self.contexts.pop(mode, None)
+
+    def cancel(self):
+        """
+        Closes every open stream whose cancel event is set.
+        A read already blocked in another thread may still wait for the server's next chunk;
+        the stream loop checks its cancel event after every chunk and stops there.
+        """
+        with self.lock:
+            cancelled = [response for response, event in self.streams.items() if event.is_set()]
+        for response in cancelled:
+            response.close()
+
+    def get_response(self, query, cancel=None, remember=True, turn=None):
         """
         Sends a query to the AI model and streams the response.
+        The conversation context of the current mode is sent along, so the server can reuse
+        its cache for the system prompt and earlier turns instead of evaluating them again.
 
         Args:
             query (str): The user input/query.
-            LLM (str): The AI model to use.
+            cancel (threading.Event): Stops the stream at the next chunk once set; cancel() also closes it.
+            remember (bool): Continue and update the current mode's conversation.
+            turn (int): Trace the first token and first sentence under this turn.
         Yields:
             str: Processed chunks of the AI model's response.
         """
+        response = None
+        acquired = False
+        tracer = self.tracer if turn is not None else None
+        first_token = first_sentence = True
+        mode = self.mode
+        context = self.contexts.get(mode) if remember else None
         try:
             data = {
                 "model": self.model,
                 "keep_alive": KEEP_ALIVE,
-                "context": CONTEXT,
                 "prompt": f"{query}",
-                "system": f"{self.prompt}",
                 "options": {
                     "num_keep": NUM_KEEP,
                     "temperature": TEMPERATURE,
@@ -65,26 +165,78 @@ class LlmHandler:
                     "num_thread": NUM_THREAD
                 }
             }
+            if NUM_PREDICT is not None:
+                data["options"]["num_predict"] = NUM_PREDICT
+            if context:
+                # the system prompt is already part of the context
+                data["context"] = context
+            else:
+                data["system"] = f"{self.prompt}"
+            if self.slots is not None:
+                # wait for a free stream, giving up if the answer is cancelled meanwhile
+                while not self.slots.acquire(timeout=0.1):
+                    if cancel is not None and cancel.is_set():
+                        return
+                acquired = True
             response = self.session.post(
-                "http://localhost:11434/api/generate",
+                self.url,
                 json=data,
                 stream=True
             )
+            if cancel is not None:
+                with self.lock:
+                    self.streams[response] = cancel
+                if cancel.is_set():
+                    return
 
             buffer = []
-            for chunk in response.iter_content(chunk_size=512):
-                chunk_str = chunk.decode("utf-8")
-                try:
-                    chunk_json = json.loads(chunk_str)
-                    buffer.append(chunk_json.get("response", ""))
-                except json.JSONDecodeError:
-                    continue
-                if re.search(r'[.!?]$', ''.join(buffer)):
-                    chunk_str = ' '.join(''.join(buffer).split())
-                    buffer = []
-                    yield chunk_str
+            for record in iter_ndjson(response.iter_content(chunk_size=512)):
+                if cancel is not None and cancel.is_set():
+                    return
+                if "error" in record:
+                    logging.error(f"LLM error: {record['error']}")
+                    break
+
+                token = record.get("response", "")
+                if token:
+                    if tracer and first_token:
+                        first_token = False
+                        tracer.event("first_token", turn)
+                    buffer.append(token)
+                    # only the newest token can complete a sentence
+                    if SENTENCE_END.search(token):
+                        sentence = ' '.join(''.join(buffer).split())
+                        buffer = []
+                        if sentence:
+                            if tracer and first_sentence:
+                                first_sentence = False
+                                tracer.event("first_sentence", turn)
+                            yield sentence
+
+                if record.get("done"):
+                    self.last_stats = {field: record[field] for field in STATS_FIELDS if field in record}
+                    if remember:
+                        self.remember(mode, record.get("context"))
+                    break
+
+            remainder = ' '.join(''.join(buffer).split())
+            if remainder and not (cancel is not None and cancel.is_set()):
+                if tracer and first_sentence:
+                    tracer.event("first_sentence", turn)
+                yield remainder
 
-        except requests.exceptions.RequestException as e:
-            logging.error(f"Request to API Failed: {e}")
         except Exception as e:
-            logging.exception(f"Unexpected error: {e}")
+            if cancel is not None and cancel.is_set():
+                # reading from a stream closed by cancel()
+                return
+            if isinstance(e, requests.exceptions.RequestException):
+                logging.error(f"Request to API Failed: {e}")
+            else:
+                logging.exception(f"Unexpected error: {e}")
+        finally:
+            if cancel is not None and response is not None:
+                with self.lock:
+                    self.streams.pop(response, None)
+                response.close()
+            if acquired:
+                self.slots.release()
@@ -1,176 +1,335 @@
 # Blossom
+import time
+STARTED = time.perf_counter()
+
 from res_handler import ResponseHandler
 from settings import *
 import pyaudio
-from vosk import Model, KaldiRecognizer
-from TTS.api import TTS
-import torch
-import wave
+from vosk import Model
+import _thread
 import queue
-import uuid
-import glob
+from collections import deque
 from cli_ui import CliUI
-import librosa
-import soundfile as sf
+from asr_handler import WakeMatcher, SpeechRecognizer, TwoStageRecognizer, VoiceActivityGate, RecognizerProcess, recognize
+from audio_handler import AudioClip, AudioPlayer, AudioCapture
+from cache_handler import AudioCache
+from trace_handler import Tracer
+from functools import partial
 
 class Core:
-    """Core class responsible for managing speech recognition and text-to-speech and user queries."""
-    def __init__(self):
+    """
+    Core class responsible for managing speech recognition and text-to-speech and user queries.
+    An audio backend with PyAudio's interface and a TTS handler can be passed in to replace
+    the sound card and XTTS, as the benchmarks do.
+    """
+    def __init__(self, audio=None, tts=None):
         self.name = NAME
         self.model = VOSK_MODEL
-        self.query = None
+        self.speaker_wav = SPEAKER_WAV
         self.called = False
-        self.is_playing = False
-
-        self.on_init()
-
-    def on_init(self):
-        """Initializes the necessary components for the class instance."""
+        self.wake_cued = False
+        self.first_audio_turn = None
+        self.turn = 0
+        self.answer_turn = 0  # turn of the answer being generated, captured when it starts
+        self.spoken = deque(maxlen=ECHO_HISTORY)
+
+        self.on_init(audio, tts)
+
+    def on_init(self, audio=None, tts=None):
+        """
+        Initializes the necessary components for the class instance.
+        XTTS, the Vosk model and the LLM are loaded on background threads at the same time;
+        listening starts as soon as speech recognition is ready, and sentences wait for XTTS.
+        """
+        self.startup = {'imports': (STARTED, time.perf_counter())}  # stage -> (start, end)
+        self.loaders = []
+        self.listening = threading.Event()
+        # fork the recognizer process before any threads or models exist
+        self.asr_process = RecognizerProcess(self.model, SAMPLING_RATE) if ASR_PROCESS else None
         self.lock = threading.Lock()
         self.condition = threading.Condition()
-        self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-        self.tts = TTS(model_name=TTS_MODEL, progress_bar=False).to(self.device)
+        self.device = None
+        self.tts = self.tts_pool = None
+        self.tts_ready = threading.Event()
+        if tts is not None:
+            self.timed("xtts", self.load_tts, tts)
+        else:
+            self.load_in_background("xtts", self.load_tts)
+        self.tracer = Tracer(TRACE_FILE, metrics_file=METRICS_FILE)
+        self.audio_cache = AudioCache(AUDIO_CACHE_DIR, AUDIO_CACHE_MEMORY_BYTES, AUDIO_CACHE_DISK_BYTES)
         self.shutdown_flag = threading.Event()
-        self.audio = pyaudio.PyAudio()
-        self.model = self.load_vosk_model()
-        self.recognizer = KaldiRecognizer(self.model, SAMPLING_RATE)
+        self.interrupted = threading.Event()
+        self.answering = threading.Event()
+        self.audio = audio or pyaudio.PyAudio()
+        self.player = AudioPlayer(self.audio, CHUNK_SIZE, on_idle=self.on_playback_idle,
+                                  on_busy=self.on_playback_busy, on_start=self.on_playback_start,
+                                  on_played=self.on_played)
+        self.cues = {path: AudioClip.from_wav(path) for path in (START_WAV, END_WAV)}
+        self.wake_matcher = WakeMatcher(self.name, CALL_WORDS)
+        self.recognizer = self.vad = None
+        self.asr_loader = None
+        if self.asr_process:
+            self.capture = AudioCapture(RATE, CAPTURE_RING_SECONDS, ring=self.asr_process.ring)
+        else:
+            self.capture = AudioCapture(RATE, CAPTURE_RING_SECONDS)
+            self.asr_loader = self.load_in_background("vosk", self.load_recognizer)
+        self.tracer.add_gauges('capture', self.capture.stats)
+        self.tracer.add_gauges('audio_cache', self.audio_cache.stats)
+        self.tracer.add_gauges('vad', self.vad_stats)
         self.handler = ResponseHandler(self)
+        # a request without a prompt loads the model without generating anything
+        self.load_in_background("llm", self.handler.llm.preload_model)
         self.speech_queue = queue.Queue()
-        self.audio_queue = queue.Queue()
+        self.synthesized = queue.Queue()  # (turn, text, trace, Future) in the order sentences were queued
+        self.queries = queue.Queue()
+        self.audio_queue = self.player.queue
         self.cli = CliUI(self.name, self.handler)
 
+    def timed(self, name, func, *args):
+        """Runs one startup stage and records when it started and finished."""
+        start = time.perf_counter()
+        try:
+            func(*args)
+        except Exception as e:
+            logging.error(f"Failed to load {name}: {e}")
+        finally:
+            self.startup[name] = (start, time.perf_counter())
+
+    def load_in_background(self, name, func, *args):
+        """Runs a startup stage on its own thread, so models load side by side."""
+        thread = threading.Thread(target=self.timed, args=(name, func, *args), daemon=True)
+        thread.start()
+        self.loaders.append(thread)
+        return thread
+
+    def load_tts(self, tts=None):
+        """Loads XTTS, unless a TTS handler was passed in, and starts the TTS pool on CPU."""
+        try:
+            if tts is None:
+                # torch and TTS take seconds to import, so they load alongside the other models
+                import torch
+                from tts_handler import TtsHandler
+                self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+                tts = TtsHandler(self.device)
+            if TTS_WORKERS:
+                from tts_handler import TtsPool
+                if TtsPool.supports(tts):
+                    self.tts_pool = TtsPool(tts)
+                else:
+                    logging.warning("TTS_WORKERS is ignored on a GPU, sentences are synthesized in-process.")
+            self.tts = tts
+        finally:
+            self.tts_ready.set()
+
     def load_vosk_model(self):
         """Loads the Vosk speech recognition model."""
         if not os.path.exists(self.model):
-            logging.info(f'Model not found at {self.model}, please check the path.')
-            exit(1)
+            raise FileNotFoundError(f'Model not found at {self.model}, please check the path.')
         try:
             return Model(self.model)
         except ValueError as e:
-            logging.error(f'Error loading Vosk model: {e}')
-            exit(1)
-
-    def change_audio_speed(self, input_wav, speed=1.1):
-        """Change the speed of a WAV file without affecting pitch."""
-        y, sr = librosa.load(input_wav, sr=None)
-        y_fast = librosa.effects.time_stretch(y, rate=speed)
+            raise RuntimeError(f'Error loading Vosk model: {e}') from e
 
-        output_wav = f"{uuid.uuid4().hex}_fast.wav"
-        sf.write(output_wav, y_fast, sr)
-        return output_wav
-
-    def speak(self, text, speed=1.1):
-        """Generate speech audio from text using TTS and adjust speed."""
+    def load_recognizer(self):
+        """Loads the Vosk model and builds the recognizer and voice activity gate on it."""
+        self.model = self.load_vosk_model()
+        self.vad = VoiceActivityGate(SAMPLING_RATE) if VAD_ENABLED else None
+        if TWO_STAGE_ASR:
+            self.recognizer = TwoStageRecognizer(self.model, SAMPLING_RATE, self.wake_matcher)
+        else:
+            self.recognizer = SpeechRecognizer(self.model, SAMPLING_RATE, self.wake_matcher)
+
+    def vad_stats(self):
+        """Returns the voice activity gate counters, from the recognizer process if it runs one."""
+        if self.asr_process:
+            return self.asr_process.stats
+        return self.vad.stats() if self.vad else {}
+
+    def report_startup(self):
+        """Waits for every model to load, then reports and traces how long each startup stage took."""
+        for loader in self.loaders:
+            loader.join()
+        self.listening.wait(timeout=5)
+        stages = []
+        for name, (start, end) in sorted(self.startup.items(), key=lambda item: item[1][1]):
+            self.tracer.record('span', f"startup_{name}", start, end)
+            stages.append(f"{name} {end - start:.1f} s")
+        report = f"Ready after {time.perf_counter() - STARTED:.1f} s: {', '.join(stages)}"
+        logging.info(report)
+        self.cli.print_status(report)
+
+    def synthesize(self, text, speed=1.1):
+        """Generate speech for text with TTS and return it as an in-memory AudioClip, reusing cached audio."""
+        return self.tts.render(text, self.speaker_wav, self.audio_cache, speed)
+
+    def speak(self, text, speed=1.1, turn=None, trace=None):
+        """Generate speech audio from text and queue it for playback, unless its turn was cancelled meanwhile."""
         try:
-            temp_wav = f"{uuid.uuid4().hex}_temp.wav"
-            self.tts.tts_to_file(text, file_path=temp_wav, speaker_wav=SPEAKER_WAV, language="en")
-
-            # Speed up audio
-            if len(text) > SPEED_THRESHOLD and SPEED_UP:
-                output_wav = self.change_audio_speed(temp_wav, speed=speed)
-            else:
-                output_wav = temp_wav
-
-            self.audio_queue.put(output_wav)
+            with self.tracer.span("tts", trace, chars=len(text)):
+                clip = self.synthesize(text, speed=speed)
+            self.deliver(clip, text, turn, trace)
         except Exception as e:
             logging.error(f"TTS error: {e}")
 
-    def play_audio(self, filename):
-        """Play the generated or pre-recorded audio file."""
-        def audio_thread():
-            self.is_playing = True
-            stream = None
+    def deliver(self, clip, text, turn=None, trace=None):
+        """Queues a synthesized sentence for playback, unless its turn was cancelled meanwhile."""
+        # under the lock, a barge-in either stops this clip with the player or makes the check drop it
+        with self.lock:
+            if turn is None or turn == self.turn:
+                self.spoken.append(text)
+                self.player.play(clip, tag=trace)
+
+    def play_audio(self, filename, cue=False):
+        """Queue a pre-recorded audio file for playback, using the preloaded copy of cue sounds."""
+        clip = self.cues.get(filename)
+        if clip is None:
             try:
-                with wave.open(filename, 'rb') as wf:
-                    chunk_size = min(CHUNK_SIZE, wf.getnframes())
-                    stream = self.audio.open(
-                        format=self.audio.get_format_from_width(wf.getsampwidth()),
-                        channels=wf.getnchannels(),
-                        rate=wf.getframerate(),
-                        output=True,
-                        frames_per_buffer=chunk_size)
-
-                    data = wf.readframes(wf.getnframes())
-                    stream.write(data)
-                    time.sleep(0.1)
-                    stream.stop_stream()
-
-                if "_temp" in filename:
-                    os.remove(filename)
-                self.is_playing = False
-
+                clip = AudioClip.from_wav(filename)
             except Exception as e:
-                logging.error(f'Error during playback of {filename}: {e}')
-            finally:
-                if stream is not None:
-                    if stream.is_active():
-                        stream.stop_stream()
-                    stream.close()
-
-        threading.Thread(target=audio_thread, daemon=True).start()
+                logging.error(f'Error loading {filename}: {e}')
+                return None
+        return self.player.play(clip, cue=cue)
+
+    def on_playback_busy(self):
+        """Pauses the recognizer process while audio is playing."""
+        if self.asr_process and not BARGE_IN:
+            self.asr_process.paused.set()
+
+    def on_playback_idle(self):
+        """Wakes the recognizer once all queued audio has played."""
+        if self.asr_process:
+            self.asr_process.paused.clear()
+        with self.condition:
+            self.condition.notify_all()
+        self.finish_turn()
+
+    def on_playback_start(self, clip, cue, tag):
+        """Traces when the first answer audio of a turn starts playing."""
+        if tag is not None and tag != self.first_audio_turn:
+            self.first_audio_turn = tag
+            self.tracer.event("first_audio", tag)
+
+    def on_played(self, clip, cue, tag, start, end):
+        """Traces the playback of an answer clip."""
+        if tag is not None:
+            self.tracer.record('span', 'playback', start, end, tag, seconds=round(clip.duration, 3))
+
+    def finish_turn(self):
+        """Ends the traced turn once its answer has been generated, synthesized and played."""
+        if (self.tracer.turn is not None and not self.answering.is_set()
+                and not self.speech_queue.unfinished_tasks and not self.player.is_playing):
+            self.tracer.end_turn()
+
+    def synthesis_worker(self):
+        """Synthesizes queued sentences in order, so sentence N+1 is rendered while N plays."""
+        # sentences queued while XTTS is still loading wait here
+        self.tts_ready.wait()
+        if self.tts is None:
+            logging.error("Speech synthesis is unavailable, shutting down.")
+            self.shutdown_flag.set()
+            _thread.interrupt_main()
+            return
+        if self.tts_pool:
+            self.reassembly_thread = threading.Thread(target=self.reassembly_worker, daemon=True)
+            self.reassembly_thread.start()
+            self.dispatch_worker()
+            return
+        while True:
+            item = self.speech_queue.get()
+            if item is None:
+                self.speech_queue.task_done()
+                break
+            turn, text, trace = item
+            if turn == self.turn:
+                self.speak(text, turn=turn, trace=trace)
+            # lets callers join() the queue until every sentence has reached the player
+            self.speech_queue.task_done()
+            logging.debug(f"Pipeline depth: {self.queue_depth()}")
+
+    def dispatch_worker(self):
+        """Hands queued sentences to the TTS pool as they arrive, so several are synthesized at once."""
+        while True:
+            item = self.speech_queue.get()
+            if item is None:
+                self.synthesized.put(None)
+                break
+            turn, text, trace = item
+            future = None
+            if turn == self.turn:
+                future = self.tts_pool.submit(text, self.speaker_wav, self.audio_cache)
+                if trace is not None:
+                    future.add_done_callback(partial(self.on_synthesized, time.perf_counter(), trace, len(text)))
+            self.synthesized.put((turn, text, trace, future))
+
+    def reassembly_worker(self):
+        """Queues the pool's clips for playback in the order their sentences were queued."""
+        while True:
+            item = self.synthesized.get()
+            if item is None:
+                self.speech_queue.task_done()
+                break
+            turn, text, trace, future = item
+            try:
+                clip = future.result() if future is not None else None
+                if clip is not None:
+                    self.deliver(clip, text, turn, trace)
+            except Exception as e:
+                logging.error(f"TTS error: {e}")
+            # lets callers join() the queue until every sentence has reached the player
+            self.speech_queue.task_done()
+            logging.debug(f"Pipeline depth: {self.queue_depth()}")
+
+    def on_synthesized(self, start, trace, chars, future):
+        """Traces the synthesis of a sentence by the pool, from submission until its clip came back."""
+        self.tracer.record('span', 'tts', start, time.perf_counter(), trace, chars=chars)
+
+    def queue_depth(self):
+        """Returns the number of sentences waiting for synthesis and clips waiting for playback."""
+        depth = {'speech': self.speech_queue.qsize(), 'audio': self.audio_queue.qsize()}
+        if self.tts_pool:
+            depth['synthesizing'] = self.synthesized.qsize()
+        return depth
 
     def recognize_speech(self):
-        """Capture and process speech input."""
+        """Capture and process speech input, as soon as the recognizer has loaded."""
+        if self.asr_loader:
+            self.asr_loader.join()
+            if self.recognizer is None:
+                logging.error("Speech recognition is unavailable, shutting down.")
+                self.shutdown_flag.set()
+                _thread.interrupt_main()
+                return
+
+        # the callback fills the capture ring on PortAudio's thread
         stream = self.audio.open(format=pyaudio.paInt16,
                         channels = 1,
                         rate = RATE,
                         input = True,
-                        frames_per_buffer = FRAMES_PER_BUFFER)
+                        frames_per_buffer = CHUNK_SIZE,
+                        stream_callback = self.capture.callback)
         stream.start_stream()
 
-        # load model into memory
-        res = " ".join(self.handler.llm.get_response(f"Hey {self.name}"))
-        self.queue(res)
-
-        logging.info("Listening...")
-
         try:
+            if self.asr_process:
+                self.receive_speech()
+                return
+
+            self.on_listening()
             while not self.shutdown_flag.is_set():
 
-                # halt if audio is being played
+                # halt if audio is being played, then skip what was captured meanwhile
                 with self.condition:
-                    while not self.audio_queue.empty():
-                        self.condition.wait()
-
-                data = stream.read(FRAMES_PER_BUFFER, exception_on_overflow=EXCEPTION_ON_OVERFLOW)
-
-                if self.recognizer.AcceptWaveform(data):
-                    result = json.loads(self.recognizer.Result())
-                    if 'text' in result and result['text'].strip() != "":
-                        with self.lock:
-                            self.query = result['text'].strip()
-                        self.cli.print_user_input(f'{self.query}')
-
-                with self.lock:
-                    if not self.query:
-                        continue
-
-                    # lowercase and split
-                    query_lower = self.query.lower().strip()
-                    query_words = query_lower.split()
-                    name_lower = self.name.lower()
-
-                    # hotword detection
-                    if any(word in query_lower for word in CALL_WORDS):
-                        for word in CALL_WORDS:
-                            if f'{word} {name_lower}' in query_lower:
-                                self.called = True
-                                logging.info("call detected!")
-                                _, query = query_lower.split(f'{word} {name_lower}', 1)
-                                if query.strip() == "" or len(query.strip().split()) < 2:
-                                    self.query = None
-                                    self.play_audio(START_WAV)
-                                else:
-                                    self.query = query.strip()
-                                break
-
-                    if self.called is not True:
-                        if query_words[0] == name_lower and len(query_words) > 2:
-                            self.called = True
-                            logging.info("call detected!")
-                            self.query = " ".join(query_words[1:])
-
-                time.sleep(0.1)
+                    if self.player.is_playing and not BARGE_IN:
+                        while self.player.is_playing and not self.shutdown_flag.is_set():
+                            self.condition.wait()
+                        self.capture.ring.discard()
+
+                data = self.capture.read(FRAMES_PER_BUFFER, timeout=0.5)
+                if data is None:
+                    continue
+
+                for event, text in recognize(self.recognizer, self.vad, data):
+                    self.on_speech_event(event, text)
         except IOError as e:
             logging.error(f'IOError in audio stream: {e}')
         except Exception as e:
@@ -178,29 +337,183 @@ class Core:
         finally:
             stream.stop_stream()
             stream.close()
+            if self.asr_process:
+                self.asr_process.close()
             self.audio.terminate()
-            logging.info("Audio stream terminated.")
-
-    def process_queue(self):
-        """Process speech and audio playback queues."""
-        if not self.speech_queue.empty():
-            self.speak(self.speech_queue.get())
-        if not self.audio_queue.empty():
-            if not self.is_playing:
-                self.play_audio(self.audio_queue.get())
-        elif not self.is_playing:
-            time.sleep(0.1)
-            with self.condition:
-                self.condition.notify()
+            logging.info(f"Audio stream terminated. Capture: {self.capture.stats()}")
+
+    def receive_speech(self):
+        """Handles the events sent back by the recognizer process."""
+        while not self.shutdown_flag.is_set():
+            result = self.asr_process.get(timeout=0.5)
+            if result is None:
+                if not self.asr_process.process.is_alive():
+                    logging.error("Recognizer process exited unexpectedly.")
+                    break
+                continue
+            event, text = result
+            if event == 'ready':
+                self.on_listening()
+            elif event == 'error':
+                logging.error(text)
+                break
+            elif event != 'stats':
+                # the counters were kept by get() for the vad gauges
+                self.on_speech_event(event, text)
+
+    def on_listening(self):
+        """Records when listening started."""
+        self.startup['listening'] = (STARTED, time.perf_counter())
+        self.listening.set()
+        logging.info("Listening...")
+
+    def on_speech_event(self, event, text):
+        """Reacts to a ('wake' | 'final', text) event from the recognizer."""
+        if BARGE_IN and self.answer_in_progress():
+            if self.is_echo(text):
+                logging.debug(f"Ignoring echo: {text}")
+                return
+            if self.wake_matcher.match(text) is not None:
+                self.barge_in()
+
+        if event == 'wake' and not self.wake_cued:
+            # cue as soon as the wake phrase is heard, before the utterance ends
+            logging.info("call detected!")
+            self.tracer.begin_turn()
+            self.tracer.event("wake")
+            self.wake_cued = True
+            self.play_audio(START_WAV, cue=True)
+        elif event == 'final':
+            self.cli.print_user_input(f'{text}')
+            # open the turn before a query can be dispatched, and drop it if nobody was talking to us
+            started = self.tracer.begin_turn() if self.tracer.turn is None else None
+            if self.detect_call(text) or started is None:
+                self.tracer.event("asr_final", words=len(text.split()))
+            else:
+                self.tracer.drop_turn(started)
+            self.wake_cued = False
+
+    def answer_in_progress(self):
+        """Whether an answer is being generated, synthesized or played."""
+        return self.answering.is_set() or self.player.is_playing or not self.speech_queue.empty()
+
+    def is_echo(self, text):
+        """Whether recognized text is just the assistant's own recent speech picked up by the microphone."""
+        words = re.sub(r'[^a-z0-9\s]', ' ', text.lower()).split()
+        if not words:
+            return True
+        spoken = re.sub(r'[^a-z0-9\s]', ' ', ' '.join(self.spoken).lower()).split()
+        return f" {' '.join(words)} " in f" {' '.join(spoken)} "
+
+    def barge_in(self):
+        """Cancels the answer in progress: the LLM stream, pending sentences and playback."""
+        logging.info("Barge-in, cancelling the current answer.")
+        self.tracer.event("barge_in")
+        with self.lock:
+            self.turn += 1
+            self.interrupted.set()
+        self.handler.llm.cancel()
+        while True:
+            try:
+                item = self.speech_queue.get_nowait()
+            except queue.Empty:
+                break
+            self.speech_queue.task_done()
+            if item is None:
+                self.speech_queue.put(None)
+                break
+        if self.tts_pool:
+            self.tts_pool.cancel()
+        self.player.stop()
+
+    def detect_call(self, text):
+        """
+        Checks an utterance for the wake phrase and dispatches the query that follows it.
+
+        Returns:
+            bool: Whether the utterance was addressed to the assistant.
+        """
+        with self.lock:
+            query = self.wake_matcher.match(text)
+            if query is not None:
+                logging.info("call detected!")
+                if len(query.split()) < 2:
+                    # wait for the query in the next utterance
+                    self.called = True
+                    if not self.wake_cued:
+                        self.play_audio(START_WAV, cue=True)
+                else:
+                    self.called = False
+                    self.queries.put(query)
+                return True
+            elif self.called:
+                self.called = False
+                self.queries.put(text.lower().strip())
+                return True
+            return False
 
     def queue(self, text, display=True):
-        self.speech_queue.put(text)
+        """Queues a sentence of the answer for synthesis, unless the answer was cancelled."""
+        # under the lock, a barge-in either drains this sentence or this check drops it
+        with self.lock:
+            if self.interrupted.is_set() or self.answer_turn != self.turn:
+                return
+            self.speech_queue.put((self.answer_turn, text, self.tracer.turn))
         if display:
             self.cli.print_assistant_response(text)
 
+    def start(self):
+        """Starts the speech recognition and synthesis threads."""
+        self.speech_thread = threading.Thread(target=self.recognize_speech, daemon=True)
+        self.speech_thread.start()
+        self.synthesis_thread = threading.Thread(target=self.synthesis_worker, daemon=True)
+        self.synthesis_thread.start()
+        threading.Thread(target=self.report_startup, daemon=True).start()
+
+    def process(self, query):
+        """Answers one query."""
+        if self.tracer.turn is None:
+            self.tracer.begin_turn()
+        self.tracer.event("dispatch")
+        with self.lock:
+            self.answer_turn = self.turn
+            self.interrupted.clear()
+        self.answering.set()
+        try:
+            self.play_audio(END_WAV)
+            with self.tracer.span("handle"):
+                self.handler.handle(query)
+        finally:
+            self.answering.clear()
+            self.finish_turn()
+
+    def shutdown(self):
+        """Stops all threads and flushes the caches."""
+        logging.info("Shutting down...")
+        self.shutdown_flag.set()
+        self.speech_queue.put(None)
+        if self.tts_pool:
+            self.tts_pool.close()
+        self.player.close()
+        self.on_playback_idle()
+        self.cli.stop()
+        self.handler.refresher.close()
+        logging.info(f"Background refreshes: {self.handler.refresher.stats()}")
+        self.handler.store.close()
+        self.handler.llm.session.close()
+        self.handler.llm.unload_model()
+        logging.info(f"Audio cache: {self.audio_cache.stats()}")
+
+        if self.speech_thread:
+            self.speech_thread.join()
+        logging.info(f"Voice activity gate: {self.vad_stats()}")
+        # the final metrics include the capture and recognizer counters of the stopped stream
+        self.tracer.close()
+        logging.info("All threads terminated.")
+
     def run(self):
         """Main loop for processing user queries."""
-        self.speech_thread = threading.Thread(target=self.recognize_speech, daemon=True).start()
+        self.start()
 
         self.cli.clear_screen()
         self.cli.print_header()
@@ -208,30 +521,10 @@ class Core:
 
         try:
             while True:
-                self.process_queue()
-                if self.called:
-                    with self.lock:
-                        if self.query:
-                            self.play_audio(END_WAV)
-                            self.called = False
-                            self.handler.handle(self.query)
-                        self.query = None
-                time.sleep(0.1)
+                self.process(self.queries.get())
 
         except KeyboardInterrupt:
-            logging.info("Shutting down...")
-            self.shutdown_flag.set()
-            self.handler.save_cache()
-            self.handler.llm.session.close()
-            self.handler.llm.unload_model()
-
-            files = glob.glob("*_temp.wav")
-            for file in files:
-                os.remove(file)
-
-            if self.speech_thread:
-                self.speech_thread.join()
-            logging.info("All threads terminated.")
+            self.shutdown()
 
 if __name__ == '__main__':
     core = Core()
@@ -0,0 +1,117 @@
+# Refresh Handler
+from settings import *
+from collections import OrderedDict
+from contextlib import contextmanager
+
+class RefreshScheduler:
+    """
+    Runs background cache refreshes on a fixed number of worker threads.
+    Refreshes are keyed by intent: a key that is already queued or running, or that was
+    refreshed less than interval seconds ago, is dropped. While a foreground stream is
+    active no refresh starts, and running ones are cancelled and queued again.
+    """
+    def __init__(self, workers=REFRESH_WORKERS, interval=REFRESH_INTERVAL,
+                 max_pending=REFRESH_QUEUE_SIZE, on_cancel=None):
+        self.interval = interval
+        self.max_pending = max_pending
+        self.on_cancel = on_cancel
+        self.pending = OrderedDict()  # key -> (func, args)
+        self.running = {}             # key -> (func, args, cancel event)
+        self.last_run = {}            # key -> time of the last completed refresh
+        self.foreground_count = 0
+        self.closed = False
+        self.condition = threading.Condition()
+        self.counts = dict.fromkeys(
+            ('submitted', 'completed', 'cancelled', 'failed', 'duplicate', 'too_recent', 'queue_full'), 0)
+        self.threads = [threading.Thread(target=self._run, daemon=True) for _ in range(workers)]
+        for thread in self.threads:
+            thread.start()
+
+    def submit(self, key, func, *args):
+        """
+        Queues func(*args, cancel=event) to refresh key.
+
+        Returns:
+            bool: Whether the refresh was queued.
+        """
+        with self.condition:
+            if self.closed:
+                return False
+            if key in self.pending or key in self.running:
+                reason = 'duplicate'
+            elif time.monotonic() - self.last_run.get(key, float('-inf')) < self.interval:
+                reason = 'too_recent'
+            elif len(self.pending) >= self.max_pending:
+                reason = 'queue_full'
+            else:
+                self.pending[key] = (func, args)
+                self.counts['submitted'] += 1
+                self.condition.notify()
+                return True
+            self.counts[reason] += 1
+            return False
+
+    @contextmanager
+    def foreground(self):
+        """Holds off background refreshes, cancelling running ones, for the duration of the block."""
+        with self.condition:
+            self.foreground_count += 1
+            running = [cancel for _, _, cancel in self.running.values()]
+            for cancel in running:
+                cancel.set()
+        if running and self.on_cancel:
+            self.on_cancel()
+        try:
+            yield
+        finally:
+            with self.condition:
+                self.foreground_count -= 1
+                self.condition.notify_all()
+
+    def _run(self):
+        while True:
+            with self.condition:
+                while not self.closed and (not self.pending or self.foreground_count):
+                    self.condition.wait()
+                if self.closed:
+                    return
+                key, (func, args) = self.pending.popitem(last=False)
+                cancel = threading.Event()
+                self.running[key] = (func, args, cancel)
+
+            failed = False
+            try:
+                func(*args, cancel=cancel)
+            except Exception as e:
+                failed = True
+                logging.error(f"Background refresh of {key} failed: {e}")
+
+            with self.condition:
+                del self.running[key]
+                if cancel.is_set():
+                    self.counts['cancelled'] += 1
+                    if not self.closed and key not in self.pending:
+                        # run it again once the foreground is done
+                        self.pending[key] = (func, args)
+                        self.pending.move_to_end(key, last=False)
+                else:
+                    self.counts['failed' if failed else 'completed'] += 1
+                    self.last_run[key] = time.monotonic()
+
+    def stats(self):
+        """Returns refresh counters and the current queue depth."""
+        with self.condition:
+            return dict(self.counts, pending=len(self.pending), running=len(self.running))
+
+    def close(self, timeout=5):
+        """Cancels running refreshes, drops queued ones and stops the workers."""
+        with self.condition:
+            self.closed = True
+            self.pending.clear()
+            for _, _, cancel in self.running.values():
+                cancel.set()
+            self.condition.notify_all()
+        if self.on_cancel:
+            self.on_cancel()
+        for thread in self.threads:
+            thread.join(timeout)
@@ -4,11 +4,10 @@ from nltk.corpus import stopwords
 from nltk.stem import PorterStemmer
 from llm_handler import LlmHandler
 from settings import *
-from cache_handler import LRUCache, LFUCache
+from cache_handler import LRUCache, LFUCache, CacheStore
+from intent_handler import IntentIndex
+from refresh_handler import RefreshScheduler
 import hashlib
-from bs4 import BeautifulSoup
-import tkinter as tk
-from tkinter import simpledialog
 from dotenv import load_dotenv
 import base64
 
@@ -19,13 +18,27 @@ class ResponseHandler:
     Handles response caching and retrieval for the chatbot.
     Uses LRU (Least Recently Used) and LFU (Least Frequently Used) caching strategies
     to optimize response storage and reuse.
+    A handler created with shared uses that handler's caches, store, refresher and
+    LLM connection, keeping only the conversation state (mode, level, score and
+    context) to itself, as the sessions of the server do.
     """
-    def __init__(self, core):
+    def __init__(self, core, shared=None, score_file="score.txt"):
         self.core = core
+        self.shared = shared
         self.sim = False
-        self.lru_cache = LRUCache(MAX_LRU_SIZE)
-        self.lfu_cache = LFUCache(MAX_LFU_SIZE)
-        self.score_file = "score.txt"
+        if shared:
+            self.lru_cache = shared.lru_cache
+            self.lfu_cache = shared.lfu_cache
+            self.intent_index = shared.intent_index
+            self.cache_lock = shared.cache_lock
+        else:
+            self.lru_cache = LRUCache(MAX_LRU_SIZE, on_update=self.persist_lru,
+                                      on_evict=lambda key: self.store.delete('lru', key))
+            self.lfu_cache = LFUCache(MAX_LFU_SIZE, MAX_LFU_BYTES, on_update=self.persist_lfu,
+                                      on_evict=self.evict_lfu)
+            self.intent_index = IntentIndex(INTENT_MATCH_THRESHOLD)
+            self.cache_lock = threading.Lock()
+        self.score_file = score_file
         self.score = 0
         self.pos_points = 0
         self.neg_points = 0
@@ -38,22 +51,28 @@ class ResponseHandler:
 
     def on_init(self):
         """Initializes the necessary components for the class instance."""
-        self.llm = LlmHandler()
-        self.cache = self.load_cache()
-        self.stemmer = PorterStemmer()
+        tracer = self.core.tracer if self.core else None
+        if self.shared:
+            shared = self.shared
+            self.llm = LlmHandler(tracer=tracer, session=shared.llm.session, slots=shared.llm.slots)
+            self.refresher = shared.refresher
+            self.store = shared.store
+            self.stemmer = shared.stemmer
+        else:
+            self.llm = LlmHandler(tracer=tracer)
+            self.refresher = RefreshScheduler(on_cancel=self.llm.cancel)
+            self.store = CacheStore(CACHE_DB, CACHE_FLUSH_INTERVAL)
+            self.cache = self.load_cache()
+            self.stemmer = PorterStemmer()
         self.high_score = self.load_score()
 
     def get_text_input(self, prompt):
-        """Creates a temporary popup to take user input and return the text."""
-        root = tk.Tk()
-        root.withdraw()
-        user_input = simpledialog.askstring("Input", prompt)
-        root.destroy()
-        return user_input
+        """Asks the user for text through the UI and returns it."""
+        return self.core.cli.ask(prompt)
 
     def load_score(self):
-        """Loads score from score.txt, defaulting to 0 if file is missing."""
-        if os.path.exists(self.score_file):
+        """Loads score from score.txt, defaulting to 0 if file is missing or no score file is kept."""
+        if self.score_file and os.path.exists(self.score_file):
             try:
                 with open(self.score_file, "r") as file:
                     return int(file.read().strip())
@@ -85,6 +104,8 @@ class ResponseHandler:
 
     def save_score(self):
         """Saves the current score to score.txt."""
+        if not self.score_file:
+            return
         with open(self.score_file, "w") as file:
             file.write(str(self.score))
 
@@ -92,6 +113,7 @@ class ResponseHandler:
         """Updates score and saves it to score.txt."""
         self.score += value
         self.save_score()
+        self.core.cli.refresh_score()
 
     @staticmethod
     def hash_query(query):
@@ -99,21 +121,34 @@ class ResponseHandler:
         return hashlib.md5(query.encode()).hexdigest()
 
     def load_cache(self):
-        """Loads cached responses from file, initializing LRU and LFU caches."""
-        if not os.path.exists(CACHE_FILE):
-            with open(CACHE_FILE, 'w') as file:
-                json.dump({'lru': {}, 'lfu': {}}, file)
-            return
+        """Loads cached responses from the cache store, initializing LRU and LFU caches."""
+        if self.store.import_json(CACHE_FILE):
+            logging.info(f"Imported {CACHE_FILE} into {CACHE_DB}")
 
-        with open(CACHE_FILE, 'r') as file:
-            data = json.load(file)
-            self.lru_cache.load(data.get('lru', {}))
-            self.lfu_cache.load(data.get('lfu', {}))
+        data = self.store.load()
+        self.lru_cache.load(data.get('lru', {}))
+        self.lfu_cache.load(data.get('lfu', {}))
+        for intent in self.lfu_cache.cache:
+            self.intent_index.add(intent)
 
     def save_cache(self):
-        """Saves the current cache state to a file."""
-        with open(CACHE_FILE, 'w') as file:
-            json.dump({'lru': self.lru_cache.to_dict(), 'lfu': self.lfu_cache.to_dict()}, file)
+        """Blocks until all pending cache changes are written to the store."""
+        self.store.flush()
+
+    def persist_lru(self, key):
+        """Queues the current LRU entry for a key to be written to the store."""
+        if key in self.lru_cache.cache:
+            self.store.put('lru', key, self.lru_cache.cache[key])
+
+    def persist_lfu(self, key):
+        """Queues the current LFU entry and frequency for a key to be written to the store."""
+        if key in self.lfu_cache.cache:
+            self.store.put('lfu', key, self.lfu_cache.cache[key], self.lfu_cache.freq[key])
+
+    def evict_lfu(self, key):
+        """Drops an evicted LFU intent from the store and the intent index."""
+        self.store.delete('lfu', key)
+        self.intent_index.remove(key)
 
     def extract_key_phrases(self, query):
         """Extracts key phrases from the query using stemming and removes stop words."""
@@ -127,26 +162,45 @@ class ResponseHandler:
             result.pop(0)
         return result
 
-    def fetch_and_store(self, query, query_hash, intent):
-        """Fetches a fresh response from the LLM and stores it in the cache."""
+    def fetch_and_store(self, query, query_hash, intent, cancel=None):
+        """Fetches a fresh response from the LLM and stores it in the cache, unless cancelled."""
         new_response = []
-        for chunk in self.llm.get_response(query):
+        # cache refreshes stay out of the conversation context
+        for chunk in self.llm.get_response(query, cancel=cancel, remember=False):
             if chunk.strip():
                 new_response.append(chunk)
 
+        if cancel is not None and cancel.is_set():
+            return
         new_response = ' '.join(new_response)
         self.add_response(query, query_hash, intent, new_response)
 
     def add_response(self, query, query_hash, intent, response):
         """Adds a response to the LFU cache under the given intent and updates the LRU cache."""
-        existing_responses = self.lfu_cache.get(intent) or []
+        with self.cache_lock:
+            existing_responses = self.lfu_cache.get(intent) or []
+
+            if response not in existing_responses:
+                existing_responses.append(response)
+                self.lfu_cache.put(intent, existing_responses)
+                if intent in self.lfu_cache.cache:
+                    self.intent_index.add(intent)
 
-        if response not in existing_responses:
-            existing_responses.append(response)
-            self.lfu_cache.put(intent, existing_responses)
+            self.lru_cache.put(query_hash, {'intent': intent})
 
-        self.lru_cache.put(query_hash, {'intent': intent})
-        self.save_cache()
+    def parse_query(self, query):
+        """
+        Normalizes a query and derives its cache keys.
+
+        Returns:
+            tuple: (normalized query, query hash for the LRU cache, intent name for the LFU cache)
+        """
+        query = self.replace_words_with_numbers(query)
+        return query, self.hash_query(query.lower()), '.'.join(self.extract_key_phrases(query))
+
+    def split_sentences(self, response):
+        """Splits a cached response into the sentences that are spoken one by one."""
+        return re.split(r'(?<=[.!?])\s+', response)
 
     def replace_words_with_numbers(self, text):
         pattern = re.compile(r'\b(' + '|'.join(WORD_TO_NUM.keys()) + r')\b', re.IGNORECASE)
@@ -162,6 +216,8 @@ class ResponseHandler:
             self.core.queue("Failed to fetch dark web results.")
             return
 
+        # dark web searches are rare, so bs4 isn't imported at startup
+        from bs4 import BeautifulSoup
         soup = BeautifulSoup(response.text, "html.parser")
         links = [a["href"] for a in soup.find_all("a", href=True)][:limit]
 
@@ -180,10 +236,12 @@ class ResponseHandler:
         - Uses the last response tracking to avoid immediate repetition.
         - Fetches a new response in the background while serving a cached response.
         """
-        query = self.replace_words_with_numbers(query)
-        query_hash = self.hash_query(query.lower())
-        cached_data = self.lru_cache.get(query_hash) or self.lfu_cache.get(query_hash)
-        intent_name = '.'.join(self.extract_key_phrases(query))
+        tracer = self.core.tracer
+        query, query_hash, intent_name = self.parse_query(query)
+        with tracer.span("cache_lookup") as span:
+            with self.cache_lock:
+                cached_data = self.lru_cache.get(query_hash) or self.lfu_cache.get(query_hash)
+            span["hit"] = bool(cached_data)
 
         if "help" in intent_name:
             self.core.cli.print_help_text()
@@ -191,13 +249,13 @@ class ResponseHandler:
         elif "uncensor" in intent_name and self.uncensored == False:
             self.uncensored = True
             self.core.queue(f"{NAME} has been uncensored.")
-            self.llm.prompt = f"{UNCENSORED_PROMPT}"
+            self.llm.set_mode("uncensored", f"{UNCENSORED_PROMPT}")
             return
 
         elif "censor" in intent_name and self.uncensored == True:
             self.uncensored = False
             self.core.queue(f"{NAME} has been censored.")
-            self.llm.prompt = f"{GEN_PROMPT}"
+            self.llm.set_mode("general", f"{GEN_PROMPT}")
             return
 
         elif any(word in intent_name for word in ("dark.web", "tor", "onion")) and any(word in intent_name for word in ("scan", "lookup", "search")):
@@ -210,7 +268,7 @@ class ResponseHandler:
 
         if not self.sim:
             if any(word in intent_name for word in ("start", "run")) and any(word in intent_name for word in ("attack", "test", "simul")):
-                self.llm.prompt = f"{SIM_PROMPT} \nLEVEL: {self.level}"
+                self.llm.set_mode("simulation", f"{SIM_PROMPT} \nLEVEL: {self.level}")
                 self.sim = True
 
             if any(word in intent_name for word in ("scenario", "simul", "scene", "attack")) and any(word in intent_name for word in ("build", "creat")):
@@ -251,22 +309,32 @@ class ResponseHandler:
 
             if any(word in intent_name for word in ("stop", "close")) and any(word in intent_name for word in ("attack", "test", "simul")):
                 if not self.uncensored:
-                    self.llm.prompt = GEN_PROMPT
+                    self.llm.set_mode("general", GEN_PROMPT)
                 else:
-                    self.llm.prompt = UNCENSORED_PROMPT
+                    self.llm.set_mode("uncensored", UNCENSORED_PROMPT)
                 self.sim = False
 
+        if not cached_data and not self.sim:
+            # fall back to the closest cached intent for paraphrased queries
+            with tracer.span("intent_match") as span:
+                similar_intent, _ = self.intent_index.match(intent_name)
+                span["hit"] = bool(similar_intent)
+            if similar_intent:
+                cached_data = {'intent': similar_intent}
+
         if cached_data and not self.sim:
             detected_intent = cached_data['intent']
-            cached_responses = self.lfu_cache.get(detected_intent) or []
+            with self.cache_lock:
+                cached_responses = list(self.lfu_cache.get(detected_intent) or [])
 
             if len(cached_responses) >= 2:
-                last_used = self.lru_cache.get('last_used_response')
-                possible_responses = [res for res in cached_responses if res != last_used] if len(cached_responses) > 1 else cached_responses
-                selected_response = random.choice(possible_responses)
-                self.lru_cache.put('last_used_response', selected_response)
+                with self.cache_lock:
+                    last_used = self.lru_cache.get('last_used_response')
+                    possible_responses = [res for res in cached_responses if res != last_used] if len(cached_responses) > 1 else cached_responses
+                    selected_response = random.choice(possible_responses)
+                    self.lru_cache.put('last_used_response', selected_response)
 
-                sentences = re.split(r'(?<=[.!?])\s+', selected_response)
+                sentences = self.split_sentences(selected_response)
                 response = []
                 for sentence in sentences:
                     self.core.queue(sentence, display=False)
@@ -274,42 +342,49 @@ class ResponseHandler:
                 response = ' '.join(response)
                 self.core.cli.print_assistant_response(response)
 
-                threading.Thread(target=self.fetch_and_store, args=(query, query_hash, detected_intent)).start()
+                # refreshes run on the owner's LLM client, whose streams the refresher can cancel
+                owner = self.shared or self
+                self.refresher.submit(detected_intent, owner.fetch_and_store, query, query_hash, detected_intent)
                 return
 
         response = []
-        for chunk in self.llm.get_response(query):
-            if chunk.strip():
-                if self.sim:
-                    if 'WIN' in chunk:
-                        self.pos_points += 1
-                        self.neg_points = 0
-                        self.update_score(1)
-                    elif 'LOSE' in chunk:
-                        self.neg_points += 1
-                        self.pos_points = 0
-                        self.update_score(-1)
-                    chunk = chunk.replace("LOSE", "")
-                    chunk = chunk.replace("WIN", "")
-
-                    if self.score > self.high_score:
-                        self.high_score = self.score
-
-                    # Increase level if WIN 2 times in a row and vice versa
-                    if self.pos_points >= 2:
-                        self.pos_points = 0
-                        self.level += 1
-                    elif self.neg_points >= 2:
-                        self.neg_points = 0
-                        self.level -= 1
-
-                self.core.queue(chunk, display=False)
-                response.append(chunk)
+        # background refreshes hold off while the user is waiting on this stream
+        with self.refresher.foreground():
+            for chunk in self.llm.get_response(query, cancel=self.core.interrupted, turn=tracer.turn):
+                if chunk.strip():
+                    if self.sim:
+                        if 'WIN' in chunk:
+                            self.pos_points += 1
+                            self.neg_points = 0
+                            self.update_score(1)
+                        elif 'LOSE' in chunk:
+                            self.neg_points += 1
+                            self.pos_points = 0
+                            self.update_score(-1)
+                        chunk = chunk.replace("LOSE", "")
+                        chunk = chunk.replace("WIN", "")
+
+                        if self.score > self.high_score:
+                            self.high_score = self.score
+
+                        # Increase level if WIN 2 times in a row and vice versa
+                        if self.pos_points >= 2:
+                            self.pos_points = 0
+                            self.level += 1
+                        elif self.neg_points >= 2:
+                            self.neg_points = 0
+                            self.level -= 1
+
+                    self.core.queue(chunk, display=False)
+                    response.append(chunk)
 
         response = ' '.join(response)
+        if self.core.interrupted.is_set():
+            # the user spoke over the answer, so it is neither finished nor worth caching
+            return
         if response == "":
             self.core.queue("I'm not sure how to answer that.")
         self.core.cli.print_assistant_response(response)
 
         if not self.sim:
-            threading.Thread(target=self.add_response, args=(query, query_hash, intent_name, response)).start()
+            self.add_response(query, query_hash, intent_name, response)
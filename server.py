@@ -0,0 +1,618 @@
+# Blossom Server
+"""
+Headless multi-session server.
+
+XTTS, the Vosk model, the response caches and the LLM connection are loaded once
+and shared by every client. Each connection gets a lightweight session with its
+own simulation state, level, score, prompt mode and conversation context.
+Speech synthesis runs on a small worker pool that takes the sessions in turn,
+and LLM streams are capped across sessions, so one long answer can't starve the
+others.
+
+Clients connect over TCP or a Unix socket and exchange frames of a one-byte type
+and a four-byte big-endian length, followed by the payload:
+  A  audio. Client to server: 16-bit mono PCM at SAMPLING_RATE, ideally
+     FRAMES_PER_BUFFER samples per frame. Server to client: one clip, as a
+     '!IBBB' header (rate, channels, sample width, cue flag) and its PCM.
+  T  client text: a typed query, or the reply to an 'ask' event
+  J  server JSON event: ready, wake, user, assistant, ask, score, cancel, done, error
+  Q  client is closing
+
+Usage: python server.py [--host 127.0.0.1] [--port 8765] [--unix path] [--max-sessions 16]
+                        [--llm-streams 2] [--tts-workers 1]
+"""
+from settings import *
+from res_handler import ResponseHandler
+from tts_handler import TtsHandler, TtsPool
+from asr_handler import WakeMatcher, SpeechRecognizer, TwoStageRecognizer, VoiceActivityGate, recognize
+from audio_handler import AudioClip
+from cache_handler import AudioCache
+from trace_handler import Tracer, TurnTracer
+from collections import OrderedDict, deque
+from vosk import Model
+import torch
+import argparse
+import itertools
+import queue
+import socket
+import socketserver
+import struct
+
+FRAME = struct.Struct('!cI')
+CLIP = struct.Struct('!IBBB')
+MAX_FRAME = 16 * 1024 * 1024
+
+def write_frame(file, kind, payload=b""):
+    """Writes one frame to a binary file object."""
+    file.write(FRAME.pack(kind, len(payload)))
+    if payload:
+        file.write(payload)
+    file.flush()
+
+def read_frame(file):
+    """
+    Reads one frame from a binary file object.
+
+    Returns:
+        tuple: (type, payload), or (None, b"") once the connection is closed.
+    """
+    header = file.read(FRAME.size)
+    if len(header) < FRAME.size:
+        return None, b""
+    kind, length = FRAME.unpack(header)
+    if length > MAX_FRAME:
+        raise ValueError(f"Frame of {length} bytes exceeds the limit")
+    payload = file.read(length)
+    if len(payload) < length:
+        return None, b""
+    return kind, payload
+
+def encode_clip(clip, cue=False):
+    """Returns the payload of an audio frame sent to the client."""
+    return CLIP.pack(clip.rate, clip.channels, clip.sampwidth, cue) + clip.data
+
+def decode_clip(payload):
+    """Returns (AudioClip, cue) from the payload of an audio frame sent by the server."""
+    rate, channels, sampwidth, cue = CLIP.unpack_from(payload)
+    return AudioClip(payload[CLIP.size:], rate, channels, sampwidth), bool(cue)
+
+
+class FairScheduler:
+    """
+    Runs jobs from many sessions on a few worker threads, taking the sessions in turn.
+    A session's jobs run one at a time in the order they were submitted, so its
+    sentences stay in order, while a session with a long answer queued only gets
+    every other turn of a worker when someone else is waiting.
+    """
+    def __init__(self, workers=SERVER_TTS_WORKERS):
+        self.queues = OrderedDict()  # session -> deque of (func, args), in round-robin order
+        self.busy = set()            # sessions with a job running
+        self.closed = False
+        self.condition = threading.Condition()
+        self.counts = dict.fromkeys(('submitted', 'completed', 'failed', 'cancelled'), 0)
+        self.threads = [threading.Thread(target=self._run, daemon=True) for _ in range(workers)]
+        for thread in self.threads:
+            thread.start()
+
+    def submit(self, key, func, *args):
+        """Queues func(*args) behind the session's earlier jobs."""
+        with self.condition:
+            if self.closed:
+                return False
+            jobs = self.queues.get(key)
+            if jobs is None:
+                jobs = self.queues[key] = deque()
+            jobs.append((func, args))
+            self.counts['submitted'] += 1
+            self.condition.notify()
+            return True
+
+    def cancel(self, key):
+        """Drops the jobs a session still has queued and returns how many there were."""
+        with self.condition:
+            jobs = self.queues.get(key)
+            if jobs is None:
+                return 0
+            count = len(jobs)
+            jobs.clear()
+            if key not in self.busy:
+                del self.queues[key]
+            self.counts['cancelled'] += count
+            return count
+
+    def _next(self):
+        """Takes the first job of the first idle session, moving that session to the back."""
+        for key, jobs in self.queues.items():
+            if jobs and key not in self.busy:
+                func, args = jobs.popleft()
+                self.queues.move_to_end(key)
+                self.busy.add(key)
+                return key, func, args
+        return None
+
+    def _run(self):
+        while True:
+            with self.condition:
+                job = None
+                while not self.closed and (job := self._next()) is None:
+                    self.condition.wait()
+                if self.closed:
+                    return
+            key, func, args = job
+            failed = False
+            try:
+                func(*args)
+            except Exception as e:
+                failed = True
+                logging.error(f"Scheduled job of session {key} failed: {e}")
+            with self.condition:
+                self.busy.discard(key)
+                if not self.queues.get(key, True):
+                    del self.queues[key]
+                self.counts['failed' if failed else 'completed'] += 1
+                self.condition.notify_all()
+
+    def stats(self):
+        """Returns job counters and the current queue depth."""
+        with self.condition:
+            return dict(self.counts, queued=sum(len(jobs) for jobs in self.queues.values()),
+                        running=len(self.busy))
+
+    def close(self, timeout=5):
+        """Drops queued jobs and stops the workers."""
+        with self.condition:
+            self.closed = True
+            self.queues.clear()
+            self.condition.notify_all()
+        for thread in self.threads:
+            thread.join(timeout)
+
+
+class SessionUI:
+    """Stands in for CliUI, sending what would be printed to the client as events."""
+    def __init__(self, session):
+        self.session = session
+
+    def print_help_text(self):
+        self.session.send_event('assistant', text=HELP_TEXT)
+
+    def print_assistant_response(self, text):
+        self.session.send_event('assistant', text=str(text))
+
+    def print_user_input(self, text):
+        self.session.send_event('user', text=text)
+
+    def refresh_score(self):
+        handler = self.session.handler
+        self.session.send_event('score', score=handler.score, high_score=handler.high_score,
+                                level=handler.level, sim=handler.sim)
+
+    def ask(self, prompt):
+        return self.session.ask(prompt)
+
+    def stop(self):
+        pass
+
+
+class Session:
+    """
+    One client connection.
+    Stands in for Core towards its own ResponseHandler: answers are queued sentence by
+    sentence, synthesized on the server's shared scheduler and sent back in order.
+    Speech is recognized on the connection's thread with a recognizer of its own on
+    the shared Vosk model, and queries are answered on a worker thread.
+    """
+    def __init__(self, server, session_id, connection, rfile, wfile):
+        self.server = server
+        self.id = session_id
+        self.connection = connection
+        self.rfile = rfile
+        self.wfile = wfile
+        self.send_lock = threading.Lock()
+        self.lock = threading.Lock()
+        self.called = False
+        self.wake_cued = False
+        self.turn = 0           # bumped to drop the sentences of a cancelled answer
+        self.answer_turn = 0    # turn of the answer being generated, captured when it starts
+        self.pending = 0        # sentences queued or being synthesized
+        self.first_audio_turn = None
+        self.remainder = b""
+        self.warned = False
+        self.interrupted = threading.Event()
+        self.answering = threading.Event()
+        self.asking = threading.Event()
+        self.disconnected = threading.Event()
+        self.queries = queue.Queue()
+        self.answers = queue.Queue()  # replies to ask()
+        self.tracer = TurnTracer(server.tracer)
+        self.cli = SessionUI(self)
+        self.handler = ResponseHandler(self, shared=server.handler, score_file=None)
+        self.recognizer = server.new_recognizer()
+        self.vad = VoiceActivityGate(SAMPLING_RATE) if VAD_ENABLED and self.recognizer else None
+        self.worker = threading.Thread(target=self.answer_queries, daemon=True)
+
+    def send(self, kind, payload=b""):
+        """Sends a frame, returning False once the client has gone away."""
+        if self.disconnected.is_set():
+            return False
+        try:
+            with self.send_lock:
+                write_frame(self.wfile, kind, payload)
+            return True
+        except (OSError, ValueError):
+            self.disconnected.set()
+            self.interrupted.set()
+            return False
+
+    def send_event(self, event, **fields):
+        return self.send(b'J', json.dumps(dict(fields, event=event)).encode())
+
+    def send_clip(self, clip, cue=False):
+        return self.send(b'A', encode_clip(clip, cue))
+
+    def ask(self, prompt):
+        """Asks the client for text and waits for the reply."""
+        while not self.answers.empty():
+            self.answers.get_nowait()
+        self.asking.set()
+        try:
+            self.send_event('ask', prompt=prompt)
+            return self.answers.get(timeout=SERVER_ASK_TIMEOUT)
+        except queue.Empty:
+            return None
+        finally:
+            self.asking.clear()
+
+    def run(self):
+        """Serves the connection until the client closes it."""
+        self.send_event('ready', session=self.id, rate=SAMPLING_RATE, asr=self.recognizer is not None)
+        self.worker.start()
+        try:
+            while not self.disconnected.is_set():
+                kind, payload = read_frame(self.rfile)
+                if kind is None or kind == b'Q':
+                    break
+                if kind == b'A':
+                    self.feed(payload)
+                elif kind == b'T':
+                    self.on_text(payload.decode('utf-8', 'replace').strip())
+        except (OSError, ValueError) as e:
+            logging.info(f"Session {self.id} disconnected: {e}")
+        finally:
+            self.close()
+
+    def feed(self, pcm):
+        """Runs a chunk of client audio through the voice activity gate and the recognizer."""
+        if self.recognizer is None:
+            if not self.warned:
+                self.warned = True
+                self.send_event('error', message="Speech recognition is not available, send text instead.")
+            return
+        data = self.remainder + pcm
+        cut = len(data) - len(data) % 2
+        data, self.remainder = data[:cut], data[cut:]
+        for event, text in recognize(self.recognizer, self.vad, data):
+            self.on_speech_event(event, text)
+
+    def on_text(self, text):
+        """Takes typed text as the reply to a pending prompt, or as a query."""
+        if self.asking.is_set():
+            self.answers.put(text)
+        elif text:
+            self.queries.put(text)
+
+    def on_speech_event(self, event, text):
+        """Reacts to a ('wake' | 'final', text) event from the recognizer."""
+        if BARGE_IN and self.answer_in_progress() and self.server.wake_matcher.match(text) is not None:
+            self.cancel_answer()
+
+        if event == 'wake' and not self.wake_cued:
+            self.tracer.begin_turn()
+            self.tracer.event("wake")
+            self.wake_cued = True
+            self.send_event('wake', text=text)
+            self.send_clip(self.server.cues[START_WAV], cue=True)
+        elif event == 'final':
+            self.cli.print_user_input(text)
+            # open the turn before a query can be dispatched, and drop it if nobody was talking to us
+            started = self.tracer.begin_turn() if self.tracer.turn is None else None
+            if self.detect_call(text) or started is None:
+                self.tracer.event("asr_final", words=len(text.split()))
+            else:
+                self.tracer.drop_turn(started)
+            self.wake_cued = False
+
+    def detect_call(self, text):
+        """
+        Checks an utterance for the wake phrase and dispatches the query that follows it.
+
+        Returns:
+            bool: Whether the utterance was addressed to the assistant.
+        """
+        query = self.server.wake_matcher.match(text)
+        if query is not None:
+            if len(query.split()) < 2:
+                # wait for the query in the next utterance
+                self.called = True
+                if not self.wake_cued:
+                    self.send_clip(self.server.cues[START_WAV], cue=True)
+            else:
+                self.called = False
+                self.queries.put(query)
+            return True
+        elif self.called:
+            self.called = False
+            self.queries.put(text.lower().strip())
+            return True
+        return False
+
+    def answer_in_progress(self):
+        """Whether an answer is being generated or synthesized."""
+        return self.answering.is_set() or self.pending > 0
+
+    def cancel_answer(self):
+        """Cancels the answer in progress: the LLM stream and the sentences not yet sent."""
+        self.tracer.event("barge_in")
+        with self.lock:
+            self.turn += 1
+            self.pending -= self.server.scheduler.cancel(self.id)
+            self.interrupted.set()
+        self.handler.llm.cancel()
+        self.send_event('cancel')
+
+    def queue(self, text, display=True):
+        """Queues a sentence of the answer for synthesis, unless the answer was cancelled."""
+        with self.lock:
+            if self.interrupted.is_set() or self.answer_turn != self.turn:
+                return
+            self.pending += 1
+            self.server.scheduler.submit(self.id, self.speak, self.answer_turn, text, self.tracer.turn)
+        if display:
+            self.cli.print_assistant_response(text)
+
+    def speak(self, turn, text, trace):
+        """Synthesizes a sentence and sends it to the client, unless its answer was cancelled meanwhile."""
+        try:
+            if turn == self.turn and not self.disconnected.is_set():
+                with self.tracer.span("tts", trace, chars=len(text)):
+                    clip = self.server.synthesize(text)
+                # under the lock, a cancel either follows this clip or makes the check drop it
+                with self.lock:
+                    sent = turn == self.turn and self.send_clip(clip)
+                if sent and trace != self.first_audio_turn:
+                    self.first_audio_turn = trace
+                    self.tracer.event("first_audio", trace)
+        except Exception as e:
+            logging.error(f"TTS error in session {self.id}: {e}")
+        finally:
+            with self.lock:
+                self.pending -= 1
+            self.finish_turn()
+
+    def finish_turn(self):
+        """Ends the turn once its answer has been generated and every sentence sent."""
+        with self.lock:
+            if self.tracer.turn is None or self.answering.is_set() or self.pending:
+                return
+            self.tracer.end_turn()
+        self.send_event('done')
+
+    def process(self, query):
+        """Answers one query."""
+        if self.tracer.turn is None:
+            self.tracer.begin_turn()
+        self.tracer.event("dispatch")
+        with self.lock:
+            self.answer_turn = self.turn
+            self.interrupted.clear()
+        self.answering.set()
+        try:
+            self.send_clip(self.server.cues[END_WAV], cue=True)
+            with self.tracer.span("handle"):
+                self.handler.handle(query)
+        except Exception as e:
+            logging.error(f"Session {self.id} failed to answer {query!r}: {e}")
+            self.send_event('error', message=f"Failed to answer the query: {e}")
+        finally:
+            self.answering.clear()
+            self.finish_turn()
+
+    def answer_queries(self):
+        while True:
+            query = self.queries.get()
+            if query is None:
+                break
+            if not self.disconnected.is_set():
+                self.process(query)
+
+    def disconnect(self):
+        """Closes the connection from the server side, which ends run()."""
+        try:
+            self.connection.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+    def close(self):
+        """Cancels the answer in progress and stops the session's worker."""
+        self.disconnected.set()
+        self.interrupted.set()
+        with self.lock:
+            self.turn += 1
+            self.pending -= self.server.scheduler.cancel(self.id)
+        self.handler.llm.cancel()
+        self.answers.put(None)
+        self.queries.put(None)
+        self.worker.join()
+        self.tracer.drop_turn()
+
+
+class TcpListener(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+if hasattr(socketserver, "ThreadingUnixStreamServer"):
+    class UnixListener(socketserver.ThreadingUnixStreamServer):
+        daemon_threads = True
+
+
+class Server:
+    """
+    Loads the models and caches once and serves sessions over TCP or a Unix socket.
+    A TTS handler and a Vosk model can be passed in to replace XTTS and the model
+    on disk, and speech recognition can be left out for text-only clients, as the
+    load test does.
+    """
+    def __init__(self, tts=None, model=None, asr=True, max_sessions=SERVER_MAX_SESSIONS,
+                 llm_streams=SERVER_LLM_STREAMS, tts_workers=SERVER_TTS_WORKERS):
+        self.max_sessions = max_sessions
+        self.ids = itertools.count(1)
+        self.sessions = {}  # id -> Session, or None while it is being set up
+        self.condition = threading.Condition()
+        self.listener = None
+        self.path = None
+        self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+        self.tts = tts or TtsHandler(self.device)
+        self.tts_pool = None
+        if TTS_WORKERS and TtsPool.supports(self.tts):
+            self.tts_pool = TtsPool(self.tts)
+        elif TTS_WORKERS:
+            logging.warning("TTS_WORKERS is ignored on a GPU, sentences are synthesized in-process.")
+        self.tracer = Tracer(TRACE_FILE, metrics_file=METRICS_FILE)
+        self.tracer.open_turns = max(self.tracer.open_turns, 2 * max_sessions)
+        self.model = (model or self.load_vosk_model()) if asr else None
+        self.audio_cache = AudioCache(AUDIO_CACHE_DIR, AUDIO_CACHE_MEMORY_BYTES, AUDIO_CACHE_DISK_BYTES)
+        self.cues = {path: AudioClip.from_wav(path) for path in (START_WAV, END_WAV)}
+        self.wake_matcher = WakeMatcher(NAME, CALL_WORDS)
+        self.handler = ResponseHandler(None, score_file=None)
+        self.handler.llm.slots = threading.BoundedSemaphore(llm_streams)
+        # enough scheduler threads to keep every pool worker busy
+        self.scheduler = FairScheduler(max(tts_workers, len(self.tts_pool) if self.tts_pool else 0))
+        self.tracer.add_gauges('sessions', lambda: {'active': self.stats()['sessions']})
+        self.tracer.add_gauges('tts_queue', self.scheduler.stats)
+        self.tracer.add_gauges('audio_cache', self.audio_cache.stats)
+
+    def load_vosk_model(self):
+        """Loads the Vosk speech recognition model."""
+        if not os.path.exists(VOSK_MODEL):
+            raise SystemExit(f'Model not found at {VOSK_MODEL}, please check the path.')
+        return Model(VOSK_MODEL)
+
+    def new_recognizer(self):
+        """Creates a session's recognizer on the shared model, or None without speech recognition."""
+        if self.model is None:
+            return None
+        if TWO_STAGE_ASR:
+            return TwoStageRecognizer(self.model, SAMPLING_RATE, self.wake_matcher)
+        return SpeechRecognizer(self.model, SAMPLING_RATE, self.wake_matcher)
+
+    def synthesize(self, text):
+        """Renders a sentence with the shared TTS model or pool, reusing cached audio."""
+        if self.tts_pool:
+            return self.tts_pool.submit(text, SPEAKER_WAV, self.audio_cache).result()
+        return self.tts.render(text, SPEAKER_WAV, self.audio_cache)
+
+    def run_session(self, connection, rfile, wfile):
+        """Serves one connection, turning it away when the server is full."""
+        with self.condition:
+            full = len(self.sessions) >= self.max_sessions
+            if not full:
+                session_id = next(self.ids)
+                self.sessions[session_id] = None
+        if full:
+            try:
+                write_frame(wfile, b'J', json.dumps({"event": "error", "message": "Server is full."}).encode())
+            except OSError:
+                pass
+            return
+
+        try:
+            session = Session(self, session_id, connection, rfile, wfile)
+            with self.condition:
+                self.sessions[session_id] = session
+            logging.info(f"Session {session_id} opened, {len(self.sessions)} active")
+            session.run()
+        finally:
+            with self.condition:
+                del self.sessions[session_id]
+                self.condition.notify_all()
+            logging.info(f"Session {session_id} closed")
+
+    def listen(self, host=SERVER_HOST, port=SERVER_PORT, path=SERVER_SOCKET):
+        """Binds the listening socket and returns its address."""
+        server = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def setup(self):
+                super().setup()
+                if self.connection.family in (socket.AF_INET, socket.AF_INET6):
+                    self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+            def handle(self):
+                server.run_session(self.connection, self.rfile, self.wfile)
+
+        if path:
+            if os.path.exists(path):
+                os.unlink(path)
+            self.path = path
+            self.listener = UnixListener(path, Handler)
+        else:
+            self.listener = TcpListener((host, port), Handler)
+        return self.listener.server_address
+
+    def serve(self):
+        """Accepts connections until close() is called, serving each on its own thread."""
+        self.listener.serve_forever()
+
+    def stats(self):
+        """Returns the number of active sessions and the synthesis queue counters."""
+        with self.condition:
+            active = len(self.sessions)
+        return {'sessions': active, 'tts': self.scheduler.stats()}
+
+    def close(self, timeout=5):
+        """Disconnects every session and releases the shared models and caches."""
+        if self.listener:
+            self.listener.shutdown()
+            self.listener.server_close()
+            if self.path and os.path.exists(self.path):
+                os.unlink(self.path)
+        with self.condition:
+            sessions = [session for session in self.sessions.values() if session]
+        for session in sessions:
+            session.disconnect()
+        with self.condition:
+            self.condition.wait_for(lambda: not self.sessions, timeout)
+        logging.info(f"Server: {self.stats()}")
+        self.scheduler.close()
+        if self.tts_pool:
+            self.tts_pool.close()
+        self.tracer.close()
+        self.handler.refresher.close()
+        logging.info(f"Background refreshes: {self.handler.refresher.stats()}")
+        self.handler.store.close()
+        self.handler.llm.session.close()
+        logging.info(f"Audio cache: {self.audio_cache.stats()}")
+
+def main():
+    parser = argparse.ArgumentParser(description=f"Serve {NAME} to many clients with one set of loaded models")
+    parser.add_argument("--host", default=SERVER_HOST)
+    parser.add_argument("--port", type=int, default=SERVER_PORT)
+    parser.add_argument("--unix", default=SERVER_SOCKET, help="listen on this Unix socket instead of TCP")
+    parser.add_argument("--max-sessions", type=int, default=SERVER_MAX_SESSIONS)
+    parser.add_argument("--llm-streams", type=int, default=SERVER_LLM_STREAMS, help="LLM streams in flight at once")
+    parser.add_argument("--tts-workers", type=int, default=SERVER_TTS_WORKERS, help="threads synthesizing speech")
+    args = parser.parse_args()
+
+    server = Server(max_sessions=args.max_sessions, llm_streams=args.llm_streams, tts_workers=args.tts_workers)
+    address = server.listen(args.host, args.port, args.unix)
+    print(f"{NAME} server listening on {address}")
+    try:
+        server.serve()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+        server.handler.llm.unload_model()
+
+if __name__ == '__main__':
+    main()
@@ -26,6 +26,16 @@ logging.basicConfig(
 )
 logging.getLogger().setLevel(logging.CRITICAL)
 
+# -------------------------------
+# Tracing Configuration
+# -------------------------------
+TRACING = True # Record per-turn stage timings, independent of the log level
+TRACE_FILE = "traces/trace.jsonl" # Rotating JSONL file of spans and events
+TRACE_MAX_BYTES = 10 * 1024 * 1024 # Size at which the trace file is rotated
+TRACE_BACKUPS = 3 # Rotated trace files to keep
+METRICS_FILE = "traces/metrics.prom" # Prometheus text snapshot, rewritten after every turn
+METRICS_PORT = None # Serve the metrics at http://127.0.0.1:PORT/metrics (None = file only)
+
 # -------------------------------
 # Assistant Settings
 # -------------------------------
@@ -33,6 +43,12 @@ NAME = "Blossom" # Name of the assistant
 CALL_WORDS = [
     "he", "a", "hey", "okay", "hi", "hello", "yo", "listen", "attention", "are you there"
 ]
+WAKE_ON_PARTIAL = True # Play the wake cue from partial recognition results, before the utterance ends
+TWO_STAGE_ASR = True # Listen with a wake-phrase grammar and run the full recognizer only after a wake
+WAKE_WINDOW_SECONDS = 8.0 # Seconds without speech before the full recognizer goes idle again
+WAKE_PREROLL_CHUNKS = 4 # Audio chunks replayed into the full recognizer after a wake
+BARGE_IN = True # Keep listening while answering, so a new wake phrase cancels the answer
+ECHO_HISTORY = 8 # Recently spoken sentences used to ignore the assistant's own voice as barge-in
 HELP_TEXT = """
 Modes:
   - GEN_MODE: General AI Assistant (Default).
@@ -70,8 +86,24 @@ TTS_MODEL = "tts_models/multilingual/multi-dataset/xtts_v2" # Text-to-speech mod
 SAMPLING_RATE = 16000 # Audio sampling rate (Hz)
 CHUNK_SIZE = 1024 # Size of each audio chunk
 FRAMES_PER_BUFFER = 4096 # Buffer size for audio processing
-EXCEPTION_ON_OVERFLOW = False # Prevent exceptions on buffer overflow
+CAPTURE_RING_SECONDS = 10 # Seconds of microphone audio the capture ring buffer can hold
+ASR_PROCESS = False # Run speech recognition in a child process fed through shared memory
+ASR_STATS_INTERVAL = 5.0 # Seconds between the voice activity counters the recognizer process sends back
 RATE = 16000 # Audio rate (should match SAMPLING_RATE)
+VAD_ENABLED = True # Skip the recognizer for silent audio chunks
+VAD_FRAME_MS = 20 # Frame length used for energy and zero-crossing analysis (ms)
+VAD_MARGIN_DB = 9.0 # Energy above the adaptive noise floor that counts as voice (dB)
+VAD_MAX_ZCR = 0.35 # Zero-crossing rate above which moderate energy is treated as noise
+VAD_HANGOVER_CHUNKS = 4 # Chunks still decoded after speech stops, so utterances can end
+VAD_PREROLL_CHUNKS = 2 # Silent chunks kept and replayed when speech starts
+TTS_CPU_PROFILE = False # Tune XTTS for CPU-only machines: thread settings, inference mode, optional int8, warm-up
+TTS_THREADS = None # Torch intra-op threads for TTS (None = the cores left after Ollama's NUM_THREAD)
+TTS_INTEROP_THREADS = 1 # Torch inter-op threads for TTS
+TTS_QUANTIZE = False # Dynamic int8 quantization of the XTTS linear layers (CPU profile only)
+TTS_WARMUP_PASSES = 2 # Sentences synthesized at startup so the first answer isn't the slowest
+TTS_WORKERS = 0 # TTS worker processes synthesizing sentences in parallel (0 = one sentence at a time in-process)
+TTS_WORKER_THREADS = 1 # Torch threads per TTS worker; keep TTS_WORKERS * TTS_WORKER_THREADS within the free cores
+TTS_POOL_START = "forkserver" # "forkserver" or "spawn"; every worker loads its own copy of the model (CPU only)
 SPEED_UP = False
 SPEED_THRESHOLD = 200
 
@@ -81,15 +113,20 @@ SPEED_THRESHOLD = 200
 EXCLUDED_PREFIXES = ("tell", "say", "find", "search", "look") # Words to ignore at first index
 MAX_LRU_SIZE = 1000 # Max size for Least Recently Used (LRU) cache
 MAX_LFU_SIZE = 5000 # Max size for Least Frequently Used (LFU) cache
+MAX_LFU_BYTES = None # Optional cap on total LFU cache size in bytes (None = unlimited)
+INTENT_MATCH_THRESHOLD = 0.55 # Min TF-IDF cosine similarity to reuse a cached intent for a paraphrase
+REFRESH_WORKERS = 1 # Background threads refreshing cached answers
+REFRESH_INTERVAL = 300 # Min seconds between background refreshes of the same intent
+REFRESH_QUEUE_SIZE = 32 # Max refreshes waiting to run; further ones are dropped
 STARTING_LEVEL = 1
 DARK_WEB_SEARCH_URL = "https://onionsearchengine.com/search"
 
 # -------------------------------
 # LLM Configuration
 # -------------------------------
+OLLAMA_URL = "http://localhost:11434"  # Base URL of the Ollama server
 LLM_MODEL = "llama3.2:1b"  # Language model identifier
 KEEP_ALIVE = 5  # Keep-alive time for the model in minutes
-CONTEXT = [1, 2, 3]  # Context window configuration
 NUM_KEEP = 5  # Number of context tokens to persist
 TEMPERATURE = 1.0  # Controls randomness in response generation
 TOP_K = 20  # Limits probability sampling to the top-K most likely tokens
@@ -105,6 +142,9 @@ MIROSTAT_TAU = 0.8  # Controls stability of Mirostat sampling
 MIROSTAT_ETA = 0.6  # Learning rate for Mirostat
 PENALIZE_NEWLINE = True  # Apply penalties to newline characters
 NUM_CTX = 1024  # Context length in tokens
+NUM_PREDICT = None  # Maximum tokens generated per answer (None = no limit)
+CONTEXT_MARGIN = 192  # Tokens kept free in NUM_CTX for the next query and a typical answer
+CONTEXT_TOKEN_BUDGET = NUM_CTX - CONTEXT_MARGIN  # Conversation context kept between turns before starting afresh
 NUM_BATCH = 2  # Batch size for model processing
 NUM_GPU = 1  # Number of GPUs to use
 MAIN_GPU = 0  # Designated primary GPU ID
@@ -112,14 +152,31 @@ USE_MMAP = True  # Memory-mapped file usage for model loading
 USE_MLOCK = False  # Prevents memory swapping (requires root privileges)
 NUM_THREAD = 8  # Number of CPU threads allocated for processing
 
+# -------------------------------
+# Server Configuration
+# -------------------------------
+SERVER_HOST = "127.0.0.1"  # Address the multi-session server listens on
+SERVER_PORT = 8765  # TCP port of the multi-session server
+SERVER_SOCKET = None  # Unix socket path to listen on instead of TCP (None = TCP)
+SERVER_MAX_SESSIONS = 16  # Connections served at once; further ones are turned away
+SERVER_LLM_STREAMS = 2  # LLM streams in flight across sessions (match OLLAMA_NUM_PARALLEL)
+SERVER_TTS_WORKERS = 1  # Threads synthesizing speech, taking the sessions in turn
+SERVER_ASK_TIMEOUT = 120  # Seconds a session waits for the client to answer a text prompt
+
 # -------------------------------
 # File Paths
 # -------------------------------
 VOSK_MODEL = "vosk-model"  # Path to the Vosk speech recognition model
 SPEAKER_WAV = "audio/speaker.wav"  # Path to the speaker voice sample
+SPEAKER_LATENTS_DIR = "latents"  # Directory for cached speaker conditioning latents
+AUDIO_CACHE_DIR = "audio_cache"  # Directory for cached synthesized speech
+AUDIO_CACHE_MEMORY_BYTES = 64 * 1024 * 1024  # In-memory audio cache budget
+AUDIO_CACHE_DISK_BYTES = 512 * 1024 * 1024  # On-disk audio cache budget
 START_WAV = "audio/start.wav"  # Path to start sound
 END_WAV = "audio/end.wav"  # Path to end sound
-CACHE_FILE = "cache.json"  # Path to the cache file for stored data
+CACHE_FILE = "cache.json"  # Legacy cache file, imported into CACHE_DB once
+CACHE_DB = "cache.db"  # Path to the SQLite cache store
+CACHE_FLUSH_INTERVAL = 0.5  # Seconds the cache writer batches changes before committing
 
 # -------------------------------
 # Assistant Prompt Configuration
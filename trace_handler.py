@@ -0,0 +1,254 @@
+# Trace Handler
+from settings import *
+from contextlib import contextmanager
+from logging.handlers import RotatingFileHandler
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import bisect
+import itertools
+import queue
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+class Tracer:
+    """
+    Per-turn stage tracing.
+    Spans and events carry the ID of the turn they belong to. Recording one only builds a
+    dict and updates a histogram; a writer thread appends the records to a rotating JSONL
+    file. The histograms, and gauges read from registered stats() callables, are exported
+    as Prometheus text to a file after every turn and, if a port is set, over HTTP at /metrics.
+    Events are measured from the start of their turn, spans by their own duration.
+    """
+    def __init__(self, path=TRACE_FILE, max_bytes=TRACE_MAX_BYTES, backups=TRACE_BACKUPS,
+                 metrics_file=METRICS_FILE, metrics_port=METRICS_PORT, enabled=TRACING):
+        self.enabled = enabled
+        self.metrics_file = metrics_file
+        self.ids = itertools.count(1)
+        self.turn = None        # turn in progress
+        self.turn_starts = {}   # turn -> perf_counter() at its start
+        self.open_turns = 16    # turns kept open at once, more when sessions run side by side
+        self.histograms = {}    # (kind, name) -> [bucket counts, sum, count]
+        self.gauges = {}        # metric prefix -> callable returning a dict of counters
+        self.lock = threading.Lock()
+        self.records = queue.SimpleQueue()
+        self.server = None
+        self.thread = None
+        if not enabled:
+            return
+
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.handler = RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backups, encoding="utf-8")
+        self.handler.setFormatter(logging.Formatter("%(message)s"))
+        self.thread = threading.Thread(target=self._write, daemon=True)
+        self.thread.start()
+        if metrics_port:
+            self.serve(metrics_port)
+
+    def begin_turn(self):
+        """Starts a new turn and returns its ID."""
+        turn = next(self.ids)
+        with self.lock:
+            self.turn = turn
+            self.turn_starts[turn] = time.perf_counter()
+            # forget turns that never ended, such as a wake without a query
+            while len(self.turn_starts) > self.open_turns:
+                self.turn_starts.pop(next(iter(self.turn_starts)))
+        return turn
+
+    def drop_turn(self, turn):
+        """Forgets a turn without recording it."""
+        with self.lock:
+            self.turn_starts.pop(turn, None)
+            if turn == self.turn:
+                self.turn = None
+
+    def end_turn(self, turn=None):
+        """Records the total duration of a turn and exports the metrics."""
+        with self.lock:
+            turn = turn or self.turn
+            start = self.turn_starts.pop(turn, None)
+            if turn == self.turn:
+                self.turn = None
+        if start is not None:
+            self.record('span', 'turn', start, time.perf_counter(), turn)
+            if self.enabled:
+                self.records.put(None)
+
+    def record(self, kind, name, start, end, turn=None, **attrs):
+        """Records a span or event given its perf_counter() start and end."""
+        if not self.enabled:
+            return
+        seconds = end - start
+        with self.lock:
+            histogram = self.histograms.get((kind, name))
+            if histogram is None:
+                histogram = self.histograms[(kind, name)] = [[0] * (len(BUCKETS) + 1), 0.0, 0]
+            histogram[0][bisect.bisect_left(BUCKETS, seconds)] += 1
+            histogram[1] += seconds
+            histogram[2] += 1
+        attrs.update(turn=turn, kind=kind, name=name, ms=round(seconds * 1e3, 3),
+                     at=time.time() - (time.perf_counter() - start))
+        self.records.put(attrs)
+
+    def event(self, name, turn=None, **attrs):
+        """Records a point in time, measured from the start of its turn, if that turn is still open."""
+        if not self.enabled:
+            return
+        turn = turn or self.turn
+        start = self.turn_starts.get(turn)
+        if start is None:
+            # without its turn's start the event has no latency, only a 0 ms sample
+            return
+        self.record('event', name, start, time.perf_counter(), turn, **attrs)
+
+    @contextmanager
+    def span(self, name, turn=None, **attrs):
+        """Records the duration of the enclosed block."""
+        turn = turn or self.turn
+        start = time.perf_counter()
+        try:
+            yield attrs
+        finally:
+            self.record('span', name, start, time.perf_counter(), turn, **attrs)
+
+    def add_gauges(self, prefix, stats):
+        """Exports the numeric values returned by stats() as blossom_<prefix>_<key> gauges."""
+        with self.lock:
+            self.gauges[prefix] = stats
+
+    def metrics(self):
+        """Returns the histograms in the Prometheus text exposition format."""
+        lines = []
+        with self.lock:
+            histograms = sorted((key, [list(value[0]), value[1], value[2]]) for key, value in self.histograms.items())
+            gauges = sorted(self.gauges.items())
+        for kind in ('span', 'event'):
+            metric = f"blossom_{kind}_seconds"
+            entries = [(name, value) for (entry_kind, name), value in histograms if entry_kind == kind]
+            if not entries:
+                continue
+            help_text = "Duration of turn stages" if kind == 'span' else "Time from the start of the turn to each event"
+            lines.append(f"# HELP {metric} {help_text}.")
+            lines.append(f"# TYPE {metric} histogram")
+            for name, (counts, total, count) in entries:
+                cumulative = 0
+                for bound, bucket in zip(BUCKETS + (float('inf'),), counts):
+                    cumulative += bucket
+                    le = "+Inf" if bound == float('inf') else repr(bound)
+                    lines.append(f'{metric}_bucket{{{kind}="{name}",le="{le}"}} {cumulative}')
+                lines.append(f'{metric}_sum{{{kind}="{name}"}} {total:.6f}')
+                lines.append(f'{metric}_count{{{kind}="{name}"}} {count}')
+        for prefix, stats in gauges:
+            try:
+                values = stats()
+            except Exception as e:
+                logging.warning(f"Failed to read {prefix} stats: {e}")
+                continue
+            for key, value in sorted(values.items()):
+                if isinstance(value, bool) or not isinstance(value, (int, float)):
+                    continue
+                metric = f"blossom_{prefix}_{key}"
+                lines.append(f"# TYPE {metric} gauge")
+                lines.append(f"{metric} {value}")
+        return "\n".join(lines) + "\n"
+
+    def write_metrics(self):
+        """Writes the metrics snapshot file atomically."""
+        if not self.metrics_file:
+            return
+        try:
+            os.makedirs(os.path.dirname(self.metrics_file) or '.', exist_ok=True)
+            temp_path = f"{self.metrics_file}.tmp"
+            with open(temp_path, "w") as file:
+                file.write(self.metrics())
+            os.replace(temp_path, self.metrics_file)
+        except OSError as e:
+            logging.warning(f"Failed to write metrics: {e}")
+
+    def _write(self):
+        while True:
+            record = self.records.get()
+            if record is None:
+                # end of a turn
+                self.write_metrics()
+                continue
+            if record is False:
+                break
+            try:
+                self.handler.emit(logging.makeLogRecord({"msg": json.dumps(record)}))
+            except (TypeError, ValueError) as e:
+                logging.warning(f"Dropping unserializable trace record: {e}")
+
+    def serve(self, port, host="127.0.0.1"):
+        """Serves the metrics at http://host:port/metrics on a background thread."""
+        tracer = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                if self.path != "/metrics":
+                    self.send_error(404)
+                    return
+                body = tracer.metrics().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        """Flushes the pending records, writes the final metrics and stops the server."""
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+        if self.thread:
+            self.records.put(None)
+            self.records.put(False)
+            self.thread.join()
+            self.handler.close()
+
+
+class TurnTracer:
+    """
+    One session's view of a shared Tracer.
+    Keeps the session's own turn in progress, so concurrent sessions record their
+    spans and events under separate turns into the same file and histograms.
+    """
+    def __init__(self, tracer):
+        self.tracer = tracer
+        self.turn = None
+
+    def begin_turn(self):
+        """Starts a new turn for this session and returns its ID."""
+        self.turn = self.tracer.begin_turn()
+        return self.turn
+
+    def drop_turn(self, turn=None):
+        """Forgets a turn without recording it."""
+        turn = turn or self.turn
+        if turn == self.turn:
+            self.turn = None
+        if turn is not None:
+            self.tracer.drop_turn(turn)
+
+    def end_turn(self, turn=None):
+        """Records the total duration of a turn and exports the metrics."""
+        turn = turn or self.turn
+        if turn == self.turn:
+            self.turn = None
+        if turn is not None:
+            self.tracer.end_turn(turn)
+
+    def record(self, kind, name, start, end, turn=None, **attrs):
+        self.tracer.record(kind, name, start, end, turn or self.turn, **attrs)
+
+    def event(self, name, turn=None, **attrs):
+        self.tracer.event(name, turn or self.turn, **attrs)
+
+    def span(self, name, turn=None, **attrs):
+        return self.tracer.span(name, turn or self.turn, **attrs)
@@ -0,0 +1,413 @@
+# TTS Handler
+from settings import *
+from TTS.api import TTS
+from audio_handler import AudioClip
+from concurrent.futures import Future
+from functools import partial
+import torch
+import hashlib
+import itertools
+import multiprocessing
+import signal
+import queue
+import numpy as np
+
+def cpu_threads(threads=TTS_THREADS):
+    """Returns the torch threads for TTS: TTS_THREADS, or the cores Ollama's NUM_THREAD leaves free."""
+    return threads or max(1, (os.cpu_count() or 1) - NUM_THREAD)
+
+def set_torch_threads(threads, interop=TTS_INTEROP_THREADS):
+    """Sets torch's intra-op threads, and its inter-op threads if they can still be changed."""
+    torch.set_num_threads(threads)
+    try:
+        torch.set_num_interop_threads(interop)
+    except RuntimeError:
+        # only possible before the first inter-op parallel work
+        logging.debug("Torch inter-op threads were already set")
+
+def conv1d_to_linear(module):
+    """
+    Replaces the Conv1D layers of GPT-2 blocks, which are linear layers with transposed
+    weights, by nn.Linear, so dynamic quantization covers them too.
+    """
+    for name, child in module.named_children():
+        if type(child).__name__ == "Conv1D" and hasattr(child, "nf"):
+            linear = torch.nn.Linear(child.weight.shape[0], child.nf)
+            linear.weight.data = child.weight.data.t().contiguous()
+            linear.bias.data = child.bias.data
+            setattr(module, name, linear)
+        else:
+            conv1d_to_linear(child)
+
+
+class TtsHandler:
+    """
+    Wraps the XTTS model for speech synthesis.
+    Speaker conditioning latents are computed once per speaker WAV, kept in memory
+    and stored on disk under a hash of the WAV contents, so later sentences and
+    later runs skip the conditioning step.
+    On a CPU device, the CPU profile sets torch's threads so they leave Ollama's cores
+    alone, runs synthesis in inference mode, optionally quantizes the linear layers
+    to int8 and synthesizes a few warm-up sentences.
+    """
+    def __init__(self, device, model_name=TTS_MODEL, latents_dir=SPEAKER_LATENTS_DIR, cpu_profile=TTS_CPU_PROFILE):
+        self.device = device
+        self.model_name = model_name
+        self.latents_dir = latents_dir
+        self.tts = TTS(model_name=model_name, progress_bar=False).to(device)
+        self.latents = {}       # content hash -> (gpt_cond_latent, speaker_embedding)
+        self.file_hashes = {}   # path -> (mtime, size, content hash)
+        self.lock = threading.Lock()
+        self.inference_mode = False
+        self.quantized = False
+        if cpu_profile and torch.device(device).type == "cpu":
+            self.tune_for_cpu()
+
+    def tune_for_cpu(self, threads=TTS_THREADS, quantize=TTS_QUANTIZE, warmup=TTS_WARMUP_PASSES):
+        """Applies the CPU inference profile."""
+        set_torch_threads(cpu_threads(threads))
+        self.inference_mode = True
+        if quantize:
+            self.quantize()
+        self.warm_up(warmup)
+
+    def quantize(self):
+        """
+        Dynamically quantizes the model's linear layers to int8, in place.
+        Cached latents and audio of the full-precision model are kept apart by the model name.
+        """
+        if self.quantized:
+            return
+        engines = torch.backends.quantized.supported_engines
+        engine = next((engine for engine in ("x86", "fbgemm", "qnnpack") if engine in engines), None)
+        if engine is None:
+            logging.warning("No quantized engine available, keeping full-precision weights")
+            return
+        torch.backends.quantized.engine = engine
+        conv1d_to_linear(self.model)
+        torch.ao.quantization.quantize_dynamic(self.model, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+        self.quantized = True
+        self.model_name = f"{self.model_name}+int8"
+        with self.lock:
+            self.latents.clear()
+            self.file_hashes.clear()
+
+    def worker_factory(self):
+        """Returns a picklable callable that loads this handler's equivalent in a TTS worker process."""
+        model_name = self.model_name[:-len("+int8")] if self.quantized else self.model_name
+        return partial(load_worker_tts, str(self.device), model_name, self.latents_dir,
+                       self.inference_mode, self.quantized)
+
+    def warm_up(self, passes=TTS_WARMUP_PASSES, speaker_wav=SPEAKER_WAV):
+        """Synthesizes a short sentence a few times, so one-time allocations happen before the first answer."""
+        for _ in range(passes):
+            self.synthesize("Warming up the voice.", speaker_wav)
+
+    @property
+    def model(self):
+        """The underlying TTS model instance."""
+        return self.tts.synthesizer.tts_model
+
+    @property
+    def sample_rate(self):
+        """Output sample rate of the synthesized audio."""
+        return self.tts.synthesizer.output_sample_rate
+
+    @property
+    def supports_latents(self):
+        """Whether the model exposes XTTS-style speaker conditioning."""
+        return hasattr(self.model, "get_conditioning_latents")
+
+    def conditioning_args(self):
+        """Returns the conditioning arguments XTTS itself uses when synthesizing from a speaker WAV."""
+        config = self.model.config
+        return {
+            "gpt_cond_len": config.gpt_cond_len,
+            "gpt_cond_chunk_len": config.gpt_cond_chunk_len,
+            "max_ref_length": config.max_ref_len,
+            "sound_norm_refs": config.sound_norm_refs,
+        }
+
+    def speaker_hash(self, speaker_wav):
+        """
+        Hashes the model name, the conditioning arguments and the speaker WAV contents,
+        reusing the hash while the file is unchanged.
+        """
+        stat = os.stat(speaker_wav)
+        cached = self.file_hashes.get(speaker_wav)
+        if cached and cached[:2] == (stat.st_mtime, stat.st_size):
+            return cached[2]
+
+        digest = hashlib.sha256(self.model_name.encode())
+        if self.supports_latents:
+            digest.update(json.dumps(self.conditioning_args(), sort_keys=True).encode())
+        with open(speaker_wav, 'rb') as file:
+            for block in iter(lambda: file.read(1 << 16), b""):
+                digest.update(block)
+        key = digest.hexdigest()
+        self.file_hashes[speaker_wav] = (stat.st_mtime, stat.st_size, key)
+        return key
+
+    def conditioning(self, speaker_wav):
+        """Returns the (gpt_cond_latent, speaker_embedding) pair for a speaker WAV."""
+        key = self.speaker_hash(speaker_wav)
+        with self.lock:
+            if key in self.latents:
+                return self.latents[key]
+
+            path = os.path.join(self.latents_dir, f"{key}.pt")
+            latents = None
+            if os.path.exists(path):
+                try:
+                    data = torch.load(path, map_location=self.device)
+                    latents = (data["gpt_cond_latent"], data["speaker_embedding"])
+                except Exception as e:
+                    logging.warning(f"Ignoring unreadable speaker latents {path}: {e}")
+
+            if latents is None:
+                latents = self.model.get_conditioning_latents(audio_path=[speaker_wav], **self.conditioning_args())
+                try:
+                    os.makedirs(self.latents_dir, exist_ok=True)
+                    temp_path = f"{path}.tmp"
+                    torch.save({"gpt_cond_latent": latents[0].cpu(), "speaker_embedding": latents[1].cpu()}, temp_path)
+                    os.replace(temp_path, path)
+                except OSError as e:
+                    logging.warning(f"Failed to store speaker latents: {e}")
+
+            self.latents[key] = latents
+            return latents
+
+    def synthesize(self, text, speaker_wav=SPEAKER_WAV, language="en"):
+        """
+        Synthesizes text and returns float32 samples at sample_rate.
+        Sentences are synthesized separately and joined with short pauses,
+        matching what the TTS synthesizer does.
+        """
+        with torch.inference_mode(self.inference_mode):
+            return self._synthesize(text, speaker_wav, language)
+
+    def _synthesize(self, text, speaker_wav, language):
+        if not self.supports_latents:
+            return np.asarray(self.tts.tts(text, speaker_wav=speaker_wav, language=language), dtype=np.float32)
+
+        gpt_cond_latent, speaker_embedding = self.conditioning(speaker_wav)
+        config = self.model.config
+        pause = np.zeros(10000, dtype=np.float32)
+        parts = []
+        for sentence in self.tts.synthesizer.split_into_sentences(text):
+            output = self.model.inference(
+                sentence, language, gpt_cond_latent, speaker_embedding,
+                temperature=config.temperature,
+                length_penalty=config.length_penalty,
+                repetition_penalty=config.repetition_penalty,
+                top_k=config.top_k,
+                top_p=config.top_p)
+            wav = output["wav"]
+            if torch.is_tensor(wav):
+                wav = wav.squeeze().cpu().numpy()
+            parts.extend((np.asarray(wav, dtype=np.float32), pause))
+
+        if not parts:
+            return np.zeros(0, dtype=np.float32)
+        return np.concatenate(parts[:-1])
+
+    @staticmethod
+    def render_speed(text, speed):
+        """Returns the speed text is rendered at: only long text is sped up, and only when SPEED_UP is set."""
+        return speed if len(text) > SPEED_THRESHOLD and SPEED_UP else 1.0
+
+    def cache_key(self, text, speaker_wav, audio_cache, speed):
+        """Returns the audio cache key of text rendered at speed."""
+        return audio_cache.key(text, self.speaker_hash(speaker_wav), speed, self.model_name)
+
+    def render(self, text, speaker_wav=SPEAKER_WAV, audio_cache=None, speed=1.1):
+        """
+        Returns text as an in-memory AudioClip, reusing cached audio when an AudioCache is given.
+        Long text is sped up without affecting pitch when SPEED_UP is set.
+        """
+        speed = self.render_speed(text, speed)
+        key = None
+        if audio_cache is not None:
+            key = self.cache_key(text, speaker_wav, audio_cache, speed)
+            clip = audio_cache.get(key)
+            if clip is not None:
+                return clip
+
+        samples = self.synthesize(text, speaker_wav=speaker_wav)
+
+        # Speed up audio
+        if speed != 1.0:
+            # librosa is slow to import and only needed with SPEED_UP
+            import librosa
+            samples = librosa.effects.time_stretch(samples, rate=speed)
+
+        clip = AudioClip.from_float(samples, self.sample_rate)
+        if key is not None:
+            audio_cache.put(key, clip)
+        return clip
+
+
+def load_worker_tts(device, model_name, latents_dir, inference_mode, quantized):
+    """Loads a TTS worker's own copy of the model with the parent's inference profile."""
+    tts = TtsHandler(torch.device(device), model_name, latents_dir, cpu_profile=False)
+    tts.inference_mode = inference_mode
+    if quantized:
+        tts.quantize()
+    if inference_mode:
+        tts.warm_up()
+    return tts
+
+
+def run_tts_worker(factory, threads, generation, jobs, results):
+    """
+    Worker process entry point: loads a handler with factory(), then renders
+    (job id, generation, text, speaker WAV, speed) jobs and sends back
+    (job id, PCM bytes, rate, error).
+    """
+    # the parent handles Ctrl+C and stops the workers itself
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    torch.set_num_threads(threads)
+    tts = factory()
+    while True:
+        job = jobs.get()
+        if job is None:
+            break
+        job_id, job_generation, text, speaker_wav, speed = job
+        if job_generation != generation.value:
+            results.put((job_id, None, None, None))
+            continue
+        try:
+            clip = tts.render(text, speaker_wav, None, speed)
+            results.put((job_id, clip.data, clip.rate, None))
+        except Exception as e:
+            results.put((job_id, None, None, str(e)))
+
+
+class TtsPool:
+    """
+    Synthesizes sentences in parallel on worker processes.
+    Workers are started with 'forkserver' or 'spawn', never forked from a process that
+    has already run torch (its thread pools can deadlock the child), so every worker
+    loads its own copy of the model with the parent's CPU profile. Speaker latents are
+    cached on disk first, so the workers load them instead of computing them.
+    Workers run on CPU only; on a GPU, synthesize in-process instead.
+    submit() returns a Future per sentence, which callers can wait on in the order
+    the sentences were submitted. Audio cache lookups and stores stay in the calling process.
+    """
+    def __init__(self, tts, workers=TTS_WORKERS, threads=TTS_WORKER_THREADS, start_method=TTS_POOL_START,
+                 speaker_wav=SPEAKER_WAV):
+        if not self.supports(tts):
+            raise ValueError("TtsPool runs on CPU only; synthesize in-process on a GPU")
+        if start_method not in ('forkserver', 'spawn'):
+            raise ValueError(f"Unsupported TTS pool start method: {start_method}")
+        self.tts = tts
+        if start_method not in multiprocessing.get_all_start_methods():
+            start_method = 'spawn'
+        ctx = multiprocessing.get_context(start_method)
+        if tts.supports_latents:
+            tts.conditioning(speaker_wav)
+        self.jobs = ctx.Queue()
+        self.results = ctx.Queue()
+        self.generation = ctx.Value('q', 0)
+        self.ids = itertools.count()
+        self.futures = {}  # job id -> (Future, audio cache, cache key)
+        self.lock = threading.Lock()
+        self.closed = False
+        factory = tts.worker_factory()
+        self.processes = [
+            ctx.Process(target=run_tts_worker,
+                        args=(factory, threads, self.generation, self.jobs, self.results),
+                        daemon=True)
+            for _ in range(workers)]
+        for process in self.processes:
+            process.start()
+        self.thread = threading.Thread(target=self._collect, daemon=True)
+        self.thread.start()
+
+    def __len__(self):
+        return len(self.processes)
+
+    @staticmethod
+    def supports(tts):
+        """Whether a pool can serve the handler, which needs it to run on CPU."""
+        return getattr(tts.device, "type", "cpu") != "cuda"
+
+    def submit(self, text, speaker_wav=SPEAKER_WAV, audio_cache=None, speed=1.1):
+        """Queues text for synthesis and returns a Future of its AudioClip, or of None if cancelled."""
+        future = Future()
+        speed = self.tts.render_speed(text, speed)
+        key = None
+        if audio_cache is not None:
+            key = self.tts.cache_key(text, speaker_wav, audio_cache, speed)
+            clip = audio_cache.get(key)
+            if clip is not None:
+                future.set_result(clip)
+                return future
+
+        with self.lock:
+            if self.closed:
+                future.set_result(None)
+                return future
+            job_id = next(self.ids)
+            self.futures[job_id] = (future, audio_cache, key)
+        self.jobs.put((job_id, self.generation.value, text, speaker_wav, speed))
+        return future
+
+    def cancel(self):
+        """Skips every job submitted so far that no worker has started on."""
+        with self.generation.get_lock():
+            self.generation.value += 1
+
+    def _collect(self):
+        """Resolves futures with the clips coming back from the workers."""
+        while True:
+            try:
+                result = self.results.get(timeout=1.0)
+            except queue.Empty:
+                if not self.closed and not all(process.is_alive() for process in self.processes):
+                    logging.error("A TTS worker exited unexpectedly.")
+                    self._fail_pending(RuntimeError("TTS worker exited"))
+                continue
+            if result is None:
+                break
+            job_id, data, rate, error = result
+            with self.lock:
+                future, audio_cache, key = self.futures.pop(job_id, (None, None, None))
+            if future is None:
+                continue
+            if error is not None:
+                future.set_exception(RuntimeError(error))
+            elif data is None:
+                future.set_result(None)
+            else:
+                clip = AudioClip(data, rate)
+                if key is not None:
+                    audio_cache.put(key, clip)
+                future.set_result(clip)
+
+    def _fail_pending(self, error):
+        with self.lock:
+            pending = list(self.futures.values())
+            self.futures.clear()
+        for future, _, _ in pending:
+            future.set_exception(error)
+
+    def close(self, timeout=5):
+        """Stops the workers, resolving the futures still waiting with None."""
+        with self.lock:
+            self.closed = True
+        self.cancel()
+        for _ in self.processes:
+            self.jobs.put(None)
+        for process in self.processes:
+            process.join(timeout)
+            if process.is_alive():
+                process.terminate()
+                process.join()
+        self.results.put(None)
+        self.thread.join()
+        with self.lock:
+            pending = list(self.futures.values())
+            self.futures.clear()
+        for future, _, _ in pending:
+            future.set_result(None)
@@ -0,0 +1,186 @@
+# Cache Warmer
+"""
+Fills the response cache ahead of time from a file of training questions.
+
+Each question goes through the same normalization and cache keys as
+ResponseHandler.handle. Answers are generated with bounded concurrency until
+every intent has enough cached responses to be served from the cache, and are
+written to the cache store as they arrive. Questions that are already covered
+are skipped, so an interrupted run picks up where it stopped. With --audio, the
+sentences of every cached answer are also synthesized into the audio cache.
+
+Usage: python warm_cache.py questions.txt [--answers 2] [--concurrency 2] [--audio]
+"""
+from settings import *
+from res_handler import ResponseHandler
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import argparse
+
+def read_questions(path):
+    """Reads questions from plain text (one per line) or JSONL ({"query": ...} per line)."""
+    questions = []
+    with open(path, encoding="utf-8") as file:
+        for number, line in enumerate(file, 1):
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            if line.startswith('{'):
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    logging.warning(f"Skipping malformed line {number} of {path}")
+                    continue
+                line = str(record.get("query") or record.get("question") or record.get("text") or "").strip()
+            if line:
+                questions.append(line)
+    return questions
+
+class CacheWarmer:
+    """Generates and stores cached answers for a list of questions."""
+    def __init__(self, handler, answers=2, concurrency=2, renderer=None):
+        self.handler = handler
+        self.answers = answers
+        self.concurrency = concurrency
+        self.renderer = renderer
+        self.cancel = threading.Event()
+        self.counts = dict.fromkeys(('questions', 'skipped', 'answers', 'duplicates', 'failed', 'words', 'sentences'), 0)
+        self.audio_seconds = 0.0
+
+    def missing(self, intent):
+        """Number of answers still needed for an intent."""
+        with self.handler.cache_lock:
+            return max(self.answers - len(self.handler.lfu_cache.cache.get(intent, [])), 0)
+
+    def generate(self, query):
+        """Streams one answer from the LLM without touching the conversation context."""
+        chunks = [chunk for chunk in self.handler.llm.get_response(query, cancel=self.cancel, remember=False)
+                  if chunk.strip()]
+        return ' '.join(chunks)
+
+    def store(self, query, query_hash, intent, response):
+        """Adds an answer to the cache, returning whether it was new."""
+        with self.handler.cache_lock:
+            existing = self.handler.lfu_cache.cache.get(intent, [])
+            is_new = response not in existing
+        self.handler.add_response(query, query_hash, intent, response)
+        return is_new
+
+    def render(self, response):
+        """Synthesizes the sentences of an answer into the audio cache."""
+        for sentence in self.handler.split_sentences(response):
+            if sentence.strip():
+                clip = self.renderer(sentence)
+                self.counts['sentences'] += 1
+                self.audio_seconds += clip.duration
+
+    def run(self, questions):
+        """Warms the cache for every question and returns the elapsed seconds."""
+        parsed = [self.handler.parse_query(question) for question in questions]
+        self.counts['questions'] = len(parsed)
+        jobs, cached, planned = [], [], set()
+        for query, query_hash, intent in parsed:
+            if intent in planned:
+                continue
+            planned.add(intent)
+            needed = self.missing(intent)
+            jobs.extend((query, query_hash, intent) for _ in range(needed))
+            if needed < self.answers:
+                cached.append(intent)
+            if not needed:
+                self.counts['skipped'] += 1
+
+        print(f"{len(parsed)} questions, {len(planned)} intents: {len(jobs)} answers to generate, "
+              f"{self.counts['skipped']} intents already cached")
+        start = time.perf_counter()
+        executor = ThreadPoolExecutor(max_workers=self.concurrency)
+        try:
+            futures = {executor.submit(self.generate, job[0]): job for job in jobs}
+            if self.renderer:
+                # answers cached by an earlier run only need their audio
+                for intent in cached:
+                    with self.handler.cache_lock:
+                        responses = list(self.handler.lfu_cache.cache.get(intent, []))
+                    for response in responses:
+                        self.render(response)
+
+            for done, future in enumerate(as_completed(futures), 1):
+                query, query_hash, intent = futures[future]
+                try:
+                    response = future.result()
+                except Exception as e:
+                    self.counts['failed'] += 1
+                    logging.error(f"Failed to answer '{query}': {e}")
+                    continue
+                if not response:
+                    self.counts['failed'] += 1
+                elif self.store(query, query_hash, intent, response):
+                    self.counts['answers'] += 1
+                    self.counts['words'] += len(response.split())
+                    if self.renderer:
+                        self.render(response)
+                else:
+                    self.counts['duplicates'] += 1
+                if done % 10 == 0:
+                    self.report(time.perf_counter() - start, done, len(futures))
+        except KeyboardInterrupt:
+            print("Interrupted, keeping the answers stored so far.")
+            self.cancel.set()
+            self.handler.llm.cancel()
+            raise
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+            self.link(parsed)
+        return time.perf_counter() - start
+
+    def link(self, parsed):
+        """Points every question's LRU entry at its intent once the intent has cached answers."""
+        with self.handler.cache_lock:
+            for _, query_hash, intent in parsed:
+                if intent in self.handler.lfu_cache.cache:
+                    self.handler.lru_cache.put(query_hash, {'intent': intent})
+
+    def report(self, elapsed, done=None, total=None):
+        """Prints progress and throughput; settings.py keeps the log quiet."""
+        elapsed = max(elapsed, 1e-9)
+        progress = f"{done}/{total} answers, " if total is not None else ""
+        message = (f"{progress}{self.counts['answers'] / elapsed:.2f} answers/s, "
+                   f"{self.counts['words'] / elapsed:.1f} words/s")
+        if self.renderer:
+            message += (f", {self.counts['sentences'] / elapsed:.2f} sentences/s "
+                        f"({self.audio_seconds / elapsed:.2f} s of audio per second)")
+        print(message, flush=True)
+
+def main():
+    parser = argparse.ArgumentParser(description=f"Warm the {NAME} response cache from a file of training questions")
+    parser.add_argument("questions", help="text file with one question per line, or JSONL with a \"query\" field")
+    parser.add_argument("--answers", type=int, default=2, help="cached answers to collect per intent")
+    parser.add_argument("--concurrency", type=int, default=2, help="LLM requests in flight at once")
+    parser.add_argument("--audio", action="store_true", help="also synthesize the answers into the audio cache")
+    args = parser.parse_args()
+
+    handler = ResponseHandler(None)
+    renderer = None
+    if args.audio:
+        import torch
+        from tts_handler import TtsHandler
+        from cache_handler import AudioCache
+        tts = TtsHandler(torch.device("cuda" if torch.cuda.is_available() else "cpu"))
+        audio_cache = AudioCache(AUDIO_CACHE_DIR, AUDIO_CACHE_MEMORY_BYTES, AUDIO_CACHE_DISK_BYTES)
+        renderer = lambda text: tts.render(text, SPEAKER_WAV, audio_cache)
+
+    warmer = CacheWarmer(handler, args.answers, args.concurrency, renderer)
+    elapsed = 0.0
+    start = time.perf_counter()
+    try:
+        elapsed = warmer.run(read_questions(args.questions))
+    except KeyboardInterrupt:
+        elapsed = time.perf_counter() - start
+    finally:
+        handler.refresher.close()
+        handler.store.close()
+        handler.llm.session.close()
+        print(f"Done: {warmer.counts}")
+        warmer.report(elapsed)
+
+if __name__ == '__main__':
+    main()